@@ -22,6 +22,16 @@ from tugastugas import models
 target_metadata = models.Base.metadata
 # target_metadata = None
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leaves the partitions of h_task out of autogenerate.
+
+    They are created by create_h_task_partition, not by the models.
+    """
+    if type_ == "table" and reflected and compare_to is None:
+        return not name.startswith("h_task_")
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -55,6 +65,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -76,7 +87,9 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
@@ -0,0 +1,324 @@
+"""store only modified columns of updates in h_task
+
+Revision ID: 2d7c9e3a5f18
+Revises: 8e1a6f4b2c90
+Create Date: 2026-10-17 06:30:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '2d7c9e3a5f18'
+down_revision: Union[str, None] = '8e1a6f4b2c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# An UPDATE used to copy the whole old row, including the description, into
+# h_task even when only the status changed. The record now holds the old
+# values of the modified columns only (an empty object if nothing changed),
+# and undo_task_action restores just those columns. Existing full-row records
+# are still restored as before.
+AUDIT_FUNCTION = """
+CREATE OR REPLACE FUNCTION audit_task_change() RETURNS TRIGGER AS $$
+DECLARE
+  acting_user_id INT;
+  undoing BOOLEAN;
+  before_image JSONB;
+BEGIN
+  acting_user_id := NULLIF(current_setting('tugastugas.user_id', true), '')::INT;
+  undoing := coalesce(current_setting('tugastugas.undo', true), '') = 'on';
+  IF TG_OP = 'INSERT'
+  THEN
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (NEW.id,
+            1,
+            to_jsonb(NEW),
+            NEW.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  ELSIF TG_OP = 'DELETE'
+  THEN
+    -- Keep the deleted row so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            2,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, OLD.last_modifier_id),
+            undoing);
+  ELSE
+    -- Keep the before-image of the modified columns only, so that they can
+    -- be restored without storing the unchanged ones again
+    SELECT coalesce(jsonb_object_agg(old_column.key, old_column.value),
+                    '{}'::JSONB)
+      INTO before_image
+      FROM jsonb_each(to_jsonb(OLD)) AS old_column
+      JOIN jsonb_each(to_jsonb(NEW)) AS new_column USING (key)
+      WHERE old_column.value IS DISTINCT FROM new_column.value;
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            3,
+            before_image,
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE
+  h_task_id INT;
+  body JSONB;
+  op_type INT;
+  task_id INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  -- (served by ix_h_task_undo)
+  SELECT "id",
+         "data_after_executed_operation",
+         "executed_operation",
+         "target_row_id"::INT
+    INTO h_task_id, body, op_type, task_id
+    FROM h_task
+    WHERE user_id = expect_user_id AND NOT used
+    ORDER BY operation_executed_at DESC
+    LIMIT 1
+    FOR UPDATE;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+    DELETE FROM task WHERE id = task_id;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    INSERT INTO task (id,
+                      title,
+                      description,
+                      due_date,
+                      status,
+                      creator_id,
+                      last_modifier_id,
+                      from_undo)
+    SELECT r.id,
+           r.title,
+           r.description,
+           r.due_date,
+           r.status,
+           r.creator_id,
+           r.last_modifier_id,
+           r.from_undo
+      FROM jsonb_populate_record(NULL::task, body) AS r;
+  ELSIF op_type = 3 AND body <> '{}'::JSONB -- UPDATE
+  THEN
+    -- The record holds the modified columns only; the other columns keep
+    -- their current values, including changes made later by other users
+    UPDATE task
+       SET (title,
+            description,
+            due_date,
+            status,
+            creator_id,
+            last_modifier_id,
+            from_undo) = (SELECT r.title,
+                                 r.description,
+                                 r.due_date,
+                                 r.status,
+                                 r.creator_id,
+                                 r.last_modifier_id,
+                                 r.from_undo
+                            FROM jsonb_populate_record(task, body) AS r)
+     WHERE id = task_id;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_AUDIT_FUNCTION = """
+CREATE OR REPLACE FUNCTION audit_task_change() RETURNS TRIGGER AS $$
+DECLARE
+  acting_user_id INT;
+  undoing BOOLEAN;
+BEGIN
+  acting_user_id := NULLIF(current_setting('tugastugas.user_id', true), '')::INT;
+  undoing := coalesce(current_setting('tugastugas.undo', true), '') = 'on';
+  IF TG_OP = 'INSERT'
+  THEN
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (NEW.id,
+            1,
+            to_jsonb(NEW),
+            NEW.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  ELSIF TG_OP = 'DELETE'
+  THEN
+    -- Keep the deleted row so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            2,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, OLD.last_modifier_id),
+            undoing);
+  ELSE
+    -- Keep the row before the update so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            3,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE
+  h_task_id INT;
+  body JSONB;
+  op_type INT;
+  task_id INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  -- (served by ix_h_task_undo)
+  SELECT "id",
+         "data_after_executed_operation",
+         "executed_operation",
+         "target_row_id"::INT
+    INTO h_task_id, body, op_type, task_id
+    FROM h_task
+    WHERE user_id = expect_user_id AND NOT used
+    ORDER BY operation_executed_at DESC
+    LIMIT 1
+    FOR UPDATE;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+    DELETE FROM task WHERE id = task_id;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    INSERT INTO task (id,
+                      title,
+                      description,
+                      due_date,
+                      status,
+                      creator_id,
+                      last_modifier_id,
+                      from_undo)
+    SELECT r.id,
+           r.title,
+           r.description,
+           r.due_date,
+           r.status,
+           r.creator_id,
+           r.last_modifier_id,
+           r.from_undo
+      FROM jsonb_populate_record(NULL::task, body) AS r;
+  ELSIF op_type = 3 -- UPDATE
+  THEN
+    -- Keys missing from the history record keep their current values
+    UPDATE task
+       SET (title,
+            description,
+            due_date,
+            status,
+            creator_id,
+            last_modifier_id,
+            from_undo) = (SELECT r.title,
+                                 r.description,
+                                 r.due_date,
+                                 r.status,
+                                 r.creator_id,
+                                 r.last_modifier_id,
+                                 r.from_undo
+                            FROM jsonb_populate_record(task, body) AS r)
+     WHERE id = task_id;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    op.execute(DDL(AUDIT_FUNCTION))
+    op.execute(DDL(UNDO_FUNCTION))
+
+
+def downgrade() -> None:
+    op.execute(DDL(PREVIOUS_UNDO_FUNCTION))
+    op.execute(DDL(PREVIOUS_AUDIT_FUNCTION))
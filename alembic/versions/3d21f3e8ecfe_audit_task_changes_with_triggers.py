@@ -0,0 +1,202 @@
+"""audit task changes with triggers
+
+Revision ID: 3d21f3e8ecfe
+Revises: fce4251eee5b
+Create Date: 2026-10-17 04:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '3d21f3e8ecfe'
+down_revision: Union[str, None] = 'fce4251eee5b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The acting user is read from the transaction-local setting
+# tugastugas.user_id, e.g. SELECT set_config('tugastugas.user_id', '1', true).
+# Statements that do not set it, such as maintenance jobs, are attributed to
+# the last modifier of the row. Changes made while undoing are recorded as
+# already used, so undoing never undoes an undo.
+AUDIT_FUNCTION = """
+CREATE OR REPLACE FUNCTION audit_task_change() RETURNS TRIGGER AS $$
+DECLARE
+  acting_user_id INT;
+  undoing BOOLEAN;
+BEGIN
+  acting_user_id := NULLIF(current_setting('tugastugas.user_id', true), '')::INT;
+  undoing := coalesce(current_setting('tugastugas.undo', true), '') = 'on';
+  IF TG_OP = 'INSERT'
+  THEN
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (NEW.id,
+            1,
+            to_jsonb(NEW),
+            NEW.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  ELSIF TG_OP = 'DELETE'
+  THEN
+    -- Keep the deleted row so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            2,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, OLD.last_modifier_id),
+            undoing);
+  ELSE
+    -- Keep the row before the update so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            3,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+UNDO_FUNCTION_TEMPLATE = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE op_type INT;
+DECLARE body JSONB;
+  h_task_id INT;
+  task_id INT;
+  stmt TEXT;
+  k TEXT;
+  v TEXT;
+  stmt_state INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  SELECT "id",
+  	 "data_after_executed_operation",
+	 "executed_operation",
+	 "target_row_id"
+	 INTO h_task_id, body, op_type, task_id
+	 FROM h_task
+     WHERE user_id = expect_user_id AND not used
+	 ORDER BY operation_executed_at DESC
+	 LIMIT 1;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+{begin_undo}
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+     stmt := 'DELETE FROM task WHERE id = ' || quote_literal(task_id);
+     EXECUTE stmt;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    stmt := 'INSERT INTO task(';
+    stmt_state := 1;
+
+    -- Loop through JSON keys and build the INSERT statement for the deleted task
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      IF stmt_state = 1
+      THEN
+        stmt_state := 2;
+      ELSE
+        stmt := stmt || ',';
+      END IF;
+      stmt := stmt || quote_ident(k);
+    END LOOP;
+
+    stmt := stmt || ') VALUES (';
+
+    -- Loop through JSON keys again and add quoted values
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      v := body ->> k;
+      IF stmt_state = 2
+      THEN
+        stmt_state = 3;
+      ELSE
+	stmt := stmt || ',';
+      END IF;
+      stmt := stmt || quote_literal(v);
+    END LOOP;
+
+    stmt := stmt || ')';
+    EXECUTE stmt;
+  ELSIF op_type = 3 -- UPDATE
+  THEN
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      v := body ->> k;
+      IF stmt IS NULL
+      THEN
+        stmt := 'UPDATE task SET ';
+      ELSE
+        stmt := stmt || ', ';
+      END IF;
+      stmt := stmt || quote_ident(k) || ' = ' || quote_literal(v);
+    END LOOP;
+    stmt := stmt || ' WHERE id = ' || quote_literal(task_id);
+    EXECUTE stmt;
+  END IF;
+
+{end_undo}  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+BEGIN_UNDO = """
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+"""
+
+END_UNDO = """  PERFORM set_config('tugastugas.undo', 'off', true);
+
+"""
+
+
+def upgrade() -> None:
+    op.execute(DDL(AUDIT_FUNCTION))
+    op.execute(
+        DDL("""
+CREATE TRIGGER task_audit
+  AFTER INSERT OR UPDATE OR DELETE ON task
+  FOR EACH ROW EXECUTE FUNCTION audit_task_change();
+    """))
+    op.execute(
+        DDL(
+            UNDO_FUNCTION_TEMPLATE.format(begin_undo=BEGIN_UNDO,
+                                          end_undo=END_UNDO)))
+
+
+def downgrade() -> None:
+    op.execute(
+        DDL(UNDO_FUNCTION_TEMPLATE.format(begin_undo="", end_undo="")))
+    op.execute(DDL("DROP TRIGGER task_audit ON task"))
+    op.execute(DDL("DROP FUNCTION audit_task_change"))
@@ -0,0 +1,27 @@
+"""index task title for sorting
+
+Revision ID: 4f9a2c6e8b13
+Revises: 7b3e5a9c1d24
+Create Date: 2026-10-17 08:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4f9a2c6e8b13'
+down_revision: Union[str, None] = '7b3e5a9c1d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Orders by status and due_date are served by the indexes of their
+    # filters (see c359ee40da59).
+    op.create_index('ix_task_title_id', 'task', ['title', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_title_id', table_name='task')
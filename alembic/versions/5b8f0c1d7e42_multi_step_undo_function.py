@@ -0,0 +1,59 @@
+"""multi-step undo function
+
+Revision ID: 5b8f0c1d7e42
+Revises: c359ee40da59
+Create Date: 2026-10-17 05:30:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8f0c1d7e42'
+down_revision: Union[str, None] = 'c359ee40da59'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Repeats undo_task_action inside the database, so reverting a burst of
+# changes takes one statement instead of one request per history record.
+UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_actions(expect_user_id INT,
+                                             max_steps INT,
+                                             until_timestamp TIMESTAMP DEFAULT NULL)
+RETURNS TABLE (op_type INT, task_id INT) AS $$
+DECLARE
+  next_executed_at TIMESTAMP;
+BEGIN
+  FOR step IN 1..max_steps
+  LOOP
+    -- Peek at the record undo_task_action is going to revert
+    -- (served by ix_h_task_undo)
+    SELECT operation_executed_at
+      INTO next_executed_at
+      FROM h_task
+      WHERE user_id = expect_user_id AND NOT used
+      ORDER BY operation_executed_at DESC
+      LIMIT 1;
+    EXIT WHEN next_executed_at IS NULL
+           OR next_executed_at < until_timestamp;
+
+    SELECT r.op_type, r.task_id
+      INTO op_type, task_id
+      FROM undo_task_action(expect_user_id) AS r(op_type INT, task_id INT);
+    RETURN NEXT;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    op.execute(DDL(UNDO_FUNCTION))
+
+
+def downgrade() -> None:
+    op.execute(
+        DDL("DROP FUNCTION undo_task_actions(INT, INT, TIMESTAMP)"))
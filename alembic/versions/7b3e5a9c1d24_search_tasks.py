@@ -0,0 +1,180 @@
+"""search tasks with a generated tsvector
+
+Revision ID: 7b3e5a9c1d24
+Revises: 2d7c9e3a5f18
+Create Date: 2026-10-17 07:30:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e5a9c1d24'
+down_revision: Union[str, None] = '2d7c9e3a5f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same expression as tugastugas.models.SEARCH_VECTOR
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A')"
+    " || setweight(to_tsvector('english', coalesce(description, '')), 'B')")
+
+# The search vector is derived from the title and the description, so it is
+# left out of h_task: it would make every record larger, and make an update
+# of the title or the description record the old vector as modified too.
+AUDIT_FUNCTION = """
+CREATE OR REPLACE FUNCTION audit_task_change() RETURNS TRIGGER AS $$
+DECLARE
+  acting_user_id INT;
+  undoing BOOLEAN;
+  before_image JSONB;
+BEGIN
+  acting_user_id := NULLIF(current_setting('tugastugas.user_id', true), '')::INT;
+  undoing := coalesce(current_setting('tugastugas.undo', true), '') = 'on';
+  IF TG_OP = 'INSERT'
+  THEN
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (NEW.id,
+            1,
+            to_jsonb(NEW) - 'search_vector',
+            NEW.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  ELSIF TG_OP = 'DELETE'
+  THEN
+    -- Keep the deleted row so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            2,
+            to_jsonb(OLD) - 'search_vector',
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, OLD.last_modifier_id),
+            undoing);
+  ELSE
+    -- Keep the before-image of the modified columns only, so that they can
+    -- be restored without storing the unchanged ones again
+    SELECT coalesce(jsonb_object_agg(old_column.key, old_column.value),
+                    '{}'::JSONB)
+      INTO before_image
+      FROM jsonb_each(to_jsonb(OLD) - 'search_vector') AS old_column
+      JOIN jsonb_each(to_jsonb(NEW) - 'search_vector') AS new_column USING (key)
+      WHERE old_column.value IS DISTINCT FROM new_column.value;
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            3,
+            before_image,
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_AUDIT_FUNCTION = """
+CREATE OR REPLACE FUNCTION audit_task_change() RETURNS TRIGGER AS $$
+DECLARE
+  acting_user_id INT;
+  undoing BOOLEAN;
+  before_image JSONB;
+BEGIN
+  acting_user_id := NULLIF(current_setting('tugastugas.user_id', true), '')::INT;
+  undoing := coalesce(current_setting('tugastugas.undo', true), '') = 'on';
+  IF TG_OP = 'INSERT'
+  THEN
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (NEW.id,
+            1,
+            to_jsonb(NEW),
+            NEW.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  ELSIF TG_OP = 'DELETE'
+  THEN
+    -- Keep the deleted row so that it can be restored
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            2,
+            to_jsonb(OLD),
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, OLD.last_modifier_id),
+            undoing);
+  ELSE
+    -- Keep the before-image of the modified columns only, so that they can
+    -- be restored without storing the unchanged ones again
+    SELECT coalesce(jsonb_object_agg(old_column.key, old_column.value),
+                    '{}'::JSONB)
+      INTO before_image
+      FROM jsonb_each(to_jsonb(OLD)) AS old_column
+      JOIN jsonb_each(to_jsonb(NEW)) AS new_column USING (key)
+      WHERE old_column.value IS DISTINCT FROM new_column.value;
+    INSERT INTO h_task (target_row_id,
+                        executed_operation,
+                        data_after_executed_operation,
+                        from_undo,
+                        user_id,
+                        used)
+    VALUES (OLD.id,
+            3,
+            before_image,
+            OLD.from_undo OR undoing,
+            coalesce(acting_user_id, NEW.last_modifier_id),
+            undoing);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    op.execute(DDL(AUDIT_FUNCTION))
+    # Adding a stored generated column rewrites the table, and the index
+    # reads it again; run this outside of peak hours on large tables.
+    op.add_column(
+        'task',
+        sa.Column('search_vector',
+                  postgresql.TSVECTOR(),
+                  sa.Computed(SEARCH_VECTOR, persisted=True),
+                  nullable=True))
+    op.create_index('ix_task_search_vector',
+                    'task', ['search_vector'],
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_search_vector',
+                  table_name='task',
+                  postgresql_using='gin')
+    op.drop_column('task', 'search_vector')
+    op.execute(DDL(PREVIOUS_AUDIT_FUNCTION))
@@ -0,0 +1,145 @@
+"""partition h_task by month
+
+Revision ID: 8e1a6f4b2c90
+Revises: 5b8f0c1d7e42
+Create Date: 2026-10-17 06:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8e1a6f4b2c90'
+down_revision: Union[str, None] = '5b8f0c1d7e42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# h_task is range-partitioned by operation_executed_at with one partition per
+# month, named h_task_yYYYYmMM, so old history can be detached and archived
+# instead of being deleted row by row (see tugastugas.retention). Rows outside
+# every monthly partition land in h_task_default; creating their partition
+# later moves them there.
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_h_task_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+  lower_bound TIMESTAMP := date_trunc('month', month);
+  upper_bound TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+  partition_name TEXT := 'h_task_' || to_char(month, '"y"YYYY"m"MM');
+BEGIN
+  IF to_regclass(partition_name) IS NOT NULL
+  THEN
+    RETURN partition_name;
+  END IF;
+
+  EXECUTE format('CREATE TABLE %I (LIKE h_task INCLUDING DEFAULTS)',
+                 partition_name);
+  -- The default partition must not keep rows of the new range
+  EXECUTE format('WITH moved AS (
+                    DELETE FROM h_task_default
+                      WHERE operation_executed_at >= %L
+                        AND operation_executed_at < %L
+                      RETURNING *
+                  )
+                  INSERT INTO %I SELECT * FROM moved',
+                 lower_bound, upper_bound, partition_name);
+  EXECUTE format('ALTER TABLE h_task ATTACH PARTITION %I
+                    FOR VALUES FROM (%L) TO (%L)',
+                 partition_name, lower_bound, upper_bound);
+  RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Creates the partitions of the current month and of the following ones
+CREATE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_h_task_partitions(months_ahead INT)
+RETURNS SETOF TEXT AS $$
+  SELECT create_h_task_partition(
+           CAST(date_trunc('month', now()) + make_interval(months => m) AS DATE))
+    FROM generate_series(0, months_ahead) AS m;
+$$ LANGUAGE sql;
+"""
+
+COLUMNS = """id,
+             target_row_id,
+             executed_operation,
+             operation_executed_at,
+             data_after_executed_operation,
+             from_undo,
+             user_id,
+             used"""
+
+
+def upgrade() -> None:
+    op.rename_table('h_task', 'h_task_unpartitioned')
+    op.execute("ALTER INDEX h_task_pkey RENAME TO h_task_unpartitioned_pkey")
+    op.execute("ALTER INDEX ix_h_task_undo"
+               " RENAME TO ix_h_task_unpartitioned_undo")
+    op.execute("""
+        CREATE TABLE h_task (
+          id INTEGER NOT NULL DEFAULT nextval('h_task_id_seq'::regclass),
+          target_row_id VARCHAR NOT NULL,
+          executed_operation INTEGER NOT NULL,
+          operation_executed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+            DEFAULT now(),
+          data_after_executed_operation JSONB,
+          from_undo BOOLEAN NOT NULL,
+          user_id INTEGER NOT NULL REFERENCES "user" (id),
+          used BOOLEAN NOT NULL DEFAULT false,
+          CONSTRAINT h_task_pkey PRIMARY KEY (id, operation_executed_at)
+        ) PARTITION BY RANGE (operation_executed_at)""")
+    op.execute("CREATE TABLE h_task_default PARTITION OF h_task DEFAULT")
+    op.create_index('ix_h_task_undo',
+                    'h_task',
+                    ['user_id', sa.text('operation_executed_at DESC')],
+                    unique=False,
+                    postgresql_where=sa.text('NOT used'))
+    # Not DDL(), which would take the % of format() for placeholders
+    op.execute(CREATE_PARTITION_FUNCTION)
+    op.execute(CREATE_PARTITIONS_FUNCTION)
+
+    op.execute("""
+        SELECT create_h_task_partition(CAST(month AS DATE))
+          FROM (SELECT DISTINCT date_trunc('month', operation_executed_at)
+                  FROM h_task_unpartitioned) AS months (month)""")
+    op.execute("SELECT create_h_task_partitions(2)")
+    op.execute(f"""
+        INSERT INTO h_task ({COLUMNS})
+          SELECT {COLUMNS} FROM h_task_unpartitioned""")
+    op.execute("ALTER SEQUENCE h_task_id_seq OWNED BY h_task.id")
+    op.drop_table('h_task_unpartitioned')
+
+
+def downgrade() -> None:
+    op.rename_table('h_task', 'h_task_partitioned')
+    op.execute("ALTER INDEX h_task_pkey RENAME TO h_task_partitioned_pkey")
+    op.execute("ALTER INDEX ix_h_task_undo"
+               " RENAME TO ix_h_task_partitioned_undo")
+    op.execute("""
+        CREATE TABLE h_task (
+          id INTEGER NOT NULL DEFAULT nextval('h_task_id_seq'::regclass),
+          target_row_id VARCHAR NOT NULL,
+          executed_operation INTEGER NOT NULL,
+          operation_executed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+            DEFAULT now(),
+          data_after_executed_operation JSONB,
+          from_undo BOOLEAN NOT NULL,
+          user_id INTEGER NOT NULL REFERENCES "user" (id),
+          used BOOLEAN NOT NULL DEFAULT false,
+          CONSTRAINT h_task_pkey PRIMARY KEY (id)
+        )""")
+    op.create_index('ix_h_task_undo',
+                    'h_task',
+                    ['user_id', sa.text('operation_executed_at DESC')],
+                    unique=False,
+                    postgresql_where=sa.text('NOT used'))
+    op.execute(f"""
+        INSERT INTO h_task ({COLUMNS})
+          SELECT {COLUMNS} FROM h_task_partitioned""")
+    op.execute("ALTER SEQUENCE h_task_id_seq OWNED BY h_task.id")
+    # Dropping the partitioned table drops its partitions
+    op.drop_table('h_task_partitioned')
+    op.execute("DROP FUNCTION create_h_task_partitions(INT)")
+    op.execute("DROP FUNCTION create_h_task_partition(DATE)")
@@ -0,0 +1,278 @@
+"""break ties between history records of one transaction by id
+
+Revision ID: 9d3b6f2a8c57
+Revises: 4f9a2c6e8b13
+Create Date: 2026-10-17 09:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3b6f2a8c57'
+down_revision: Union[str, None] = '4f9a2c6e8b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# createTasks and the audit trigger write many h_task records in one
+# transaction, all with the same now(), so ordering by the timestamp alone
+# made "the latest action" and the order of multi-step undo arbitrary. The
+# ID, taken from a sequence, breaks the ties in the order of the changes.
+UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE
+  h_task_id INT;
+  body JSONB;
+  op_type INT;
+  task_id INT;
+BEGIN
+  -- Find the most recent unused history record for the user; the records
+  -- of one transaction share their timestamp, so the latest has the
+  -- highest ID (served by ix_h_task_undo)
+  SELECT "id",
+         "data_after_executed_operation",
+         "executed_operation",
+         "target_row_id"::INT
+    INTO h_task_id, body, op_type, task_id
+    FROM h_task
+    WHERE user_id = expect_user_id AND NOT used
+    ORDER BY operation_executed_at DESC, id DESC
+    LIMIT 1
+    FOR UPDATE;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+    DELETE FROM task WHERE id = task_id;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    INSERT INTO task (id,
+                      title,
+                      description,
+                      due_date,
+                      status,
+                      creator_id,
+                      last_modifier_id,
+                      from_undo)
+    SELECT r.id,
+           r.title,
+           r.description,
+           r.due_date,
+           r.status,
+           r.creator_id,
+           r.last_modifier_id,
+           r.from_undo
+      FROM jsonb_populate_record(NULL::task, body) AS r;
+  ELSIF op_type = 3 AND body <> '{}'::JSONB -- UPDATE
+  THEN
+    -- The record holds the modified columns only; the other columns keep
+    -- their current values, including changes made later by other users
+    UPDATE task
+       SET (title,
+            description,
+            due_date,
+            status,
+            creator_id,
+            last_modifier_id,
+            from_undo) = (SELECT r.title,
+                                 r.description,
+                                 r.due_date,
+                                 r.status,
+                                 r.creator_id,
+                                 r.last_modifier_id,
+                                 r.from_undo
+                            FROM jsonb_populate_record(task, body) AS r)
+     WHERE id = task_id;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+UNDO_STEPS_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_actions(expect_user_id INT,
+                                             max_steps INT,
+                                             until_timestamp TIMESTAMP DEFAULT NULL)
+RETURNS TABLE (op_type INT, task_id INT) AS $$
+DECLARE
+  next_executed_at TIMESTAMP;
+BEGIN
+  FOR step IN 1..max_steps
+  LOOP
+    -- Peek at the record undo_task_action is going to revert
+    -- (served by ix_h_task_undo)
+    SELECT operation_executed_at
+      INTO next_executed_at
+      FROM h_task
+      WHERE user_id = expect_user_id AND NOT used
+      ORDER BY operation_executed_at DESC, id DESC
+      LIMIT 1;
+    EXIT WHEN next_executed_at IS NULL
+           OR next_executed_at < until_timestamp;
+
+    SELECT r.op_type, r.task_id
+      INTO op_type, task_id
+      FROM undo_task_action(expect_user_id) AS r(op_type INT, task_id INT);
+    RETURN NEXT;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE
+  h_task_id INT;
+  body JSONB;
+  op_type INT;
+  task_id INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  -- (served by ix_h_task_undo)
+  SELECT "id",
+         "data_after_executed_operation",
+         "executed_operation",
+         "target_row_id"::INT
+    INTO h_task_id, body, op_type, task_id
+    FROM h_task
+    WHERE user_id = expect_user_id AND NOT used
+    ORDER BY operation_executed_at DESC
+    LIMIT 1
+    FOR UPDATE;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+    DELETE FROM task WHERE id = task_id;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    INSERT INTO task (id,
+                      title,
+                      description,
+                      due_date,
+                      status,
+                      creator_id,
+                      last_modifier_id,
+                      from_undo)
+    SELECT r.id,
+           r.title,
+           r.description,
+           r.due_date,
+           r.status,
+           r.creator_id,
+           r.last_modifier_id,
+           r.from_undo
+      FROM jsonb_populate_record(NULL::task, body) AS r;
+  ELSIF op_type = 3 AND body <> '{}'::JSONB -- UPDATE
+  THEN
+    -- The record holds the modified columns only; the other columns keep
+    -- their current values, including changes made later by other users
+    UPDATE task
+       SET (title,
+            description,
+            due_date,
+            status,
+            creator_id,
+            last_modifier_id,
+            from_undo) = (SELECT r.title,
+                                 r.description,
+                                 r.due_date,
+                                 r.status,
+                                 r.creator_id,
+                                 r.last_modifier_id,
+                                 r.from_undo
+                            FROM jsonb_populate_record(task, body) AS r)
+     WHERE id = task_id;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_UNDO_STEPS_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_actions(expect_user_id INT,
+                                             max_steps INT,
+                                             until_timestamp TIMESTAMP DEFAULT NULL)
+RETURNS TABLE (op_type INT, task_id INT) AS $$
+DECLARE
+  next_executed_at TIMESTAMP;
+BEGIN
+  FOR step IN 1..max_steps
+  LOOP
+    -- Peek at the record undo_task_action is going to revert
+    -- (served by ix_h_task_undo)
+    SELECT operation_executed_at
+      INTO next_executed_at
+      FROM h_task
+      WHERE user_id = expect_user_id AND NOT used
+      ORDER BY operation_executed_at DESC
+      LIMIT 1;
+    EXIT WHEN next_executed_at IS NULL
+           OR next_executed_at < until_timestamp;
+
+    SELECT r.op_type, r.task_id
+      INTO op_type, task_id
+      FROM undo_task_action(expect_user_id) AS r(op_type INT, task_id INT);
+    RETURN NEXT;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    op.drop_index('ix_h_task_undo', table_name='h_task')
+    op.create_index('ix_h_task_undo',
+                    'h_task', [
+                        'user_id',
+                        sa.text('operation_executed_at DESC'),
+                        sa.text('id DESC')
+                    ],
+                    unique=False,
+                    postgresql_where=sa.text('NOT used'))
+    op.execute(DDL(UNDO_FUNCTION))
+    op.execute(DDL(UNDO_STEPS_FUNCTION))
+
+
+def downgrade() -> None:
+    op.execute(DDL(PREVIOUS_UNDO_STEPS_FUNCTION))
+    op.execute(DDL(PREVIOUS_UNDO_FUNCTION))
+    op.drop_index('ix_h_task_undo', table_name='h_task')
+    op.create_index('ix_h_task_undo',
+                    'h_task',
+                    ['user_id', sa.text('operation_executed_at DESC')],
+                    unique=False,
+                    postgresql_where=sa.text('NOT used'))
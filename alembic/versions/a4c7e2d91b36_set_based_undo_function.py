@@ -0,0 +1,218 @@
+"""set-based undo function with partial index
+
+Revision ID: a4c7e2d91b36
+Revises: 3d21f3e8ecfe
+Create Date: 2026-10-17 04:30:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import DDL
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c7e2d91b36'
+down_revision: Union[str, None] = '3d21f3e8ecfe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows are restored with jsonb_populate_record and static SQL, so the
+# statements are planned once per session instead of on every EXECUTE, and
+# NULL values (e.g. a missing due date) are restored as NULL.
+UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE
+  h_task_id INT;
+  body JSONB;
+  op_type INT;
+  task_id INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  -- (served by ix_h_task_undo)
+  SELECT "id",
+         "data_after_executed_operation",
+         "executed_operation",
+         "target_row_id"::INT
+    INTO h_task_id, body, op_type, task_id
+    FROM h_task
+    WHERE user_id = expect_user_id AND NOT used
+    ORDER BY operation_executed_at DESC
+    LIMIT 1
+    FOR UPDATE;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+    DELETE FROM task WHERE id = task_id;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    INSERT INTO task (id,
+                      title,
+                      description,
+                      due_date,
+                      status,
+                      creator_id,
+                      last_modifier_id,
+                      from_undo)
+    SELECT r.id,
+           r.title,
+           r.description,
+           r.due_date,
+           r.status,
+           r.creator_id,
+           r.last_modifier_id,
+           r.from_undo
+      FROM jsonb_populate_record(NULL::task, body) AS r;
+  ELSIF op_type = 3 -- UPDATE
+  THEN
+    -- Keys missing from the history record keep their current values
+    UPDATE task
+       SET (title,
+            description,
+            due_date,
+            status,
+            creator_id,
+            last_modifier_id,
+            from_undo) = (SELECT r.title,
+                                 r.description,
+                                 r.due_date,
+                                 r.status,
+                                 r.creator_id,
+                                 r.last_modifier_id,
+                                 r.from_undo
+                            FROM jsonb_populate_record(task, body) AS r)
+     WHERE id = task_id;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PREVIOUS_UNDO_FUNCTION = """
+CREATE OR REPLACE FUNCTION undo_task_action(expect_user_id INT) RETURNS RECORD AS $$
+DECLARE op_type INT;
+DECLARE body JSONB;
+  h_task_id INT;
+  task_id INT;
+  stmt TEXT;
+  k TEXT;
+  v TEXT;
+  stmt_state INT;
+BEGIN
+  -- Find the most recent unused history record for the user
+  SELECT "id",
+  	 "data_after_executed_operation",
+	 "executed_operation",
+	 "target_row_id"
+	 INTO h_task_id, body, op_type, task_id
+	 FROM h_task
+     WHERE user_id = expect_user_id AND not used
+	 ORDER BY operation_executed_at DESC
+	 LIMIT 1;
+  IF task_id IS NULL
+  THEN
+    RETURN NULL;
+  END IF;
+
+  -- Let audit_task_change know that the following changes are an undo
+  PERFORM set_config('tugastugas.user_id', expect_user_id::TEXT, true);
+  PERFORM set_config('tugastugas.undo', 'on', true);
+
+  -- Perform undo operation based on the operation type
+  IF op_type = 1 -- INSERT
+  THEN
+     stmt := 'DELETE FROM task WHERE id = ' || quote_literal(task_id);
+     EXECUTE stmt;
+  ELSIF op_type = 2 -- DELETE
+  THEN
+    stmt := 'INSERT INTO task(';
+    stmt_state := 1;
+
+    -- Loop through JSON keys and build the INSERT statement for the deleted task
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      IF stmt_state = 1
+      THEN
+        stmt_state := 2;
+      ELSE
+        stmt := stmt || ',';
+      END IF;
+      stmt := stmt || quote_ident(k);
+    END LOOP;
+
+    stmt := stmt || ') VALUES (';
+
+    -- Loop through JSON keys again and add quoted values
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      v := body ->> k;
+      IF stmt_state = 2
+      THEN
+        stmt_state = 3;
+      ELSE
+	stmt := stmt || ',';
+      END IF;
+      stmt := stmt || quote_literal(v);
+    END LOOP;
+
+    stmt := stmt || ')';
+    EXECUTE stmt;
+  ELSIF op_type = 3 -- UPDATE
+  THEN
+    FOR k IN SELECT jsonb_object_keys(body)
+    LOOP
+      v := body ->> k;
+      IF stmt IS NULL
+      THEN
+        stmt := 'UPDATE task SET ';
+      ELSE
+        stmt := stmt || ', ';
+      END IF;
+      stmt := stmt || quote_ident(k) || ' = ' || quote_literal(v);
+    END LOOP;
+    stmt := stmt || ' WHERE id = ' || quote_literal(task_id);
+    EXECUTE stmt;
+  END IF;
+
+  PERFORM set_config('tugastugas.undo', 'off', true);
+
+  -- Mark the used history record as used to prevent re-undo
+  UPDATE h_task SET used = true WHERE id = h_task_id;
+
+  -- Return the operation type and task ID for reference
+  RETURN ROW(op_type, task_id);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    op.create_index('ix_h_task_undo',
+                    'h_task',
+                    ['user_id', sa.text('operation_executed_at DESC')],
+                    unique=False,
+                    postgresql_where=sa.text('NOT used'))
+    op.execute(DDL(UNDO_FUNCTION))
+
+
+def downgrade() -> None:
+    op.execute(DDL(PREVIOUS_UNDO_FUNCTION))
+    op.drop_index('ix_h_task_undo',
+                  table_name='h_task',
+                  postgresql_where=sa.text('NOT used'))
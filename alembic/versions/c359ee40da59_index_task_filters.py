@@ -0,0 +1,32 @@
+"""index task filters
+
+Revision ID: c359ee40da59
+Revises: a4c7e2d91b36
+Create Date: 2026-10-17 05:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c359ee40da59'
+down_revision: Union[str, None] = 'a4c7e2d91b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_task_status_id', 'task', ['status', 'id'])
+    op.create_index('ix_task_creator_id_id', 'task', ['creator_id', 'id'])
+    op.create_index('ix_task_last_modifier_id_id', 'task',
+                    ['last_modifier_id', 'id'])
+    op.create_index('ix_task_due_date_id', 'task', ['due_date', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_due_date_id', table_name='task')
+    op.drop_index('ix_task_last_modifier_id_id', table_name='task')
+    op.drop_index('ix_task_creator_id_id', table_name='task')
+    op.drop_index('ix_task_status_id', table_name='task')
@@ -0,0 +1,169 @@
+import json
+import os
+from typing import Any
+import pytest
+from alembic import command
+from alembic.config import Config
+from pytest_mock_resources import create_postgres_fixture
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from tugastugas import seed
+from tugastugas.models import Task
+
+alembic_engine = create_postgres_fixture()
+
+# One database for the operation benchmarks, grown from the smallest dataset
+# size to the largest one instead of being seeded again for every test
+benchmark_engine = create_postgres_fixture(scope="session")
+
+RESULTS = pytest.StashKey[list]()
+REGRESSIONS = pytest.StashKey[list]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption("--dataset-sizes",
+                    default="10000",
+                    help="comma-separated numbers of tasks, e.g."
+                    " 10000,100000,1000000 (default: 10000)")
+    group.addoption("--iterations",
+                    type=int,
+                    default=50,
+                    help="timed runs of every operation (default: 50)")
+    group.addoption("--benchmark-json",
+                    help="write the results to this JSON file")
+    group.addoption("--benchmark-baseline",
+                    help="compare the results with this JSON file")
+    group.addoption(
+        "--max-regression",
+        type=float,
+        default=0.25,
+        help="tolerated slowdown of the median latency (default: 0.25)")
+
+
+def pytest_configure(config):
+    config.stash[RESULTS] = []
+    config.stash[REGRESSIONS] = []
+    baseline_path = config.getoption("benchmark_baseline")
+    if baseline_path and not os.path.exists(baseline_path):
+        raise pytest.UsageError(
+            f"--benchmark-baseline: {baseline_path} does not exist")
+
+
+def pytest_generate_tests(metafunc):
+    if "dataset" in metafunc.fixturenames:
+        sizes = sorted(
+            int(size)
+            for size in metafunc.config.getoption("dataset_sizes").split(","))
+        metafunc.parametrize("dataset",
+                             sizes,
+                             indirect=True,
+                             scope="session",
+                             ids=[f"{size}-tasks" for size in sizes])
+
+
+@pytest.fixture(scope="session")
+def benchmark_db(benchmark_engine: Any) -> Any:
+    config = Config("alembic.ini")
+    config.attributes["connection"] = benchmark_engine
+    command.upgrade(config, "heads")
+    return benchmark_engine
+
+
+@pytest.fixture(scope="session")
+def dataset(request: Any, benchmark_db: Any) -> Any:
+    """Tops the benchmark database up to `request.param` tasks with
+    `tugastugas.seed`, and returns its engine and the size."""
+    size = request.param
+    with Session(benchmark_db) as session:
+        missing = size - session.scalar(select(func.count()).select_from(Task))
+    if missing > 0:
+        url = benchmark_db.url
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setenv("DB_USER", url.username)
+            monkeypatch.setenv("DB_PASSWORD", url.password)
+            monkeypatch.setenv("DB_HOST", url.host)
+            monkeypatch.setenv("DB_PORT", str(url.port))
+            monkeypatch.setenv("DB_NAME", url.database)
+            users = 0 if size != missing else 20
+            # Seeding refuses to run while other sessions are connected
+            benchmark_db.dispose()
+            seed.main([
+                "generate", "--users",
+                str(users), "--tasks",
+                str(missing), "--updates", "1", "--seed",
+                str(size)
+            ])
+        with benchmark_db.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+    return benchmark_db, size
+
+
+@pytest.fixture
+def record_benchmark(request: Any) -> Any:
+    """Returns a function storing one result for the JSON report."""
+
+    def record(result):
+        request.config.stash[RESULTS].append(result)
+
+    return record
+
+
+def find_regressions(results, baseline, max_regression):
+    """Compares results with a baseline made by an earlier run.
+
+      An operation regressed when it runs more SQL statements, or when its
+      median latency grew by more than `max_regression`.
+    """
+    baseline_results = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result["name"])
+        if previous is None:
+            continue
+        if result["statements"] > previous["statements"]:
+            regressions.append(
+                f"{result['name']}: {result['statements']} statements"
+                f" instead of {previous['statements']}")
+        if result["p50_ms"] > previous["p50_ms"] * (1 + max_regression):
+            regressions.append(
+                f"{result['name']}: median {result['p50_ms']:.2f} ms"
+                f" instead of {previous['p50_ms']:.2f} ms")
+    return regressions
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    results = config.stash[RESULTS]
+    if not results:
+        return
+    json_path = config.getoption("benchmark_json")
+    if json_path:
+        with open(json_path, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+    baseline_path = config.getoption("benchmark_baseline")
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            regressions = find_regressions(
+                results, json.load(baseline_file),
+                config.getoption("max_regression"))
+        config.stash[REGRESSIONS] = regressions
+        if regressions:
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    results = config.stash[RESULTS]
+    if not results:
+        return
+    terminalreporter.section("benchmark")
+    terminalreporter.write_line(
+        f"{'operation':<32} {'tasks':>8} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'p99 ms':>8} {'SQL':>4}")
+    for result in results:
+        terminalreporter.write_line(
+            f"{result['operation']:<32} {result['tasks']:>8}"
+            f" {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+            f" {result['p99_ms']:>8.2f} {result['statements']:>4}")
+    for regression in config.stash[REGRESSIONS]:
+        terminalreporter.write_line(f"REGRESSION {regression}", red=True)
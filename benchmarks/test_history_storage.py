@@ -0,0 +1,105 @@
+"""
+Storage and write amplification of the task history
+
+Runs the same update-heavy workload with full-row UPDATE records (revision
+8e1a6f4b2c90) and with before-images of the modified columns only (revision
+2d7c9e3a5f18), and reports the size of `h_task` and the WAL written.
+
+Run with ``python -m pytest benchmarks -s``.
+"""
+import random
+from typing import Any
+from sqlalchemy import text
+
+FULL_ROW_REVISION = "8e1a6f4b2c90"
+BEFORE_IMAGE_REVISION = "2d7c9e3a5f18"
+
+TASKS = 200
+ROUNDS = 20
+WORDS = ["task", "review", "deploy", "fix", "meeting", "customer", "report",
+         "database", "release", "budget", "design", "follow", "up", "with"]
+
+
+def make_description(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(150, 300)))
+
+
+def run_workload(engine):
+    """Creates `TASKS` tasks, then updates each of them `ROUNDS` times:
+    mostly status changes, and a title change every fifth round.
+
+      Returns:
+      dict: The number of UPDATE records, the size of `h_task` in bytes and
+      the bytes of WAL written by the updates.
+    """
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO \"user\" (id, username, password_hash)"
+                 " VALUES (1, 'usr1', '')"))
+        connection.execute(
+            text("INSERT INTO task (title, description, status, creator_id,"
+                 " last_modifier_id) VALUES (:title, :description, 'TODO',"
+                 " 1, 1)"), [{
+                     "title": f"T{i}",
+                     "description": make_description(rng)
+                 } for i in range(TASKS)])
+    with engine.connect() as connection:
+        wal_start = connection.scalar(text("SELECT pg_current_wal_insert_lsn()"))
+        size_start = history_size(connection)
+    for round_ in range(ROUNDS):
+        with engine.begin() as connection:
+            connection.execute(
+                text("SELECT set_config('tugastugas.user_id', '1', true)"))
+            if round_ % 5 == 4:
+                connection.execute(
+                    text("UPDATE task SET title = title || '-R',"
+                         " last_modifier_id = 1"))
+            else:
+                connection.execute(
+                    text("UPDATE task SET status = CASE status"
+                         " WHEN 'DOING' THEN 'DONE' ELSE 'DOING' END,"
+                         " last_modifier_id = 1"))
+    with engine.connect() as connection:
+        wal_bytes = connection.scalar(
+            text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(),"
+                 " :start)"), {"start": wal_start})
+        return {
+            "updates": connection.scalar(
+                text("SELECT count(*) FROM h_task"
+                     " WHERE executed_operation = 3")),
+            "history_bytes": history_size(connection) - size_start,
+            "wal_bytes": int(wal_bytes),
+        }
+
+
+def history_size(connection):
+    # The partitioned table itself has no storage; sum its partitions
+    return connection.scalar(
+        text("SELECT sum(pg_total_relation_size(relid))"
+             " FROM pg_partition_tree('h_task')"))
+
+
+def reset(engine):
+    with engine.begin() as connection:
+        connection.execute(
+            text("TRUNCATE task, h_task, \"user\" RESTART IDENTITY CASCADE"))
+
+
+def test_history_storage(alembic_runner: Any, alembic_engine: Any) -> None:
+    alembic_runner.migrate_up_to(FULL_ROW_REVISION, return_current=False)
+    full_row = run_workload(alembic_engine)
+    reset(alembic_engine)
+    alembic_runner.migrate_up_to(BEFORE_IMAGE_REVISION, return_current=False)
+    before_image = run_workload(alembic_engine)
+
+    print()
+    print(f"{'':>14} {'full row':>12} {'before-image':>14} {'ratio':>7}")
+    for key in ["updates", "history_bytes", "wal_bytes"]:
+        ratio = before_image[key] / full_row[key]
+        print(f"{key:>14} {full_row[key]:>12} {before_image[key]:>14}"
+              f" {ratio:>7.2f}")
+
+    assert before_image["updates"] == full_row["updates"] == TASKS * ROUNDS
+    assert before_image["history_bytes"] < full_row["history_bytes"]
+    assert before_image["wal_bytes"] < full_row["wal_bytes"]
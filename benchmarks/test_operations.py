@@ -0,0 +1,135 @@
+"""
+Latency and SQL statements of the GraphQL operations
+
+Every operation of `schema.schema` is run `--iterations` times, after a few
+untimed runs, on a database of each of the `--dataset-sizes`, the way the
+ASGI app runs it: asynchronously and with a new session per request. The
+median, 95th and 99th percentile latencies and the number of SQL statements
+are reported, written with `--benchmark-json` and compared with
+`--benchmark-baseline`.
+
+Run with ``python -m pytest benchmarks --dataset-sizes 10000,100000``.
+"""
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Any
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from tugastugas import schema
+
+WARMUP = 5
+
+NODE = "edges { node { id title status dueDate } }"
+
+# Operation name, setup statement run before each timed run (untimed), and
+# GraphQL operation; {id} is replaced by the task ID returned by the setup.
+OPERATIONS = [
+    ("tasks", None, "{ tasks(first: 50) { %s } }" % NODE),
+    ("tasks(last)", None, "{ tasks(last: 50) { %s } }" % NODE),
+    ("tasks(status)", None,
+     '{ tasks(status: "DONE", first: 50) { %s } }' % NODE),
+    ("tasks(creator)", None,
+     '{ tasks(creator: "usr2", first: 50) '
+     '{ edges { node { id creator lastModifier } } } }'),
+    ("tasks(dueSince, dueBefore)", None,
+     '{ tasks(dueSince: "2027-01-01", dueBefore: "2027-02-01", first: 50) '
+     '{ %s } }' % NODE),
+    ("tasks(orderBy)", None,
+     '{ tasks(orderBy: {field: DUE_DATE, direction: DESC, nulls: LAST}, '
+     'first: 50) { %s } }' % NODE),
+    ("tasks(search)", None,
+     '{ tasks(search: "\\"task 4242\\"", first: 50) { %s } }' % NODE),
+    ("createTask", None,
+     'mutation { createTask(title: "B", status: "TODO") { task { id } } }'),
+    ("updateTask", "SELECT id FROM task ORDER BY random() LIMIT 1",
+     'mutation { updateTask(id: {id}, status: "DOING") { task { id } } }'),
+    ("deleteTask", """
+       WITH acting_user AS (SELECT set_config('tugastugas.user_id', '1', true))
+       INSERT INTO task (title, description, status, creator_id,
+                         last_modifier_id)
+         SELECT 'B', '', 'TODO', 1, 1 FROM acting_user RETURNING id""",
+     'mutation { deleteTask(id: {id}) { id } }'),
+    ("undoTask", """
+       WITH acting_user AS (SELECT set_config('tugastugas.user_id', '1', true))
+       UPDATE task SET title = title || '!', last_modifier_id = 1
+         FROM acting_user
+         WHERE id = (SELECT id FROM task ORDER BY random() LIMIT 1)
+         RETURNING id""", 'mutation { undoTask { task { id } } }'),
+]
+
+
+async def run_operation(engine_url, setup, query, iterations):
+    """Returns the latency in seconds and the number of statements of each
+    timed run."""
+    engine = create_async_engine(engine_url)
+    session_factory = async_sessionmaker(engine,
+                                         autoflush=False,
+                                         expire_on_commit=False)
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    latencies, counts = [], []
+    try:
+        for iteration in range(WARMUP + iterations):
+            operation = query
+            if setup is not None:
+                async with engine.begin() as connection:
+                    task_id = (await connection.execute(text(setup))).scalar()
+                operation = query.replace("{id}", str(task_id))
+            event.listen(engine.sync_engine, "before_cursor_execute",
+                         count_statement)
+            statements = 0
+            start = time.perf_counter()
+            async with session_factory() as session:
+                result = await schema.schema.execute_async(
+                    operation,
+                    context={
+                        "session": session,
+                        "user": SimpleNamespace(id=1),
+                        "user_loader": schema.UserLoader(session)
+                    },
+                    execution_context_class=schema.SerialExecutionContext)
+            elapsed = time.perf_counter() - start
+            event.remove(engine.sync_engine, "before_cursor_execute",
+                         count_statement)
+            assert result.errors is None, result.errors
+            if iteration >= WARMUP:
+                latencies.append(elapsed)
+                counts.append(statements)
+    finally:
+        await engine.dispose()
+    return latencies, counts
+
+
+@pytest.mark.parametrize("name, setup, query",
+                         OPERATIONS,
+                         ids=[name for name, _, _ in OPERATIONS])
+def test_operation(dataset: Any, request: Any, record_benchmark: Any,
+                   name: str, setup: str | None, query: str) -> None:
+    engine, size = dataset
+    iterations = request.config.getoption("iterations")
+    latencies, counts = asyncio.run(
+        run_operation(
+            engine.url.set(drivername="postgresql+psycopg").render_as_string(
+                hide_password=False), setup, query, iterations))
+    percentiles = statistics.quantiles([latency * 1000
+                                        for latency in latencies],
+                                       n=100,
+                                       method="inclusive")
+    record_benchmark({
+        "name": f"{name}[{size}]",
+        "operation": name,
+        "tasks": size,
+        "iterations": iterations,
+        "p50_ms": percentiles[49],
+        "p95_ms": percentiles[94],
+        "p99_ms": percentiles[98],
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "statements": max(counts),
+    })
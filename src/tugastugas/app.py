@@ -6,9 +6,24 @@ a GraphQL endpoint for data access.
 **Features:**
 
 * User model with ID, username, and authentication status.
-* OAuth2 authentication with fake token generation for demonstration.
-* User retrieval based on access token and scope validation.
-* Basic GraphQL endpoint with a context providing database session and user information.
+* OAuth2 authentication issuing HMAC-signed tokens (see `tugastugas.tokens`)
+  for the fake users, and accepting fake tokens in development only.
+* User retrieval based on access token and scope validation, with a cache of
+  verified tokens so that a token is verified and its `User` built only once.
+* Basic GraphQL endpoint with a context providing database session, user information
+  and a request-scoped loader batching username lookups.
+* Persisted queries and a cache of parsed and validated queries
+  (see `tugastugas.graphql_app`).
+* A streaming NDJSON/CSV export of tasks at `/export/tasks` (see
+  `tugastugas.export`), behind the same middleware as the GraphQL endpoint.
+* A result cache of `tasks` pages (see `tugastugas.cache`) whose hit and miss
+  counters are served at `/cache/stats`.
+* Prometheus metrics at `/metrics` (see `tugastugas.metrics`): operation,
+  field and request latencies, SQL statements per request and pool usage.
+* Tracing of sampled requests (see `tugastugas.tracing`): spans of the
+  middleware, the GraphQL operation and fields, and the SQL statements.
+* Database session middleware opening one session per request and rolling back
+  whatever the request left uncommitted.
 * Authentication middleware using Bearer token and custom backend.
 * Guard middleware to restrict unauthorized requests (example).
 
@@ -16,17 +31,29 @@ a GraphQL endpoint for data access.
 applications should implement secure password hashing and proper authentication mechanisms.
 """
 
+import os
+import time
 from typing import Annotated, Any
 from fastapi import Depends, FastAPI, HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from tugastugas.schema import schema
-from tugastugas.database import bind
+from tugastugas.schema import schema, SerialExecutionContext, UserLoader
+from tugastugas.database import bind_async
+from tugastugas.cache import get_tasks_cache
+from tugastugas.tokens import (VerifiedTokenCache, decode_token, encode_token,
+                               get_token_cache_size, get_token_secret,
+                               get_token_ttl)
+from tugastugas.graphql_app import CachingGraphQLApp
+from tugastugas.export import export_tasks
+from tugastugas.metrics import (REGISTRY, GraphQLMetricsMiddleware,
+                                RequestMetricsMiddleware,
+                                register_tasks_cache)
+from tugastugas.tracing import (GraphQLTracingMiddleware, TracingMiddleware,
+                                get_tracer, trace, traced)
 from starlette.responses import PlainTextResponse
 from starlette.requests import HTTPConnection
 from starlette.types import ASGIApp, Receive, Scope, Send
 from starlette.routing import Route
-from starlette_graphene3 import GraphQLApp
 from starlette.authentication import (
     AuthCredentials,
     AuthenticationBackend,
@@ -80,15 +107,66 @@ def fake_decode_token(token):
     return None
 
 
+FAKE_USERS = {
+    "usr1": {
+        "id": 1,
+        "username": "usr1"
+    },
+    "usr2": {
+        "id": 2,
+        "username": "usr2"
+    },
+    "usr3": {
+        "id": 3,
+        "username": "usr3"
+    },
+}
+
+# Set ALLOW_FAKE_TOKENS to true in development only: it lets anyone log in
+# as the fake users, and lets the server start without TOKEN_SECRET.
+allow_fake_tokens = os.getenv("ALLOW_FAKE_TOKENS",
+                              "false").lower() in ("1", "true", "yes")
+token_secret = get_token_secret(development=allow_fake_tokens)
+token_ttl = get_token_ttl()
+token_cache = VerifiedTokenCache(get_token_cache_size())
+
+
+def get_token_user(token):
+    """Finds the user of an access token, or returns None.
+
+      A token is looked up in `token_cache` first. Otherwise, it is verified
+      with `decode_token` (or `fake_decode_token` if fake tokens are allowed),
+      and the resulting `User` is cached until the token expires, so the
+      signature check and the `User` construction happen once per token
+      instead of once per request.
+      """
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    claims = decode_token(token, token_secret)
+    if claims is not None:
+        user = User(id=int(claims["sub"]),
+                    username=claims["name"],
+                    is_authenticated=True)
+        token_cache.put(token, user, claims["exp"])
+        return user
+    if allow_fake_tokens:
+        user_dict = fake_decode_token(token)
+        if user_dict is not None:
+            user = User(**user_dict)
+            token_cache.put(token, user, float("inf"))
+            return user
+    return None
+
+
 def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    user_dict = fake_decode_token(token)
-    if not user_dict:
+    user = get_token_user(token)
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = User(**user_dict)
     return user
 
 
@@ -102,40 +180,81 @@ def get_current_active_user(
 
 @app.post("/token")
 def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    return {"access_token": "access-token-1", "token_type": "bearer"}
+    """Issues a signed access token for one of the fake users.
+
+      **Important:** The fake users have no passwords, so the password is
+      not checked. A real application has to verify it against
+      `User.password_hash`.
+      """
+    user_dict = FAKE_USERS.get(form_data.username)
+    if user_dict is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    claims = {
+        "sub": str(user_dict["id"]),
+        "name": user_dict["username"],
+        "exp": int(time.time()) + token_ttl
+    }
+    return {
+        "access_token": encode_token(claims, token_secret),
+        "token_type": "bearer",
+        "expires_in": token_ttl
+    }
 
 
 ############# GraghQL #################
 
-session = bind()
+session_factory = bind_async()
+tasks_cache = get_tasks_cache()
+
+
+if tasks_cache is not None:
+    register_tasks_cache(tasks_cache)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    if tasks_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **tasks_cache.stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
+AUTHENTICATED = AuthCredentials(["authenticated"])
 
 
 class BearerAuthBackend(AuthenticationBackend):
     """Custom authentication backend for Bearer token scheme.
 
       This backend checks for Bearer token authorization in the request headers.
-      It extracts the token and uses `fake_decode_token` (for demonstration purposes)
-      to decode it. If the token is valid, it returns user credentials and the User object.
-      If the token is invalid or not found, it returns None.
-
-      **Important:** This backend uses `fake_decode_token` which is for demonstration only.
-      In a real application, you should implement a secure token decoding mechanism
-      using a JWT library and secret key to verify real access tokens.
+      It extracts the token and uses `get_token_user` to verify it, which is
+      served from the cache of verified tokens for every request but the first
+      one with a token. If the token is valid, it returns user credentials and
+      the User object. If the token is invalid, malformed or not found, it
+      returns None.
       """
 
+    @trace("BearerAuthBackend.authenticate")
     async def authenticate(self, conn):
-        if "Authorization" not in conn.headers:
+        auth = conn.headers.get("Authorization")
+        if auth is None:
             return
 
-        auth = conn.headers["Authorization"]
-        scheme, token = auth.split()
-        if scheme.lower() != 'bearer':
+        scheme, _, token = auth.partition(" ")
+        if scheme.lower() != 'bearer' or not token:
             return
-        user_dict = fake_decode_token(token)
-        if user_dict is None:
+        user = get_token_user(token.strip())
+        if user is None:
             return
-        user = User(**user_dict)
-        return AuthCredentials(["authenticated"]), user
+        return AUTHENTICATED, user
 
 
 class GuardUnauthorizedRequestMiddleware:
@@ -161,20 +280,66 @@ class GuardUnauthorizedRequestMiddleware:
             return
 
 
+class DBSessionMiddleware:
+    """Middleware giving every request its own database session.
+
+      This middleware opens an `AsyncSession` from `session_factory` and stores
+      it in the request scope (`scope["session"]`) before calling the application.
+      When the request is finished, successfully or not, any transaction the
+      request left open is rolled back and the session is closed, returning its
+      connection to the pool. Identity-map state therefore never leaks from one
+      request to the next.
+      """
+
+    def __init__(self, app: ASGIApp, session_factory) -> None:
+        self.app = app
+        self.session_factory = session_factory
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        async with self.session_factory() as session:
+            scope["session"] = session
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if session.in_transaction():
+                    await session.rollback()
+
+
 middleware = [
-    Middleware(AuthenticationMiddleware, backend=BearerAuthBackend()),
-    Middleware(GuardUnauthorizedRequestMiddleware)
+    Middleware(TracingMiddleware, tracer=get_tracer()),
+    traced(Middleware(RequestMetricsMiddleware)),
+    traced(Middleware(AuthenticationMiddleware, backend=BearerAuthBackend())),
+    traced(Middleware(GuardUnauthorizedRequestMiddleware)),
+    traced(Middleware(DBSessionMiddleware, session_factory=session_factory))
 ]
 
 
 async def get_context_value(request: HTTPConnection) -> Any:
-    return {"session": session, "user": request.user}
-
-
-graphql_app = GraphQLApp(schema, context_value=get_context_value)
+    session = request.scope["session"]
+    return {
+        "session": session,
+        "user": request.user,
+        "user_loader": UserLoader(session),
+        "tasks_cache": tasks_cache
+    }
+
+
+graphql_app = CachingGraphQLApp(
+    schema,
+    context_value=get_context_value,
+    middleware=[GraphQLMetricsMiddleware(),
+                GraphQLTracingMiddleware()],
+    execution_context_class=SerialExecutionContext)
 graphql_route = Route('/',
                       endpoint=graphql_app,
                       middleware=middleware,
                       methods=["POST"])
 
+export_route = Route('/export/tasks',
+                     endpoint=export_tasks,
+                     middleware=middleware,
+                     methods=["GET"])
+
 app.add_route('/', graphql_route)
+app.add_route('/export/tasks', export_route)
@@ -0,0 +1,231 @@
+"""Result cache of `Query.tasks`.
+
+Dashboards poll `tasks` with the same arguments every few seconds. The
+`TasksCache` keeps the rows of recent pages, keyed by the user, the arguments
+and the selected columns, so such polls are answered without querying
+PostgreSQL.
+
+Entries are never updated in place. Every key contains a generation number,
+which the mutations increment after committing; entries of older generations
+are not found any more and are evicted by the LRU or their TTL.
+
+Invalidation is deliberately global: a mutation makes every cached page of
+every user unreachable. Users see the tasks of all users, and a task created,
+deleted or updated shifts the keyset pages of every order and filter it
+falls into, before or after the change, so no smaller set of entries can be
+told apart cheaply. The cache pays off for polling between mutations, which
+is where dashboards spend their time.
+
+The entries are stored by a backend:
+
+* `MemoryBackend` keeps them in the process.
+* `SQLiteBackend` keeps them in a SQLite file, which the workers of one host
+  share, so a mutation handled by one worker invalidates the pages cached by
+  the others.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+from tugastugas.graphql_app import ExpiringLRUCache
+
+GENERATION_KEY = "tasks:generation"
+
+
+class MemoryBackend:
+    """In-process backend with LRU eviction and per-entry expiry.
+
+      The entries are kept in an `ExpiringLRUCache`. Counters are kept apart
+      from them, so they are never evicted.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.entries = ExpiringLRUCache(max_size, clock=time.monotonic)
+        self.counters: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        return self.entries.get(key)
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self.entries.put(key, value, time.monotonic() + ttl)
+
+    def get_counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+
+class SQLiteBackend:
+    """Backend storing entries in a SQLite file shared by local workers.
+
+      `last_used_at` is updated on every hit. Expired entries, then the least
+      recently used ones, are deleted when more than `max_size` entries are
+      stored. Counters are kept in a table of their own.
+    """
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path,
+                                          timeout=5,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entry (
+                  key TEXT PRIMARY KEY,
+                  value TEXT NOT NULL,
+                  expires_at REAL NOT NULL,
+                  last_used_at REAL NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS ix_cache_entry_last_used_at
+                  ON cache_entry (last_used_at)""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache_counter (
+                  key TEXT PRIMARY KEY,
+                  value INTEGER NOT NULL
+                )""")
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "UPDATE cache_entry SET last_used_at = ?"
+                " WHERE key = ? AND expires_at >= ? RETURNING value",
+                (now, key, now)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now))
+            (count, ) = self.connection.execute(
+                "SELECT count(*) FROM cache_entry").fetchone()
+            if count > self.max_size:
+                self.connection.execute(
+                    "DELETE FROM cache_entry WHERE expires_at < ?", (now, ))
+                self.connection.execute(
+                    "DELETE FROM cache_entry WHERE key IN ("
+                    " SELECT key FROM cache_entry ORDER BY last_used_at DESC"
+                    " LIMIT -1 OFFSET ?)", (self.max_size, ))
+
+    def get_counter(self, key: str) -> int:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM cache_counter WHERE key = ?",
+                (key, )).fetchone()
+        return 0 if row is None else row[0]
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            (value, ) = self.connection.execute(
+                "INSERT INTO cache_counter VALUES (?, 1)"
+                " ON CONFLICT (key) DO UPDATE SET value = value + 1"
+                " RETURNING value", (key, )).fetchone()
+        return value
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class TasksCache:
+    """Cache of `Query.tasks` pages with hit and miss counters.
+
+      * Arguments:
+      * `backend`: A `MemoryBackend`, a `SQLiteBackend` or any object with
+        the same `get`, `set`, `get_counter` and `incr` methods.
+      * `ttl` (float): Seconds an entry is served for.
+
+      `hits` and `misses` count the lookups of this process; `stats` reports
+      them together with the current generation.
+    """
+
+    def __init__(self, backend, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self) -> int:
+        return self.backend.get_counter(GENERATION_KEY)
+
+    def make_key(self, user_id: int, arguments: dict[str, Any],
+                 columns: list[str]) -> str:
+        """Normalizes a request into a cache key.
+
+          The key is made before the page is queried, so a page read while
+          a mutation commits is stored under the old generation.
+        """
+        return json.dumps(
+            ["tasks", self.generation(), user_id, arguments,
+             sorted(columns)],
+            sort_keys=True,
+            default=encode_value)
+
+    def get(self, key: str) -> Any:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        self.backend.set(key, json.dumps(value, default=encode_value),
+                         self.ttl)
+
+    def invalidate(self) -> None:
+        """Makes every cached page unreachable, for all users and in all
+        workers sharing the backend. This is not targeted on purpose (see
+        the module docstring)."""
+        self.backend.incr(GENERATION_KEY)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.generation()
+        }
+
+
+def get_tasks_cache():
+    """Creates the cache configured by environment variables.
+
+      It uses the following environment variables (with defaults if not set):
+      * TASKS_CACHE_BACKEND: "memory", "sqlite" or "none" to disable the
+        cache (defaults to "memory").
+      * TASKS_CACHE_PATH: The SQLite file of the "sqlite" backend (defaults
+        to "tugastugas-cache.sqlite3").
+      * TASKS_CACHE_SIZE: Number of cached pages (defaults to "1000").
+      * TASKS_CACHE_TTL: Seconds a page is served for (defaults to "5").
+
+      Returns:
+      TasksCache | None: The cache, or None if it is disabled.
+    """
+    backend_name = os.getenv("TASKS_CACHE_BACKEND", "memory").lower()
+    max_size = int(os.getenv("TASKS_CACHE_SIZE", "1000"))
+    ttl = float(os.getenv("TASKS_CACHE_TTL", "5"))
+    if backend_name == "none":
+        return None
+    if backend_name == "memory":
+        return TasksCache(MemoryBackend(max_size), ttl)
+    if backend_name == "sqlite":
+        path = os.getenv("TASKS_CACHE_PATH", "tugastugas-cache.sqlite3")
+        return TasksCache(SQLiteBackend(path, max_size), ttl)
+    raise ValueError(f'Unknown TASKS_CACHE_BACKEND {backend_name!r}')
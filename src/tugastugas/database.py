@@ -1,8 +1,12 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session as scoped_session_factory
 from sqlalchemy.orm import DeclarativeBase
+from tugastugas.metrics import (MeteredAsyncAdaptedQueuePool, MeteredQueuePool,
+                                instrument_engine)
 
 
 def get_url():
@@ -31,6 +35,30 @@ def get_url():
     )
 
 
+def get_engine_options():
+    """Collects connection pool settings for SQLAlchemy engines.
+
+      Like `get_url`, this function reads environment variables, falling back
+      to defaults when they are not set:
+      * DB_POOL_SIZE: Connections kept open in the pool (defaults to "5").
+      * DB_MAX_OVERFLOW: Connections allowed beyond DB_POOL_SIZE under load (defaults to "10").
+      * DB_POOL_RECYCLE: Seconds after which a connection is replaced (defaults to "1800").
+      * DB_POOL_PRE_PING: Whether to test connections on checkout (defaults to "true").
+      * DB_POOL_TIMEOUT: Seconds to wait for a free connection before failing (defaults to "30").
+
+      Returns:
+      dict: Keyword arguments for `create_engine` and `create_async_engine`.
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING",
+                                   "true").lower() in ("1", "true", "yes"),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
+
 class Base(DeclarativeBase):
     """Abstract base class for SQLAlchemy models.
 
@@ -51,7 +79,9 @@ def bind():
       1. Retrieves the database connection URL using the `get_url` function.
           (Replace '.get_url' with the actual import path if different)
       2. Prints the connection URL for informational purposes (consider logging instead in production).
-      3. Creates a SQLAlchemy engine object using the retrieved connection URL.
+      3. Creates a SQLAlchemy engine object using the retrieved connection URL
+          and the pool settings returned by `get_engine_options`.
+          Its statements and pool are reported by `tugastugas.metrics`.
           Disables echo mode to avoid logging SQL statements (can be enabled for debugging).
       4. Configures a session factory using the engine:
           - Disables autocommit mode (manual commit required for transactions).
@@ -65,7 +95,11 @@ def bind():
       ScopedSession: A thread-local scoped session object for interacting with the database.
     """
     url = get_url()
-    engine = create_engine(url, echo=False)
+    engine = create_engine(url,
+                           echo=False,
+                           poolclass=MeteredQueuePool,
+                           **get_engine_options())
+    instrument_engine(engine, MeteredQueuePool.metrics_name)
     session_factory = sessionmaker(autocommit=False,
                                    autoflush=False,
                                    bind=engine)
@@ -73,3 +107,32 @@ def bind():
     Base.query = scoped_session.query_property()
     Base.metadata.bind = engine
     return scoped_session
+
+
+def bind_async():
+    """Creates an asyncio engine and session factory for the ASGI application.
+
+      This is the non-blocking counterpart of `bind`. The engine uses the async
+      mode of the psycopg driver, so waiting for PostgreSQL yields to the event
+      loop and concurrent requests overlap their I/O inside one process.
+
+      1. Creates an `AsyncEngine` from the URL returned by `get_url` and the
+          pool settings returned by `get_engine_options`.
+          Its statements and pool are reported by `tugastugas.metrics`.
+      2. Configures an `async_sessionmaker` on it:
+          - Disables autoflush mode.
+          - Disables expire-on-commit, because refreshing expired attributes
+            implicitly would need I/O outside of an `await`.
+
+      The factory is not scoped: the application opens one session per request
+      and closes it when the request is finished (see `app.DBSessionMiddleware`).
+
+      Returns:
+      async_sessionmaker: A factory of `AsyncSession` objects.
+    """
+    engine = create_async_engine(get_url(),
+                                 echo=False,
+                                 poolclass=MeteredAsyncAdaptedQueuePool,
+                                 **get_engine_options())
+    instrument_engine(engine, MeteredAsyncAdaptedQueuePool.metrics_name)
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,125 @@
+"""Streaming export of tasks.
+
+`GET /export/tasks` returns every task matching the filters of `Query.tasks`
+as NDJSON (the default) or CSV. The rows are read through a server-side
+cursor, `EXPORT_BATCH_SIZE` at a time, and every batch is encoded and sent
+before the next one is fetched, so memory use does not depend on the number
+of exported tasks.
+
+Filters are query parameters named like the arguments of `Query.tasks`, e.g.
+``/export/tasks?status=DONE&dueSince=2026-01-01&format=csv``.
+"""
+
+import csv
+import datetime
+import io
+import json
+from graphene.utils.str_converters import to_snake_case
+from sqlalchemy import select
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, StreamingResponse
+from tugastugas.models import Task
+from tugastugas.schema import filter_tasks
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    'id', 'title', 'description', 'due_date', 'status', 'creator_id',
+    'last_modifier_id'
+]
+
+# Query parameters accepted as filters, and how their values are parsed
+EXPORT_FILTERS = {
+    'id': int,
+    'status': str,
+    'creator': str,
+    'lastModifier': str,
+    'dueSince': datetime.date.fromisoformat,
+    'dueBefore': datetime.date.fromisoformat,
+    'search': str,
+}
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_filters(query_params):
+    """Converts query parameters to keyword arguments of `filter_tasks`.
+
+      Raises `ValueError` if a value cannot be parsed.
+    """
+    filters = {}
+    for name, parse in EXPORT_FILTERS.items():
+        value = query_params.get(name)
+        if value is not None:
+            try:
+                filters[to_snake_case(name)] = parse(value)
+            except ValueError:
+                raise ValueError(f'Invalid {name} {value!r}.')
+    return filters
+
+
+def encode_value(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def encode_ndjson(rows, header):
+    return "".join(
+        json.dumps(row._asdict(), default=encode_value) + "\n"
+        for row in rows).encode("utf-8")
+
+
+def encode_csv(rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
+
+
+async def stream_tasks(session, export_format, **kwargs):
+    """Yields the matching tasks, ordered by ID, encoded in batches."""
+    encode = ENCODERS[export_format]
+    query = filter_tasks(
+        select(*[getattr(Task, column) for column in EXPORT_COLUMNS]),
+        **kwargs).order_by(Task.id)
+    result = await session.stream(
+        query, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+    header = True
+    async for rows in result.partitions():
+        yield encode(rows, header)
+        header = False
+    if header:
+        # No rows; a CSV file still gets its header
+        yield encode([], header)
+
+
+async def export_tasks(request: Request):
+    """Endpoint of `GET /export/tasks`.
+
+      It runs behind the same middleware as the GraphQL endpoint, so the user
+      is authenticated and `request.scope["session"]` is the session of the
+      request. Responds 400 to an unknown format or an invalid filter.
+    """
+    export_format = request.query_params.get("format", "ndjson")
+    if export_format not in ENCODERS:
+        return PlainTextResponse(f"Unknown format {export_format!r}",
+                                 status_code=400)
+    try:
+        filters = parse_filters(request.query_params)
+    except ValueError as error:
+        return PlainTextResponse(str(error), status_code=400)
+    return StreamingResponse(stream_tasks(request.scope["session"],
+                                          export_format, **filters),
+                             media_type=MEDIA_TYPES[export_format])
@@ -0,0 +1,372 @@
+"""GraphQL endpoint caching parsed documents and persisted queries.
+
+Clients send the same few operations over and over again, so parsing and
+validating the query text on every request is wasted work. `CachingGraphQLApp`
+keeps the validated `DocumentNode` of every operation it has seen in a bounded
+LRU keyed by the sha256 hash of the query text, and implements the automatic
+persisted query (APQ) protocol used by Apollo clients:
+
+1. The client sends only `extensions.persistedQuery.sha256Hash`.
+2. If the hash is unknown, the server answers with a `PersistedQueryNotFound`
+   error and the client retries with both the hash and the query text.
+3. Later requests carrying the hash are served from the cache without sending,
+   parsing or validating the query again.
+
+Introspection results only depend on the schema, so they are cached too.
+
+Before execution, every operation is checked against the cost and depth
+limits of `tugastugas.query_cost`, and its cost is reported in the
+`extensions` of the response. The cost is cached as well, for every
+operation of a document and values of the variables giving sizes. The execution time is recorded by
+`tugastugas.metrics`, and the SQL statements are checked against the budget
+of `tugastugas.statement_budget`, if one is configured. In sampled traces
+(see `tugastugas.tracing`), parsing and execution are spanned.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from inspect import isawaitable
+from typing import Any, Callable, Dict
+from graphql import GraphQLError, OperationType, execute, parse, validate
+from graphql.language.ast import DocumentNode
+from graphql.utilities import get_operation_ast
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette_graphene3 import GraphQLApp, _get_operation_from_request
+from tugastugas.metrics import OPERATION_SECONDS
+from tugastugas.query_cost import (get_max_query_cost, get_max_query_depth,
+                                   query_cost_rule, size_variables)
+from tugastugas.statement_budget import (StatementBudgetExceeded,
+                                         get_statement_budget,
+                                         guard_statements)
+from tugastugas.tracing import start_span
+
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+
+
+def get_query_cache_size():
+    """Reads the number of documents kept by the cache.
+
+      It uses the GRAPHQL_QUERY_CACHE_SIZE environment variable
+      (defaults to "1000"). Zero disables the cache.
+
+      Returns:
+      int: The maximum number of cached documents.
+    """
+    return int(os.getenv("GRAPHQL_QUERY_CACHE_SIZE", "1000"))
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used entry.
+
+      `CachingGraphQLApp` uses it for validated documents keyed by query hash
+      and for introspection responses. Once `max_size` entries are stored,
+      adding another one evicts the entry that was read or written least
+      recently. It is safe to share between threads.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[Any, Any] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class ExpiringLRUCache(LRUCache):
+    """`LRUCache` whose entries also expire.
+
+      Every entry is stored with the time at which it expires, as read from
+      `clock`, and is dropped when it is read at or after that time.
+    """
+
+    def __init__(self,
+                 max_size: int,
+                 clock: Callable[[], float] = time.time) -> None:
+        super().__init__(max_size)
+        self.clock = clock
+
+    def get(self, key: Any, now: float | None = None) -> Any:
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= (self.clock() if now is None else now):
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            return None
+        return value
+
+    def put(self, key: Any, value: Any, expires_at: float) -> None:
+        super().put(key, (expires_at, value))
+
+
+def hash_query(query: str) -> str:
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def is_introspection(document: DocumentNode, operation_name: str | None):
+    """Tells whether the operation only selects introspection fields."""
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != OperationType.QUERY:
+        return False
+    return all(
+        getattr(selection, "name", None) is not None
+        and selection.name.value.startswith("__")
+        for selection in operation.selection_set.selections)
+
+
+class CachingGraphQLApp(GraphQLApp):
+    """`GraphQLApp` skipping parsing and validation for known queries.
+
+      It replaces the HTTP handler of `starlette_graphene3.GraphQLApp`; the
+      websocket handler is inherited unchanged.
+
+      * Arguments:
+      * `cache_size` (int, optional): Number of documents kept in the LRU,
+        defaults to `get_query_cache_size()`.
+      * `max_cost` (int, optional): Cost budget of an operation, defaults to
+        `get_max_query_cost()`.
+      * `max_depth` (int, optional): Maximum depth of an operation, defaults
+        to `get_max_query_depth()`.
+      * `statement_budget` (StatementBudget, optional): Limits of the SQL
+        statements of an operation, defaults to `get_statement_budget()`.
+      * Other keyword arguments are passed to `GraphQLApp`.
+
+      The `_handle_http_request` method performs the following steps:
+
+      1. Finds the query hash from `extensions.persistedQuery.sha256Hash` or
+         by hashing the query text, and rejects a hash not matching the text.
+      2. Looks the validated document up in the cache. On a miss, the query
+         text is required (`PersistedQueryNotFound` otherwise); it is parsed,
+         validated and stored.
+      3. Checks the cost and the depth of the operation with the variables
+         of the request (see `query_cost_rule`). The result is cached by
+         query hash, operation name and values of the variables giving
+         sizes, so a cache hit is not validated again.
+      4. Returns the cached response of an introspection operation, or
+         executes the document and caches the response if it is one.
+         The cost is reported in `extensions.cost` of the response, and the
+         execution time in `tugastugas.metrics.OPERATION_SECONDS`. An
+         operation exceeding the statement budget is logged, or answered
+         with an error if the budget raises.
+
+      Only documents that passed validation are cached, so a cache hit is
+      executed right away.
+    """
+
+    def __init__(self,
+                 *args,
+                 cache_size: int | None = None,
+                 max_cost: int | None = None,
+                 max_depth: int | None = None,
+                 statement_budget=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        if cache_size is None:
+            cache_size = get_query_cache_size()
+        self.max_cost = get_max_query_cost() if max_cost is None else max_cost
+        self.max_depth = get_max_query_depth(
+        ) if max_depth is None else max_depth
+        self.statement_budget = get_statement_budget(
+        ) if statement_budget is None else statement_budget
+        self.documents = LRUCache(cache_size)
+        self.costs = LRUCache(cache_size)
+        self.introspection_results = LRUCache(cache_size)
+
+    def _errors_response(self, errors, extensions=None) -> JSONResponse:
+        response: Dict[str, Any] = {
+            "data": None,
+            "errors": [self.error_formatter(error) for error in errors]
+        }
+        if extensions:
+            response["extensions"] = extensions
+        return JSONResponse(response, status_code=200)
+
+    async def _handle_http_request(self, request: Request) -> JSONResponse:
+        try:
+            operation = await _get_operation_from_request(request)
+        except ValueError as e:
+            return JSONResponse({"errors": [e.args[0]]}, status_code=400)
+
+        if not isinstance(operation, dict):
+            return JSONResponse(
+                {"errors": ["This server does not support batching"]},
+                status_code=400)
+
+        query = operation.get("query")
+        variable_values = operation.get("variables")
+        operation_name = operation.get("operationName")
+        request_extensions = operation.get("extensions") or {}
+        persisted_query = {}
+        if isinstance(request_extensions, dict):
+            persisted_query = request_extensions.get("persistedQuery") or {}
+        query_hash = None
+        if isinstance(persisted_query, dict):
+            query_hash = persisted_query.get("sha256Hash")
+        for value, description in [
+            (query, "query"),
+            (operation_name, "operationName"),
+            (query_hash, "extensions.persistedQuery.sha256Hash"),
+        ]:
+            if value is not None and not isinstance(value, str):
+                return JSONResponse(
+                    {"errors": [f"{description} must be a string"]},
+                    status_code=400)
+        for value, description in [
+            (variable_values, "variables"),
+            (request_extensions, "extensions"),
+            (persisted_query, "extensions.persistedQuery"),
+        ]:
+            if value is not None and not isinstance(value, dict):
+                return JSONResponse(
+                    {"errors": [f"{description} must be an object"]},
+                    status_code=400)
+
+        if query is not None:
+            if query_hash is None:
+                query_hash = hash_query(query)
+            elif query_hash != hash_query(query):
+                return JSONResponse(
+                    {"errors": ["provided sha does not match query"]},
+                    status_code=400)
+        elif query_hash is None:
+            return JSONResponse({"errors": ["The query is missing"]},
+                                status_code=400)
+
+        cached_document = self.documents.get(query_hash)
+        if cached_document is None:
+            if query is None:
+                return self._errors_response([
+                    GraphQLError(
+                        PERSISTED_QUERY_NOT_FOUND,
+                        extensions={"code": "PERSISTED_QUERY_NOT_FOUND"})
+                ])
+            with start_span("graphql.parse"):
+                try:
+                    document = parse(query)
+                except GraphQLError as error:
+                    return self._errors_response([error])
+                validation_errors = validate(self.schema.graphql_schema,
+                                             document)
+            if validation_errors:
+                return self._errors_response(validation_errors)
+            cached_document = (document, size_variables(document))
+            self.documents.put(query_hash, cached_document)
+        document, cost_variables = cached_document
+
+        # Lists only count by their length
+        sizes = [
+            len(value) if isinstance(value, list) else value
+            for value in map((variable_values or {}).get, cost_variables)
+        ]
+        cost_key = (query_hash, operation_name, json.dumps(sizes,
+                                                           default=str))
+        cost = self.costs.get(cost_key)
+        if cost is None:
+            costs: list[int] = []
+            cost_errors = validate(self.schema.graphql_schema, document, [
+                query_cost_rule(self.max_cost, self.max_depth,
+                                operation_name, variable_values, costs)
+            ])
+            cost = (max(costs, default=0), cost_errors)
+            self.costs.put(cost_key, cost)
+        requested_cost, cost_errors = cost
+        extensions = {
+            "cost": {
+                "requested": requested_cost,
+                "maximum": self.max_cost
+            }
+        }
+        if cost_errors:
+            return self._errors_response(cost_errors, extensions)
+
+        introspection_key = None
+        if not variable_values and is_introspection(document, operation_name):
+            introspection_key = (query_hash, operation_name)
+            cached_response = self.introspection_results.get(introspection_key)
+            if cached_response is not None:
+                return JSONResponse(cached_response, status_code=200)
+
+        context_value = await self._get_context_value(request)
+        operation_node = get_operation_ast(document, operation_name)
+        operation_type, name = "operation", "anonymous"
+        if operation_node is not None:
+            operation_type = operation_node.operation.value
+            if operation_node.name is not None:
+                name = operation_node.name.value
+        start = time.perf_counter()
+        guard = contextlib.nullcontext()
+        if self.statement_budget is not None:
+            guard = guard_statements(
+                self.statement_budget,
+                "The operation" if name == "anonymous" else name)
+        try:
+            with guard, start_span(f"{operation_type} {name}", attributes={
+                    "graphql.operation.type": operation_type,
+                    "graphql.operation.name": name
+            }):
+                result = execute(
+                    self.schema.graphql_schema,
+                    document,
+                    context_value=context_value,
+                    root_value=self.root_value,
+                    middleware=self.middleware,
+                    variable_values=variable_values,
+                    operation_name=operation_name,
+                    execution_context_class=self.execution_context_class,
+                )
+                if isawaitable(result):
+                    result = await result
+        except StatementBudgetExceeded as error:
+            return self._errors_response([GraphQLError(str(error))],
+                                         extensions)
+        if operation_node is not None:
+            OPERATION_SECONDS.observe(time.perf_counter() - start,
+                                      operation_type, name)
+
+        response: Dict[str, Any] = {
+            "data": result.data,
+            "extensions": extensions
+        }
+        if result.errors:
+            for error in result.errors:
+                if error.original_error:
+                    self.logger.error(
+                        "An exception occurred in resolvers",
+                        exc_info=error.original_error,
+                    )
+            response["errors"] = [
+                self.error_formatter(error) for error in result.errors
+            ]
+        elif introspection_key is not None:
+            self.introspection_results.put(introspection_key, response)
+
+        return JSONResponse(
+            response,
+            status_code=200,
+            background=context_value.get("background"),
+        )
@@ -0,0 +1,366 @@
+"""Metrics in the Prometheus text format, served at `/metrics`.
+
+The metrics are kept in process by small counter, gauge and histogram classes
+from the standard library. Recording is a lock, a `bisect` and two additions,
+so it can stay on in production:
+
+* `GraphQLMetricsMiddleware` (graphene middleware) times the root fields of
+  every operation and the fields resolved asynchronously, e.g. the usernames
+  of `TaskNode`. Other fields return right away and are not recorded.
+  `CachingGraphQLApp` times whole operations.
+* `RequestMetricsMiddleware` (ASGI middleware) times requests and totals the
+  SQL statements they run and the time spent in them. The totals are
+  collected by the engine events installed by `instrument_engine`.
+* The pools of instrumented engines are reported at scrape time: checked-out
+  and overflow connections, and how many requests wait for one. The wait
+  itself is timed by `MeteredQueuePool` and `MeteredAsyncAdaptedQueuePool`.
+* `register_tasks_cache` reports the hits and misses of `tugastugas.cache`.
+
+Metrics of one process are served; with several workers, every worker has
+to be scraped on its own.
+"""
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from inspect import isawaitable
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"'
+                          for name, value in zip(names, escaped)) + "}"
+
+
+class Registry:
+    """The metrics rendered by `/metrics`."""
+
+    def __init__(self) -> None:
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric) -> None:
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Base of the metric types.
+
+      * Arguments:
+      * `name` (str): The metric name.
+      * `documentation` (str): The HELP text.
+      * `labelnames` (tuple): The names of the labels; values are passed
+        positionally when recording.
+      * `function` (callable, optional): Makes the metric read its samples,
+        as (label values, value) pairs, when it is rendered instead of
+        recording them.
+    """
+    type_name = "untyped"
+
+    def __init__(self,
+                 name,
+                 documentation,
+                 labelnames=(),
+                 function=None,
+                 registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def samples(self):
+        if self.function is not None:
+            return [(tuple(labels), value) for labels, value in self.function()]
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}\n",
+            f"# TYPE {self.name} {self.type_name}\n"
+        ]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)}"
+                         f" {format_value(value)}\n")
+        return "".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """Histogram with fixed upper bounds (`buckets`).
+
+      Every label set keeps one count per bucket, the sum and the count of
+      the observations.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(buckets) + (math.inf, )
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}\n",
+            f"# TYPE {self.name} histogram\n"
+        ]
+        with self.lock:
+            states = [(labels, list(counts), total, count)
+                      for labels, (counts, total, count) in self.values.items()]
+        names = self.labelnames + ("le", )
+        for labels, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{format_labels(names, labels + (format_value(bound), ))}"
+                    f" {cumulative}\n")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {format_value(total)}\n")
+            lines.append(f"{self.name}_count{label_text} {count}\n")
+        return "".join(lines)
+
+
+OPERATION_SECONDS = Histogram("tugastugas_graphql_operation_seconds",
+                              "Latency of GraphQL operations.",
+                              ("type", "name"))
+FIELD_SECONDS = Histogram(
+    "tugastugas_graphql_field_seconds",
+    "Latency of root and asynchronously resolved GraphQL fields.",
+    ("field", ))
+REQUEST_SECONDS = Histogram("tugastugas_http_request_seconds",
+                            "Latency of HTTP requests.", ("path", ))
+REQUEST_SQL_STATEMENTS = Histogram(
+    "tugastugas_http_request_sql_statements",
+    "SQL statements run by an HTTP request.", ("path", ),
+    buckets=STATEMENT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    "tugastugas_http_request_sql_seconds",
+    "Time an HTTP request spent running SQL statements.", ("path", ))
+SQL_STATEMENTS = Counter("tugastugas_sql_statements_total",
+                         "SQL statements run.", ("engine", ))
+SQL_SECONDS = Histogram("tugastugas_sql_statement_seconds",
+                        "Latency of SQL statements.", ("engine", ))
+POOL_WAIT_SECONDS = Histogram(
+    "tugastugas_db_pool_wait_seconds",
+    "Time spent waiting for a connection from the pool.", ("engine", ))
+POOL_WAITING = Gauge("tugastugas_db_pool_waiting",
+                     "Requests waiting for a connection from the pool.",
+                     ("engine", ))
+
+# Engines passed to instrument_engine, by engine label. The pool is looked
+# up at scrape time because Engine.dispose() replaces it.
+engines = {}
+
+
+def pool_samples(method):
+
+    def samples():
+        return [((name, ), getattr(engine.pool, method)())
+                for name, engine in list(engines.items())]
+
+    return samples
+
+
+POOL_SIZE = Gauge("tugastugas_db_pool_size",
+                  "Connections kept open by the pool.", ("engine", ),
+                  function=pool_samples("size"))
+POOL_CHECKED_OUT = Gauge("tugastugas_db_pool_checked_out",
+                         "Connections in use.", ("engine", ),
+                         function=pool_samples("checkedout"))
+POOL_OVERFLOW = Gauge(
+    "tugastugas_db_pool_overflow",
+    "Connections opened beyond the pool size (negative while the pool is"
+    " not full).", ("engine", ),
+    function=pool_samples("overflow"))
+
+
+class RequestStats:
+    """SQL statements run by the current request and the time they took."""
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.seconds = 0.0
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name):
+    """Counts and times the statements of `engine`, and reports its pool.
+
+      `engine` may be an `Engine` or an `AsyncEngine`; `name` is the value
+      of the `engine` label.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    engines[name] = sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info["metrics_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        start = conn.info.pop("metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        SQL_STATEMENTS.inc(name)
+        SQL_SECONDS.observe(elapsed, name)
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+
+
+class MeteredPoolMixin:
+    """Times how long checkouts wait for a connection.
+
+      `metrics_name` is the value of the `engine` label, the same as the one
+      given to `instrument_engine` by `tugastugas.database`.
+    """
+    metrics_name = "default"
+
+    def _do_get(self):
+        POOL_WAITING.inc(self.metrics_name)
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start,
+                                      self.metrics_name)
+            POOL_WAITING.dec(self.metrics_name)
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class MeteredAsyncAdaptedQueuePool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+class GraphQLMetricsMiddleware:
+    """Graphene middleware timing root fields and asynchronous fields."""
+
+    def resolve(self, next, root, info, **args):
+        start = time.perf_counter()
+        result = next(root, info, **args)
+        if isawaitable(result):
+            return self.observe_async(result, info, start)
+        if info.path.prev is None:
+            FIELD_SECONDS.observe(time.perf_counter() - start,
+                                  f"{info.parent_type.name}.{info.field_name}")
+        return result
+
+    async def observe_async(self, result, info, start):
+        try:
+            return await result
+        finally:
+            FIELD_SECONDS.observe(time.perf_counter() - start,
+                                  f"{info.parent_type.name}.{info.field_name}")
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing HTTP requests and totalling their SQL.
+
+      It should come first, so that rejected requests are timed as well.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
+            path = scope["path"]
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path)
+            REQUEST_SQL_STATEMENTS.observe(stats.statements, path)
+            REQUEST_SQL_SECONDS.observe(stats.seconds, path)
+
+
+def register_tasks_cache(tasks_cache, registry=REGISTRY):
+    """Reports the hits and misses of a `TasksCache` (see `tugastugas.cache`)."""
+    Counter("tugastugas_tasks_cache_hits_total",
+            "Pages of Query.tasks served from the cache.",
+            function=lambda: [((), tasks_cache.hits)],
+            registry=registry)
+    Counter("tugastugas_tasks_cache_misses_total",
+            "Pages of Query.tasks not found in the cache.",
+            function=lambda: [((), tasks_cache.misses)],
+            registry=registry)
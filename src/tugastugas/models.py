@@ -5,10 +5,12 @@ from sqlalchemy import text
 from sqlalchemy import Table
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import Computed
 from sqlalchemy import false
 from sqlalchemy.types import TIMESTAMP
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from tugastugas.database import Base
 from sqlalchemy.orm import relationship
 
@@ -31,12 +33,39 @@ class User(Base):
 #    tasks:Mapped[List["Task"]] = relationship(foreign_keys=["task.creator_id"])
 
 
+# Text search configuration of the full-text search of Query.tasks
+SEARCH_CONFIG = 'english'
+
+# Document searched by Query.tasks(search: ...); matches in the title rank
+# higher than matches in the description
+SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A')"
+    f" || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')),"
+    " 'B')")
+
+
 class Task(Base):
     """
     Basic task model
+
+    `search_vector` is generated by PostgreSQL from the title and the
+    description, and indexed with GIN for `Query.tasks(search: ...)`. It is
+    deferred, so it is only loaded when asked for.
     """
 
     __tablename__ = "task"
+    # Indexes for the filters of Query.tasks. The trailing id column lets the
+    # same index serve the keyset pagination order, and the orders of
+    # TaskOrder on status, due_date and title in both directions.
+    __table_args__ = (
+        Index('ix_task_status_id', 'status', 'id'),
+        Index('ix_task_creator_id_id', 'creator_id', 'id'),
+        Index('ix_task_last_modifier_id_id', 'last_modifier_id', 'id'),
+        Index('ix_task_due_date_id', 'due_date', 'id'),
+        Index('ix_task_title_id', 'title', 'id'),
+        Index('ix_task_search_vector', 'search_vector',
+              postgresql_using='gin'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[String] = mapped_column(String())
@@ -49,6 +78,10 @@ class Task(Base):
     last_modifier: Mapped["User"] = relationship(
         foreign_keys=[last_modifier_id])
     from_undo: Mapped[bool] = mapped_column(Boolean, server_default=false())
+    search_vector: Mapped[str] = mapped_column(TSVECTOR,
+                                               Computed(SEARCH_VECTOR,
+                                                        persisted=True),
+                                               deferred=True)
 
 
 # Adapted from cxↄ's comment on Stackoverflow https://stackoverflow.com/a/66453481/4685140
@@ -64,7 +97,8 @@ class HTask(Base):
       * `target_row_id` (int, not null): ID of the task object the operation was performed on.
       * `executed_operation 1-CREATE 2-DELETE 3-UPDATE
       * `operation_executed_at` (datetime, not null): Timestamp of when the operation was executed.
-    * `data_after_executed_operation` is for storing the entire task row
+    * `data_after_executed_operation` is for storing the entire task row, or
+      only the old values of the modified columns for an UPDATE
       * `from_undo` (bool): Flag indicating if this record is a result of an undo operation.
       * `user_id` (int, foreign key): ID of the user who performed the operation (foreign key to user.id).
       * `user` (User, relationship): Relationship to the User model for retrieving user information.
@@ -72,13 +106,30 @@ class HTask(Base):
       in an undo operation (defaults to False).
 
       This model is likely used to implement undo functionalities for tasks. 
+
+      The table is partitioned by month of `operation_executed_at` (see the
+      migration 8e1a6f4b2c90 and `tugastugas.retention`), so the timestamp is
+      part of the primary key.
     """
     __tablename__ = 'h_task'
-    id: Mapped[int] = mapped_column(primary_key=True)
+    __table_args__ = (
+        # Supports the lookup of the latest undoable record in undo_task_action;
+        # the id orders the records written in the same transaction
+        Index('ix_h_task_undo',
+              'user_id',
+              text('operation_executed_at DESC'),
+              text('id DESC'),
+              postgresql_where=text('NOT used')),
+        {
+            'postgresql_partition_by': 'RANGE (operation_executed_at)'
+        },
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     target_row_id: Mapped[int] = mapped_column(String(), nullable=False)
     executed_operation: Mapped[int] = mapped_column(Integer(), nullable=False)
     operation_executed_at: Mapped[datetime.datetime] = mapped_column(
         TIMESTAMP(timezone=False),
+        primary_key=True,
         nullable=False,
         server_default=text('now()'))
     data_after_executed_operation: Mapped[dict] = mapped_column(JSONB,
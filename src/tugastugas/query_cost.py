@@ -0,0 +1,250 @@
+"""Cost and depth limits of GraphQL operations.
+
+`Query.tasks` returns up to `MAX_PAGE_SIZE` tasks per selection, and a client
+can repeat the selection under many aliases. The validation rule made by
+`query_cost_rule` estimates how much work an operation asks for before it is
+executed, and rejects operations over budget:
+
+* Every field costs its weight, 1 unless `FIELD_WEIGHTS` says otherwise.
+* Below a field taking `first`/`last`, list fields like `edges` are multiplied
+  by the requested page size (`DEFAULT_PAGE_SIZE` when neither is given).
+  Other list fields are bounded by their arguments and counted once.
+* A field working on many items, e.g. `createTasks` or `undoTask`, has its
+  weight and its list fields multiplied by the size of the argument listed
+  in `SIZE_ARGUMENTS`: the length of a list, literal or given by a
+  variable, or the value of an integer.
+* Introspection fields (`__schema`, `__typename`, ...) are free.
+
+The cost only depends on the document, the operation and the variables
+giving sizes, listed by `size_variables`, so callers can cache it.
+"""
+
+import os
+from typing import Any, Dict, List
+from graphql import (ArgumentNode, DocumentNode, FieldNode,
+                     FragmentSpreadNode, GraphQLError, InlineFragmentNode,
+                     ListValueNode, OperationDefinitionNode, ValidationRule,
+                     VariableNode, Visitor, get_named_type,
+                     get_nullable_type, is_list_type, value_from_ast, visit)
+from tugastugas.schema import DEFAULT_PAGE_SIZE, MAX_UNDO_STEPS
+
+FIELD_WEIGHTS = {
+    # One SQL statement each
+    "Query.tasks": 10,
+    "Mutation.createTask": 10,
+    "Mutation.createTasks": 10,
+    "Mutation.deleteTask": 10,
+    "Mutation.updateTask": 10,
+    "Mutation.undoTask": 10,
+    # Batched username lookups
+    "TaskNode.creator": 2,
+    "TaskNode.lastModifier": 2,
+}
+
+PAGE_SIZE_ARGUMENTS = ("first", "last")
+
+# The argument giving the number of items a field works on, and the number
+# when it is missing
+SIZE_ARGUMENTS = {
+    "Mutation.createTasks": ("input", 0),
+    "Mutation.undoTask": ("steps", 1),
+}
+
+# Arguments raising the number of items when the size argument is missing:
+# undoTask(untilTimestamp) undoes up to MAX_UNDO_STEPS actions
+DEFAULT_SIZE_ARGUMENTS = {
+    "Mutation.undoTask": ("untilTimestamp", MAX_UNDO_STEPS),
+}
+
+
+def get_max_query_cost():
+    """Reads the cost budget of one operation.
+
+      It uses the GRAPHQL_MAX_COST environment variable (defaults to "20000").
+
+      Returns:
+      int: The maximum cost of an operation.
+    """
+    return int(os.getenv("GRAPHQL_MAX_COST", "20000"))
+
+
+def get_max_query_depth():
+    """Reads the maximum nesting of fields in one operation.
+
+      It uses the GRAPHQL_MAX_DEPTH environment variable (defaults to "10").
+
+      Returns:
+      int: The maximum depth of an operation.
+    """
+    return int(os.getenv("GRAPHQL_MAX_DEPTH", "10"))
+
+
+def size_variables(document: DocumentNode) -> list[str]:
+    """Lists the variables giving `first`/`last` or an argument of
+    `SIZE_ARGUMENTS` anywhere in `document`."""
+    size_arguments = set(PAGE_SIZE_ARGUMENTS) | {
+        argument
+        for argument, _ in SIZE_ARGUMENTS.values()
+    }
+    names: set[str] = set()
+
+    class SizeVisitor(Visitor):
+
+        def enter_argument(self, node: ArgumentNode, *_args):
+            if node.name.value in size_arguments and isinstance(
+                    node.value, VariableNode):
+                names.add(node.value.name.value)
+
+    visit(document, SizeVisitor())
+    return sorted(names)
+
+
+def query_cost_rule(max_cost: int,
+                    max_depth: int,
+                    operation_name: str | None = None,
+                    variable_values: Dict[str, Any] | None = None,
+                    costs: List[int] | None = None):
+    """Makes a validation rule limiting the cost and depth of an operation.
+
+      The limits depend on the variables of the request (e.g. `first: $n`), so
+      a rule class is made for every request and passed to
+      `graphql.validate`.
+
+      * Arguments:
+      * `max_cost` (int): Operations costing more are rejected.
+      * `max_depth` (int): Operations nesting fields deeper are rejected.
+      * `operation_name` (str, optional): The operation to be executed; every
+        operation of the document is checked when omitted.
+      * `variable_values` (dict, optional): The variables of the request.
+      * `costs` (list, optional): The computed cost is appended to it, so
+        the caller can report it.
+
+      Returns:
+      type: A `ValidationRule` subclass.
+    """
+
+    class QueryCostRule(ValidationRule):
+
+        def enter_operation_definition(self, node: OperationDefinitionNode,
+                                       *_args):
+            if operation_name is not None and (
+                    node.name is None or node.name.value != operation_name):
+                return self.SKIP
+            root_type = self.context.schema.get_root_type(node.operation)
+            cost, depth = self.measure(root_type, node.selection_set, 1,
+                                       set(), 1)
+            if costs is not None:
+                costs.append(cost)
+            if depth > max_depth:
+                self.report_error(
+                    GraphQLError(
+                        f'The query depth {depth} exceeds the maximum depth'
+                        f' of {max_depth}.', node))
+            if cost > max_cost:
+                self.report_error(
+                    GraphQLError(
+                        f'The query cost {cost} exceeds the maximum cost'
+                        f' of {max_cost}.', node))
+            return self.SKIP
+
+        def measure(self, parent_type, selection_set, depth, fragments,
+                    page_size):
+            """Returns the cost and the depth of a selection set.
+
+              `page_size` is the number of items of list fields in the
+              selection set.
+            """
+            cost, max_seen_depth = 0, depth - 1
+            for selection in selection_set.selections:
+                if isinstance(selection, FieldNode):
+                    name = selection.name.value
+                    field = getattr(parent_type, "fields", {}).get(name)
+                    if name.startswith("__") or field is None:
+                        continue
+                    coordinate = f'{parent_type.name}.{name}'
+                    size = self.size(selection, field, coordinate)
+                    child_cost, child_depth = 0, depth
+                    if selection.selection_set is not None:
+                        child_cost, child_depth = self.measure(
+                            get_named_type(field.type),
+                            selection.selection_set, depth + 1, fragments,
+                            size)
+                    weight = FIELD_WEIGHTS.get(coordinate, 1)
+                    if coordinate in SIZE_ARGUMENTS:
+                        weight *= size
+                    field_cost = weight + child_cost
+                    if is_list_type(get_nullable_type(field.type)):
+                        field_cost *= page_size
+                    cost += field_cost
+                    max_seen_depth = max(max_seen_depth, child_depth)
+                    continue
+                if isinstance(selection, InlineFragmentNode):
+                    fragment_type = parent_type
+                    if selection.type_condition is not None:
+                        fragment_type = self.context.schema.get_type(
+                            selection.type_condition.name.value)
+                    selections = selection.selection_set
+                    inner_fragments = fragments
+                elif isinstance(selection, FragmentSpreadNode):
+                    name = selection.name.value
+                    fragment = self.context.get_fragment(name)
+                    if fragment is None or name in fragments:
+                        continue
+                    fragment_type = self.context.schema.get_type(
+                        fragment.type_condition.name.value)
+                    selections = fragment.selection_set
+                    # Only within the fragment: siblings may spread it again
+                    inner_fragments = fragments | {name}
+                else:
+                    continue
+                fragment_cost, fragment_depth = self.measure(
+                    fragment_type, selections, depth, inner_fragments,
+                    page_size)
+                cost += fragment_cost
+                max_seen_depth = max(max_seen_depth, fragment_depth)
+            return cost, max_seen_depth
+
+        @staticmethod
+        def size(node: FieldNode, field, coordinate: str) -> int:
+            """Returns the number of items of the list fields below `node`,
+            which is also the number of items a field of `SIZE_ARGUMENTS`
+            works on."""
+            if coordinate in SIZE_ARGUMENTS:
+                name, default = SIZE_ARGUMENTS[coordinate]
+                arguments = {
+                    argument.name.value: argument.value
+                    for argument in node.arguments
+                }
+                value = arguments.get(name)
+                if value is None:
+                    if coordinate in DEFAULT_SIZE_ARGUMENTS:
+                        other_name, other_default = DEFAULT_SIZE_ARGUMENTS[
+                            coordinate]
+                        if other_name in arguments:
+                            return other_default
+                    return default
+                if isinstance(value, ListValueNode):
+                    return len(value.values)
+                if isinstance(value, VariableNode):
+                    value = (variable_values or {}).get(value.name.value)
+                else:
+                    value = value_from_ast(value, field.args[name].type)
+                if isinstance(value, list):
+                    return len(value)
+                if isinstance(value, int):
+                    return max(value, 0)
+                # A single value is coerced into a list of one
+                return default if value is None else 1
+            if not any(name in field.args for name in PAGE_SIZE_ARGUMENTS):
+                return 1
+            for argument in node.arguments:
+                if argument.name.value in PAGE_SIZE_ARGUMENTS:
+                    page_size = value_from_ast(
+                        argument.value,
+                        field.args[argument.name.value].type,
+                        variable_values)
+                    if isinstance(page_size, int):
+                        return max(page_size, 0)
+            return DEFAULT_PAGE_SIZE
+
+    return QueryCostRule
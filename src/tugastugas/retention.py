@@ -0,0 +1,209 @@
+"""Maintenance of the task history.
+
+`h_task` is partitioned by month (see the migration 8e1a6f4b2c90). The
+migration only creates the partitions of the month it runs in and of the two
+following ones; later partitions are created by this command, which must be
+scheduled (e.g. daily from cron). It does the following:
+
+1. Creates the partitions of the current month and of the next
+   `--months-ahead` months, so that new records do not land in the default
+   partition.
+2. With `--keep-days`, archives every monthly partition whose records are
+   all older than the horizon, then detaches and drops it. Dropping a whole
+   partition leaves no dead tuples behind, unlike a DELETE.
+3. With `--keep-used-days`, archives and deletes the records already used by
+   an undo that are older than the horizon.
+
+Archives are gzip-compressed CSV files written by `COPY ... TO STDOUT` into
+`--archive-dir`. A file is written under a `.partial` name, completely,
+before the transaction removing its records commits, so records are never
+dropped without being archived. It only gets its final name once the
+transaction has committed, and is deleted if the transaction fails, so an
+archive always stands for records that are gone from `h_task`.
+
+If it is not run, the records of later months pile up in the default
+partition, which cannot be archived and dropped by month, and are only moved
+out when the command runs again.
+
+Usage::
+
+    tugastugas-retention --keep-days 365 --keep-used-days 30
+"""
+
+import argparse
+import contextlib
+import datetime
+import gzip
+import os
+import re
+from psycopg import sql
+from sqlalchemy import create_engine
+from tugastugas.database import get_url
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def create_partitions(cursor, months_ahead):
+    cursor.execute("SELECT create_h_task_partitions(%s)", (months_ahead, ))
+    return [name for name, in cursor.fetchall()]
+
+
+def get_horizon(cursor, keep_days):
+    """Returns the time `keep_days` days ago, in the time zone of
+    `h_task.operation_executed_at`."""
+    cursor.execute(
+        "SELECT CAST(now() - make_interval(days => %s) AS TIMESTAMP)",
+        (keep_days, ))
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor):
+    """Returns the name and the range of every monthly partition of
+    `h_task`, leaving the default partition out."""
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+          FROM pg_inherits AS i
+          JOIN pg_class AS c ON c.oid = i.inhrelid
+          WHERE i.inhparent = 'h_task'::regclass
+          ORDER BY c.relname""")
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = PARTITION_BOUND.search(bound)
+        if match is None:
+            continue
+        lower, upper = (datetime.datetime.fromisoformat(value)
+                        for value in match.groups())
+        partitions.append((name, lower, upper))
+    return partitions
+
+
+@contextlib.contextmanager
+def archive_file(path):
+    """Yields the temporary name of the archive `path`, which is renamed to
+    `path` when the block succeeds and deleted when it fails.
+
+      The transaction removing the archived records has to be committed
+      inside the block.
+    """
+    partial_path = path + ".partial"
+    try:
+        yield partial_path
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, path)
+
+
+def copy_to_archive(cursor, query, path):
+    """Writes the result of `query` to a gzip-compressed CSV file.
+
+      Returns:
+      int: The number of archived records.
+    """
+    statement = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)")
+    with gzip.open(path, "wb") as archive:
+        with cursor.copy(statement.format(query)) as copy:
+            for data in copy:
+                archive.write(data)
+    return cursor.rowcount
+
+
+def archive_partitions(connection, horizon, archive_dir):
+    """Archives, detaches and drops the partitions older than `horizon`.
+
+      Returns:
+      list: The name, archive path and number of records of every dropped
+      partition.
+    """
+    archived = []
+    with connection.cursor() as cursor:
+        partitions = list_partitions(cursor)
+    for name, _, upper in partitions:
+        if upper > horizon:
+            continue
+        path = os.path.join(archive_dir, f"{name}.csv.gz")
+        with archive_file(path) as partial_path:
+            with connection.transaction(), connection.cursor() as cursor:
+                count = copy_to_archive(
+                    cursor,
+                    sql.SQL("SELECT * FROM {}").format(sql.Identifier(name)),
+                    partial_path)
+                cursor.execute(
+                    sql.SQL("ALTER TABLE h_task DETACH PARTITION {}").format(
+                        sql.Identifier(name)))
+                cursor.execute(
+                    sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        archived.append((name, path, count))
+    return archived
+
+
+def archive_used_records(connection, horizon, archive_dir):
+    """Archives and deletes the used records older than `horizon`.
+
+      Returns:
+      tuple: The archive path and the number of records.
+    """
+    path = os.path.join(
+        archive_dir, f"h_task_used_before_{horizon:%Y%m%dT%H%M%S}.csv.gz")
+    with archive_file(path) as partial_path:
+        with connection.transaction(), connection.cursor() as cursor:
+            count = copy_to_archive(
+                cursor,
+                sql.SQL("DELETE FROM h_task"
+                        " WHERE used AND operation_executed_at < {}"
+                        " RETURNING *").format(sql.Literal(horizon)),
+                partial_path)
+    return path, count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="tugastugas-retention",
+        description="Create, archive and drop partitions of the task history.")
+    parser.add_argument("--months-ahead",
+                        type=int,
+                        default=2,
+                        help="partitions to create after the current month")
+    parser.add_argument("--keep-days",
+                        type=int,
+                        help="archive and drop partitions older than this")
+    parser.add_argument(
+        "--keep-used-days",
+        type=int,
+        help="archive and delete used records older than this")
+    parser.add_argument("--archive-dir",
+                        default="h_task_archive",
+                        help="directory of the archives")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(get_url())
+    raw_connection = engine.raw_connection()
+    try:
+        connection = raw_connection.driver_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            for name in create_partitions(cursor, args.months_ahead):
+                print(f"Partition {name} is ready")
+        if args.keep_days is None and args.keep_used_days is None:
+            return
+        os.makedirs(args.archive_dir, exist_ok=True)
+        if args.keep_days is not None:
+            with connection.cursor() as cursor:
+                horizon = get_horizon(cursor, args.keep_days)
+            for name, path, count in archive_partitions(
+                    connection, horizon, args.archive_dir):
+                print(f"Archived {count} records of {name} to {path}")
+        if args.keep_used_days is not None:
+            with connection.cursor() as cursor:
+                horizon = get_horizon(cursor, args.keep_used_days)
+            path, count = archive_used_records(connection, horizon,
+                                               args.archive_dir)
+            print(f"Archived {count} used records to {path}")
+    finally:
+        raw_connection.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 """
 GraphQL schema
 """
+import base64
+import datetime
+import json
 from typing import Any
 from graphql import GraphQLError
+from graphql import ExecutionContext
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode
 import graphene
+from graphene import relay
 from graphene import ObjectType
 from graphene import String
 from graphene import Date
@@ -11,12 +17,47 @@ from graphene import Field
 from graphene import Mutation
 from graphene import Int
 from graphene import List
+from graphene import NonNull
+from graphene import InputObjectType
 from graphene_sqlalchemy import SQLAlchemyObjectType
 from graphene_sqlalchemy.types import ORMField
 from graphene_sqlalchemy.utils import get_session
-from sqlalchemy import select, delete, text
-from sqlalchemy.orm import aliased
-from tugastugas.models import User, Task
+from graphene.utils.dataloader import DataLoader
+from graphene.utils.str_converters import to_snake_case
+from sqlalchemy import select, insert, text, any_, bindparam
+from sqlalchemy import and_, cast, func, literal_column, or_, tuple_
+from sqlalchemy import Integer, REAL
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased, load_only
+from tugastugas.models import SEARCH_CONFIG, User, Task
+from tugastugas.tracing import start_span
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_UNDO_STEPS = 1000
+MAX_BULK_CREATE = 1000
+
+
+class UserLoader(DataLoader):
+    """Request-scoped loader batching username lookups by user ID.
+
+      Every `load` call made while one GraphQL execution pass is running is
+      collected and resolved by a single `WHERE id = ANY(...)` query, so
+      listing N tasks costs one query on `user` instead of up to 2N.
+
+      A new loader has to be created for every request (see
+      `app.get_context_value`) because it caches the usernames it has loaded.
+    """
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    async def batch_load_fn(self, user_ids):
+        stmt = select(User.id, User.username).where(User.id == any_(
+            bindparam('user_ids', list(user_ids), type_=ARRAY(Integer))))
+        usernames = dict((await self.session.execute(stmt)).all())
+        return [usernames.get(user_id) for user_id in user_ids]
 
 
 class TaskNode(SQLAlchemyObjectType):
@@ -31,33 +72,442 @@ class TaskNode(SQLAlchemyObjectType):
     * `id`: the ID field has to be forced its type to be integer to prevent generated ID.
     * `creator`: A field representing the username of the task creator (string).
     * `last_modifier`: A field representing the username of the last modifier (string).
+    * `search_vector`: excluded, it only serves `Query.tasks(search: ...)`.
 
     The class also defines resolver functions for `creator` and `last_modifier` fields.
-    These resolvers access the corresponding username attributes from the related user objects
-    associated with the task.
+    These resolvers load the usernames through the request-scoped `UserLoader`
+    found in the context as `user_loader`, so the lookups of all tasks in one
+    response are batched into a single query.
     """
 
     class Meta:
         model = Task
+        exclude_fields = ('search_vector', )
 
     id = ORMField(type_=Int)
     creator = Field(String)
     last_modifier = Field(String)
 
-    def resolve_creator(self, info):
-        return self.creator.username
+    async def resolve_creator(self, info):
+        return await info.context['user_loader'].load(self.creator_id)
+
+    async def resolve_last_modifier(self, info):
+        return await info.context['user_loader'].load(self.last_modifier_id)
+
+
+class TaskConnection(relay.Connection):
+    """Relay connection over `TaskNode` used by `Query.tasks`."""
+
+    class Meta:
+        node = TaskNode
+
+
+def encode_cursor(key):
+    """Encodes the keyset position of a task, the values of its sort key
+    (see `task_sort_key`), as an opaque cursor."""
+    payload = json.dumps(key, default=datetime.date.isoformat).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor, sort_key):
+    """Decodes a cursor made by `encode_cursor` back to the values of
+    `sort_key`.
+
+      Raises `GraphQLError` if the cursor is malformed or made for another
+      sort key.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(key, list) or len(key) != len(sort_key):
+            raise ValueError(key)
+        return [
+            None if value is None and column.nulls_first is not None else
+            column.parse(value) for column, value in zip(sort_key, key)
+        ]
+    except (ValueError, TypeError):
+        raise GraphQLError(f'Invalid cursor {cursor!r}.')
+
+
+def parse_int(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(value)
+    return value
+
+
+def parse_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(value)
+    return value
+
+
+def parse_str(value):
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return value
+
+
+class SortColumn:
+    """One column of the order of `Query.tasks`.
+
+      * `expression`: The sorted SQL expression.
+      * `descending` (bool): Whether larger values come first.
+      * `parse`: Converts a value read from a cursor, raising `ValueError` or
+        `TypeError` if it is invalid.
+      * `nulls_first` (bool, optional): Whether NULLs come first, None if
+        the expression is never NULL.
+    """
+
+    def __init__(self, expression, descending, parse, nulls_first=None):
+        self.expression = expression
+        self.descending = descending
+        self.parse = parse
+        self.nulls_first = nulls_first
 
-    def resolve_last_modifier(self, info):
-        return self.last_modifier.username
+
+# Fields of TaskOrder, with the parsers of their cursor values. Every field
+# is served by an index on (field, id), see the Task model.
+ORDER_FIELDS = {
+    'id': parse_int,
+    'due_date': datetime.date.fromisoformat,
+    'status': parse_str,
+    'title': parse_str,
+}
+
+
+def search_query(search):
+    """Parses a search of `Query.tasks` with `websearch_to_tsquery`, which
+    accepts "quoted phrases", OR and -excluded words."""
+    return func.websearch_to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), search)
+
+
+def task_sort_key(order_by=None, search=None):
+    """Returns the order of `Query.tasks` as a list of `SortColumn`.
+
+      Tasks are sorted by the field of `order_by` (see `TaskOrder`), by
+      relevance to `search`, or by ID. The ID is always last, so that the
+      key is unique and can be used as a cursor, and follows the direction
+      of the field, so that one index scan returns the tasks in order.
+    """
+    if order_by is not None:
+        field = order_by['field']
+        descending = order_by['direction'] == 'desc'
+        id_column = SortColumn(Task.id, descending, parse_int)
+        if field == 'id':
+            return [id_column]
+        nulls_first = None
+        if Task.__table__.c[field].nullable:
+            # PostgreSQL sorts NULLs as larger than any value by default
+            nulls_first = descending if order_by['nulls'] is None else (
+                order_by['nulls'] == 'first')
+        return [
+            SortColumn(getattr(Task, field), descending, ORDER_FIELDS[field],
+                       nulls_first), id_column
+        ]
+    if search is None:
+        return [SortColumn(Task.id, False, parse_int)]
+    # Unlike ts_rank, ts_rank_cd ignores the words excluded by the search
+    rank = func.ts_rank_cd(Task.search_vector,
+                           search_query(search),
+                           type_=REAL)
+    return [
+        SortColumn(rank, True, parse_number),
+        SortColumn(Task.id, False, parse_int)
+    ]
+
+
+def sort_segments(sort_key):
+    """Splits an order into the parts that an index scan returns in order.
+
+      A B-tree index on (field, id) returns the tasks whose field is NULL
+      and the other ones in order, but they are sorted together only when
+      NULLs come last in ascending order or first in descending order.
+      Scanning them one after the other serves the other placement too, so
+      one index serves every order on a field.
+
+      Returns:
+      list: (is_null, condition, segment sort key) tuples in the order of
+      `sort_key`; `is_null` is None when the order has a single part, or
+      whether the first column is NULL in the part.
+    """
+    first = sort_key[0]
+    if first.nulls_first is None:
+        return [(None, None, sort_key)]
+    segments = [(True, first.expression.is_(None), sort_key[1:]),
+                (False, first.expression.is_not(None), sort_key)]
+    return segments if first.nulls_first else segments[::-1]
+
+
+def seek(sort_key, key, after):
+    """Makes the keyset predicate selecting the tasks after (or before) the
+    one whose sort key values are `key`.
+
+      The values are cast to the types of the expressions, so that e.g. a
+      rank read as a double compares equal to the REAL it was read from.
+      When the columns share a direction, the predicate is a row comparison,
+      which a B-tree index scan can start from.
+    """
+    key = [
+        cast(value, column.expression.type)
+        for column, value in zip(sort_key, key)
+    ]
+    if all(column.descending == sort_key[0].descending
+           for column in sort_key):
+        columns = tuple_(*[column.expression for column in sort_key])
+        values = tuple_(*key)
+        return columns < values if sort_key[0].descending == after else (
+            columns > values)
+    conditions = []
+    for position, column in enumerate(sort_key):
+        value = key[position]
+        beyond = column.expression < value if column.descending == after else (
+            column.expression > value)
+        conditions.append(
+            and_(*[
+                previous.expression == previous_value
+                for previous, previous_value in zip(sort_key[:position], key)
+            ], beyond))
+    return or_(*conditions)
+
+
+def get_page_size(first, last):
+    if first is not None and last is not None:
+        raise GraphQLError('Passing both first and last is not supported.')
+    page_size = first if first is not None else last
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+    if page_size < 0 or page_size > MAX_PAGE_SIZE:
+        raise GraphQLError(
+            f'The page size must be between 0 and {MAX_PAGE_SIZE}.')
+    return page_size
+
+
+def filter_tasks(proj_query, **kwargs):
+    """Applies the filter arguments of `Query.tasks` to a task query.
+
+      Every filter is backed by an index on `task` (see the `Task` model), and
+      the usernames compared by `creator` and `last_modifier` by the unique
+      constraint on `user.username`. `search` is matched against the
+      generated `search_vector` column, indexed with GIN.
+    """
+    if 'search' in kwargs:
+        proj_query = proj_query.where(
+            Task.search_vector.op('@@')(search_query(kwargs['search'])))
+    if 'id' in kwargs:
+        proj_query = proj_query.where(Task.id == kwargs['id'])
+    if 'status' in kwargs:
+        proj_query = proj_query.where(Task.status == kwargs['status'])
+    if 'creator' in kwargs:
+        creator_alias = aliased(User)
+        proj_query = proj_query.join(
+            creator_alias, creator_alias.id == Task.creator_id).where(
+                creator_alias.username == kwargs['creator'])
+    if 'last_modifier' in kwargs:
+        last_modifier_alias = aliased(User)
+        proj_query = proj_query.join(
+            last_modifier_alias,
+            last_modifier_alias.id == Task.last_modifier_id).where(
+                last_modifier_alias.username == kwargs['last_modifier'])
+    if 'due_since' in kwargs:
+        proj_query = proj_query.where(Task.due_date >= kwargs['due_since'])
+    if 'due_before' in kwargs:
+        proj_query = proj_query.where(Task.due_date < kwargs['due_before'])
+    return proj_query
+
+
+# Columns read by the resolvers of TaskNode fields not mapped to a column
+TASK_FIELD_COLUMNS = {
+    'creator': 'creator_id',
+    'lastModifier': 'last_modifier_id',
+}
+
+
+def collect_fields(selection_set, fragments):
+    """Yields the fields of a selection set, looking into fragments."""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from collect_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from collect_fields(fragment.selection_set, fragments)
+
+
+def selected_task_columns(info):
+    """Finds the `task` columns needed for the nodes selected in `info`.
+
+      The ID is always loaded because cursors are made from it. Usernames
+      are not joined: `creator` and `last_modifier` only need the user IDs,
+      and the names are fetched by the `UserLoader`.
+    """
+    columns = {'id'}
+    for connection_field in info.field_nodes:
+        for edges in collect_fields(connection_field.selection_set,
+                                    info.fragments):
+            if edges.name.value != 'edges':
+                continue
+            for node in collect_fields(edges.selection_set, info.fragments):
+                if node.name.value != 'node':
+                    continue
+                for field in collect_fields(node.selection_set,
+                                            info.fragments):
+                    name = field.name.value
+                    column = TASK_FIELD_COLUMNS.get(name, to_snake_case(name))
+                    if column in Task.__table__.columns:
+                        columns.add(column)
+    return sorted(columns)
+
+
+def task_to_row(a_task, columns):
+    return {column: getattr(a_task, column) for column in columns}
+
+
+def row_to_task(row):
+    """Makes a transient `Task` from a row cached by `task_to_row`."""
+    if row.get('due_date') is not None:
+        row['due_date'] = datetime.date.fromisoformat(row['due_date'])
+    return Task(**row)
+
+
+async def fetch_tasks(session,
+                      columns,
+                      page_size,
+                      after,
+                      before,
+                      backward,
+                      order_by=None,
+                      **kwargs):
+    """Queries one page of tasks, the values of their sort key (see
+    `task_sort_key`), and whether there are more of them.
+
+      Every part of the order (see `sort_segments`) is queried in turn until
+      the page is full, so a page runs two statements only when it reaches
+      the end of the first part.
+
+      In sampled traces, the queries and the loading of the `Task` objects
+      are spanned together as `fetch_tasks`; the SQL statements have spans of
+      their own, so the rest of the span is spent in the ORM.
+    """
+    sort_key = task_sort_key(order_by, kwargs.get('search'))
+    after_key = None if after is None else decode_cursor(after, sort_key)
+    before_key = None if before is None else decode_cursor(before, sort_key)
+    # The sort key values other than the ID are selected with the task
+    key_expressions = [column.expression for column in sort_key[:-1]]
+    proj_query = filter_tasks(
+        select(Task, *key_expressions).options(
+            load_only(*[getattr(Task, column) for column in columns])),
+        **kwargs)
+    segments = sort_segments(sort_key)
+
+    def segment_of(key):
+        return next(index for index, (is_null, _, _) in enumerate(segments)
+                    if is_null is None or is_null == (key[0] is None))
+
+    def segment_values(is_null, key):
+        return key[1:] if is_null else key
+
+    # One extra row tells whether there is another page.
+    rows = []
+    with start_span("fetch_tasks") as span:
+        order = range(len(segments))
+        for index in reversed(order) if backward else order:
+            is_null, condition, segment_key = segments[index]
+            segment_query = proj_query
+            if condition is not None:
+                segment_query = segment_query.where(condition)
+            if after_key is not None:
+                if index < segment_of(after_key):
+                    continue
+                if index == segment_of(after_key):
+                    segment_query = segment_query.where(
+                        seek(segment_key, segment_values(is_null, after_key),
+                             True))
+            if before_key is not None:
+                if index > segment_of(before_key):
+                    continue
+                if index == segment_of(before_key):
+                    segment_query = segment_query.where(
+                        seek(segment_key,
+                             segment_values(is_null, before_key), False))
+            segment_order = [
+                column.expression.desc() if column.descending != backward
+                else column.expression.asc() for column in segment_key
+            ]
+            rows += (await session.execute(
+                segment_query.order_by(*segment_order).limit(page_size + 1 -
+                                                             len(rows)))).all()
+            if len(rows) > page_size:
+                break
+        if span is not None:
+            span.set_attribute("tasks.count", len(rows))
+    tasks = [row[0] for row in rows[:page_size]]
+    keys = [list(row[1:]) + [row[0].id] for row in rows[:page_size]]
+    return tasks, keys, len(rows) > page_size
+
+
+def invalidate_tasks_cache(context):
+    """Drops the cached pages of `Query.tasks` after a mutation committed."""
+    tasks_cache = context.get('tasks_cache')
+    if tasks_cache is not None:
+        tasks_cache.invalidate()
+
+
+class TaskOrderField(graphene.Enum):
+    ID = 'id'
+    DUE_DATE = 'due_date'
+    STATUS = 'status'
+    TITLE = 'title'
+
+
+class SortDirection(graphene.Enum):
+    ASC = 'asc'
+    DESC = 'desc'
+
+
+class NullsOrder(graphene.Enum):
+    FIRST = 'first'
+    LAST = 'last'
+
+
+class TaskOrder(InputObjectType):
+    """Input type describing the order of `Query.tasks`.
+
+      * `field`: The sorted field; tasks with the same value are sorted by ID.
+      * `direction`: ASC (default) or DESC.
+      * `nulls`: Whether tasks without a due date come FIRST or LAST when
+        sorting by DUE_DATE. They come last in ascending order and first in
+        descending order by default.
+      """
+    field = TaskOrderField(required=True)
+    direction = SortDirection()
+    nulls = NullsOrder()
+
+
+def enum_value(value):
+    return getattr(value, 'value', value)
+
+
+def normalize_order(order_by):
+    """Converts a `TaskOrder` to a dict of strings, as used by
+    `task_sort_key` and as a key of the tasks cache."""
+    return {
+        'field': enum_value(order_by.field),
+        'direction': enum_value(order_by.direction) or 'asc',
+        'nulls': enum_value(order_by.nulls)
+    }
 
 
 class Query(ObjectType):
     """Root query object for the GraphQL API.
 
       This class defines the main entry point for GraphQL queries. It provides a single
-      field named `tasks` which returns a list of `TaskNode` objects.
+      field named `tasks` which returns a Relay connection of `TaskNode` objects.
 
-      * `tasks` (List[TaskNode]): Retrieves a list of tasks based on provided filters.
+      * `tasks` (TaskConnection): Retrieves a page of tasks based on provided filters.
 
       The `resolve_tasks` method handles the logic for retrieving tasks based on
       optional filter arguments. It leverages the `TaskNode` class for task representation
@@ -69,52 +519,122 @@ class Query(ObjectType):
       * `last_modifier`: Filter by username of the last modifier (string).
       * `due_since`: Filter tasks due on or after a specific date (Date).
       * `due_before`: Filter tasks due before a specific date (Date).
+      * `search`: Full-text search in the title and the description (string,
+        see `search_query`), combinable with the other filters. Matching
+        tasks are sorted by relevance, title matches first, instead of ID.
+
+      Tasks are sorted by ID unless `order_by` (a `TaskOrder`) sorts them by
+      due date, status, title or ID, which takes precedence over the
+      relevance of a search.
+
+      Tasks are paginated with `first`/`after` (forward) or `last`/`before`
+      (backward). Cursors are opaque and map to keyset predicates on the sort
+      key (the sorted field or the relevance, then the ID) instead of OFFSET,
+      so fetching any page costs the same as fetching the first one. Every
+      order is served by an index on (field, id), so sorted pages are read
+      in order from the index instead of being sorted. A search
+      ranks every matching task, so its cost grows with the number of
+      matches rather than with the size of the table. At most `MAX_PAGE_SIZE` tasks are returned per page and
+      `DEFAULT_PAGE_SIZE` when neither `first` nor `last` is given.
+
+      Only the columns of the fields selected under `edges { node { ... } }`
+      are loaded (see `selected_task_columns`), so e.g. the description is not
+      transferred when the client does not ask for it.
+
+      If the context has a `tasks_cache` (see `tugastugas.cache`), pages are
+      served from it and stored in it, keyed by the user, the arguments and
+      the selected columns. Mutations invalidate it once they committed.
 
       **Note:** This implementation requires a user to be authenticated (user_id in context)
       to access tasks. It raises a `GraphQLError` if user authentication is missing.
       """
-    tasks = List(TaskNode,
-                 id=Int(),
-                 status=String(),
-                 creator=String(),
-                 last_modifier=String(),
-                 due_since=Date(),
-                 due_before=Date())
-
-    def resolve_tasks(self, info: Any, **kwargs) -> Any:
+    tasks = Field(TaskConnection,
+                  id=Int(),
+                  status=String(),
+                  creator=String(),
+                  last_modifier=String(),
+                  due_since=Date(),
+                  due_before=Date(),
+                  search=String(),
+                  order_by=TaskOrder(),
+                  first=Int(),
+                  after=String(),
+                  last=Int(),
+                  before=String())
+
+    async def resolve_tasks(self,
+                            info: Any,
+                            first=None,
+                            after=None,
+                            last=None,
+                            before=None,
+                            **kwargs) -> Any:
         session = get_session(info.context)
         user_id = info.context.get('user').id
         if user_id is None:
             raise GraphQLError('This op needs user-id.')
-        proj_query = TaskNode.get_query(info)
-        if 'id' in kwargs:
-            proj_query = proj_query.filter_by(id=kwargs['id'])
-        if 'status' in kwargs:
-            proj_query = proj_query.filter_by(status=kwargs['status'])
-        if 'creator' in kwargs:
-            creator_alias = aliased(User)
-            proj_query = proj_query.join(
-                creator_alias, creator_alias.id == Task.creator_id).where(
-                    creator_alias.username == kwargs['creator'])
-        if 'last_modifier' in kwargs:
-            last_modifier_alias = aliased(User)
-            proj_query = proj_query.join(
-                last_modifier_alias,
-                last_modifier_alias.id == Task.last_modifier_id).where(
-                    last_modifier_alias.username == kwargs['last_modifier'])
-        if 'due_since' in kwargs:
-            proj_query = proj_query.where(Task.due_date >= kwargs['due_since'])
-        if 'due_before' in kwargs:
-            proj_query = proj_query.where(Task.due_date < kwargs['due_before'])
-        return proj_query.all()
+        page_size = get_page_size(first, last)
+        backward = last is not None
+        if kwargs.get('order_by') is not None:
+            kwargs['order_by'] = normalize_order(kwargs['order_by'])
+        columns = selected_task_columns(info)
+        tasks_cache = info.context.get('tasks_cache')
+        if tasks_cache is None:
+            tasks, keys, has_more = await fetch_tasks(session, columns,
+                                                      page_size, after, before,
+                                                      backward, **kwargs)
+        else:
+            cache_key = tasks_cache.make_key(
+                user_id,
+                dict(kwargs, first=first, after=after, last=last,
+                     before=before), columns)
+            cached_page = tasks_cache.get(cache_key)
+            if cached_page is None:
+                tasks, keys, has_more = await fetch_tasks(
+                    session, columns, page_size, after, before, backward,
+                    **kwargs)
+                tasks_cache.set(
+                    cache_key, {
+                        "tasks":
+                        [task_to_row(a_task, columns) for a_task in tasks],
+                        "keys": keys,
+                        "has_more": has_more
+                    })
+            else:
+                tasks = [row_to_task(row) for row in cached_page["tasks"]]
+                keys = cached_page["keys"]
+                has_more = cached_page["has_more"]
+        edges = [
+            TaskConnection.Edge(node=a_task, cursor=encode_cursor(key))
+            for a_task, key in zip(tasks, keys)
+        ]
+        if backward:
+            edges.reverse()
+        page_info = relay.PageInfo(
+            has_next_page=has_more and not backward,
+            has_previous_page=has_more and backward,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None)
+        return TaskConnection(edges=edges, page_info=page_info)
 
 
 #################### MUTATION ########################
 
+# History records are written by the audit trigger on `task`, which reads the
+# acting user from the transaction-local setting tugastugas.user_id.
+SET_ACTING_USER = text(
+    "SELECT set_config('tugastugas.user_id', CAST(:user_id AS TEXT), true)")
+
+# Joining this CTE into a single-statement mutation sets the acting user before
+# any row is changed, and so before the AFTER triggers of the statement fire.
+ACTING_USER_CTE = """WITH acting_user AS (
+            SELECT set_config('tugastugas.user_id', CAST(:user_id AS TEXT), true)
+          )"""
+
 
-def get_user(session, user_id):
+async def get_user(session, user_id):
     stmt = select(User).filter_by(id=user_id)
-    user = session.scalars(stmt).one_or_none()
+    user = (await session.scalars(stmt)).one_or_none()
     return user
 
 
@@ -138,11 +658,11 @@ class CreateTask(Mutation):
       session and user context information from `info`. It performs the following steps:
 
       1. Retrieves the user ID from the context (raises error if missing).
-      2. Fetches the user object from the database based on the user ID.
-      3. Creates a new `Task` object with provided arguments and associates it with the user.
-      4. Adds the new task to the database session and commits the changes.
-      5. Performs additional actions related to task history management 
-      6. Returns a `CreateTask` object with the newly created task.
+      2. Runs one statement that sets the acting user of the transaction and
+         inserts the task for the user (nothing is inserted if the user does
+         not exist). The audit trigger on `task` writes its CREATE history record.
+      3. Raises an error if the user was not found, otherwise commits.
+      4. Returns a `CreateTask` object with the newly created task.
 
       **Note:** This implementation requires user authentication (user_id in context)
       to create tasks. It raises a `GraphQLError` if user authentication is missing.
@@ -156,56 +676,136 @@ class CreateTask(Mutation):
 
     task = Field(TaskNode)
 
-    def mutate(self,
-               info,
-               title,
-               description="",
-               due_date=None,
-               status="pending"):
+    async def mutate(self,
+                     info,
+                     title,
+                     description="",
+                     due_date=None,
+                     status="pending"):
         session = get_session(info.context)
         user_id = info.context.get('user').id
         if user_id is None:
             raise GraphQLError('This op needs user-id.')
-        user = get_user(session, user_id)
-        if user is None:
-            raise GraphQLError(f'The user-id {user_id} is not found.')
-        new_task = Task(title=title,
-                        description=description,
-                        status=status,
-                        due_date=due_date,
-                        creator=user,
-                        last_modifier=user)
-        session.add(new_task)
-        session.commit()
-        history_stmt = text("""
-          INSERT INTO h_task (target_row_id,
-                    executed_operation,
-                    data_after_executed_operation,
-                    from_undo,
-                    user_id)
-          SELECT task.id,
-            1,
-            to_jsonb(task),
-            task.from_undo,
-            :user_id
-          FROM task
-          WHERE task.id = :task_id;
+        create_stmt = text(f"""
+          {ACTING_USER_CTE}
+          INSERT INTO task (title,
+                    description,
+                    due_date,
+                    status,
+                    creator_id,
+                    last_modifier_id)
+          SELECT :title,
+            :description,
+            CAST(:due_date AS DATE),
+            :status,
+            "user".id,
+            "user".id
+          FROM "user", acting_user
+          WHERE "user".id = :user_id
+          RETURNING *;
         """)
-        session.execute(history_stmt, {
-            "user_id": user_id,
-            "task_id": new_task.id
-        })
-        session.commit()
+        new_task = (await session.scalars(
+            select(Task).from_statement(create_stmt), {
+                "title": title,
+                "description": description,
+                "due_date": due_date,
+                "status": status,
+                "user_id": user_id
+            })).one_or_none()
+        if new_task is None:
+            raise GraphQLError(f'The user-id {user_id} is not found.')
+        await session.commit()
+        invalidate_tasks_cache(info.context)
         return CreateTask(task=new_task)
 
 
+class TaskInput(InputObjectType):
+    """Input type describing one task to create with `CreateTasks`.
+
+      Its fields have the same meaning and defaults as the arguments of `CreateTask`.
+      """
+    title = String(required=True)
+    description = String(default_value="")
+    due_date = Date()
+    status = String(required=True)
+
+
+class CreateTasks(Mutation):
+    """Mutation for creating many Task objects at once.
+
+      This class defines a mutation named 'CreateTasks' for bulk imports. It
+      does the same work as `CreateTask` for every item of its input, but in a
+      single transaction and with set-based statements instead of per-task
+      round trips.
+
+      * Arguments:
+      * `input` (List[TaskInput], required): The tasks to create, at most
+        `MAX_BULK_CREATE`.
+
+      * Returns:
+      A `CreateTasks` object with a single field:
+      * `tasks` (List[TaskNode]): The newly created tasks, in input order.
+
+      The `mutate` method performs the following steps:
+
+      1. Retrieves the user ID from the context (raises error if missing), and
+         checks the number of tasks.
+      2. Fetches the user object from the database based on the user ID.
+      3. Sets the acting user of the transaction for the audit trigger on `task`.
+      4. Inserts all tasks with multi-row `INSERT ... RETURNING` statements.
+         The trigger writes their CREATE history records.
+      5. Commits once and returns the created tasks.
+
+      **Note:** This implementation requires user authentication (user_id in context)
+      to create tasks. It raises a `GraphQLError` if user authentication is missing.
+      """
+
+    class Arguments:
+        input = List(NonNull(TaskInput), required=True)
+
+    tasks = List(TaskNode)
+
+    async def mutate(self, info, input):
+        session = get_session(info.context)
+        user_id = info.context.get('user').id
+        if user_id is None:
+            raise GraphQLError('This op needs user-id.')
+        if len(input) > MAX_BULK_CREATE:
+            raise GraphQLError(
+                f'At most {MAX_BULK_CREATE} tasks can be created at once.')
+        user = await get_user(session, user_id)
+        if user is None:
+            raise GraphQLError(f'The user-id {user_id} is not found.')
+        if not input:
+            return CreateTasks(tasks=[])
+        rows = [{
+            "title": task_input.title,
+            "description": task_input.description,
+            "status": task_input.status,
+            "due_date": task_input.due_date,
+            "creator_id": user_id,
+            "last_modifier_id": user_id
+        } for task_input in input]
+        # A list of parameter sets makes SQLAlchemy batch the rows into
+        # multi-row INSERT ... RETURNING statements. Rendering NULLs keeps
+        # rows with and without a due date in the same batch.
+        insert_stmt = insert(Task).returning(
+            Task, sort_by_parameter_order=True).execution_options(
+                render_nulls=True)
+        await session.execute(SET_ACTING_USER, {"user_id": user_id})
+        new_tasks = (await session.scalars(insert_stmt, rows)).all()
+        await session.commit()
+        invalidate_tasks_cache(info.context)
+        return CreateTasks(tasks=new_tasks)
+
+
 def is_owned(a_task, user_id):
     return a_task.creator_id == user_id
 
 
-def get_task(session, task_id):
+async def get_task(session, task_id):
     stmt = select(Task).filter_by(id=task_id)
-    the_task = session.execute(stmt).scalar_one_or_none()
+    the_task = (await session.execute(stmt)).scalar_one_or_none()
     return the_task
 
 
@@ -226,13 +826,14 @@ class DeleteTask(Mutation):
       session and user context information from `info`. It performs the following steps:
 
       1. Retrieves the user ID from the context (raises error if missing).
-      2. Fetches the task object from the database based on the provided ID.
+      2. Runs one statement that sets the acting user of the transaction, locks
+         the task and deletes it if the user owns it. The statement returns the
+         owner of the task and whether it was deleted. The audit trigger on
+         `task` writes the DELETE history record.
       3. Verifies that the task exists (raises error if not found).
       4. Checks if the user attempting to delete the task is the owner (raises error if not).
-      5. Performs additional actions related to task history management.
-      6. Deletes the task from the database using a SQLAlchemy delete query.
-      7. Commits the changes to the database.
-      8. Returns a `DeleteTask` object with the ID of the deleted task.
+      5. Commits the changes to the database.
+      6. Returns a `DeleteTask` object with the ID of the deleted task.
 
       **Note:** This implementation requires user authentication (user_id in context)
       to delete tasks. It also enforces ownership checks to ensure users can only delete
@@ -244,38 +845,41 @@ class DeleteTask(Mutation):
 
     id = Int(required=True)
 
-    def mutate(self, info, id):
+    async def mutate(self, info, id):
         session = get_session(info.context)
         user_id = info.context.get('user').id
         if user_id is None:
             raise GraphQLError('This op needs user-id.')
-        the_task = get_task(session, id)
-        if the_task is None:
-            raise GraphQLError(f'The task #{id} does not exist.')
-        if not is_owned(the_task, user_id):
-            raise GraphQLError('This project is not belong to the user.')
-        history_stmt = text("""
-          INSERT INTO h_task (target_row_id,
-                    executed_operation,
-                    data_after_executed_operation,
-                    from_undo,
-                    user_id)
-          SELECT task.id,
-            2,
-            to_jsonb(task),
-            task.from_undo,
-            :user_id
-          FROM task
-          WHERE task.id = :task_id;
+        del_stmt = text(f"""
+          {ACTING_USER_CTE},
+          old AS (
+            SELECT task.id, task.creator_id
+            FROM task
+            WHERE task.id = :task_id
+            FOR UPDATE
+          ), deleted AS (
+            DELETE FROM task
+            USING old, acting_user
+            WHERE task.id = old.id AND old.creator_id = :user_id
+            RETURNING task.id
+          )
+          SELECT old.id,
+            old.creator_id,
+            EXISTS (SELECT 1 FROM deleted) AS deleted
+          FROM old;
         """)
-        session.execute(history_stmt, {"user_id": user_id, "task_id": id})
-        session.commit()
-
-        del_stmt = delete(Task).where(Task.id == id).returning(Task.id)
-        del_result = session.execute(del_stmt).one_or_none()
+        del_result = (await session.execute(del_stmt, {
+            "user_id": user_id,
+            "task_id": id
+        })).one_or_none()
         if del_result is None:
+            raise GraphQLError(f'The task #{id} does not exist.')
+        if not is_owned(del_result, user_id):
+            raise GraphQLError('This project is not belong to the user.')
+        if not del_result.deleted:
             raise GraphQLError(f'Cannot delete the project #{id}')
-        session.commit()
+        await session.commit()
+        invalidate_tasks_cache(info.context)
         return DeleteTask(id=id)
 
 
@@ -300,15 +904,14 @@ class UpdateTask(Mutation):
       session and user context information from `info`. It performs the following steps:
 
       1. Retrieves the user ID from the context (raises error if missing).
-      2. Fetches the task object from the database based on the provided ID.
-      3. Verifies that the task exists (raises error if not found).
-      4. Performs additional actions related to task history management 
-      5. Iterates over provided keyword arguments (excluding `id`).
-      6. For each argument, updates the corresponding attribute of the task object.
-      7. Sets the `last_modifier_id` attribute of the task to the current user ID.
-      8. Adds the updated task object to the database session.
-      9. Commits the changes to the database.
-      10. Returns a `UpdateTask` object with the updated task.
+      2. Builds a SET clause from the provided keyword arguments (excluding `id`)
+         and sets `last_modifier_id` to the current user ID.
+      3. Runs one statement that sets the acting user of the transaction and
+         updates the task. The audit trigger on `task` writes the UPDATE
+         history record (the old values of the modified columns).
+      4. Verifies that the task exists (raises error if not found).
+      5. Commits the changes to the database.
+      6. Returns a `UpdateTask` object with the updated task.
 
       **Note:** This implementation requires user authentication (user_id in context)
       to update tasks. It also raises a `GraphQLError` if the task with the provided ID is not found.
@@ -323,96 +926,115 @@ class UpdateTask(Mutation):
 
     task = Field(TaskNode)
 
-    def mutate(self, info, id, **kwargs):
+    async def mutate(self, info, id, **kwargs):
         session = get_session(info.context)
         user_id = info.context.get('user').id
         if user_id is None:
             raise GraphQLError('This op needs user-id.')
-        the_task = get_task(session, id)
-
-        history_stmt = text("""
-          INSERT INTO h_task (target_row_id,
-                    executed_operation,
-                    data_after_executed_operation,
-                    from_undo,
-                    user_id)
-          SELECT task.id,
-            3,
-            to_jsonb(task),
-            task.from_undo,
-            :user_id
-          FROM task
-          WHERE task.id = :task_id;
+        # The keys are argument names declared in Arguments, never user input.
+        assignments = "".join(f"{k} = :{k}, " for k in kwargs)
+        update_stmt = text(f"""
+          {ACTING_USER_CTE}
+          UPDATE task
+          SET {assignments}last_modifier_id = :user_id
+          FROM acting_user
+          WHERE task.id = :task_id
+          RETURNING task.*;
         """)
-        session.execute(history_stmt, {"user_id": user_id, "task_id": id})
-        session.commit()
-
+        the_task = (await session.scalars(
+            select(Task).from_statement(update_stmt),
+            dict(kwargs, user_id=user_id, task_id=id))).one_or_none()
         if the_task is None:
             raise GraphQLError(f'The task #{id} does not exist.')
-        for k in kwargs:
-            v = kwargs[k]
-            setattr(the_task, k, v)
-        the_task.last_modifier_id = user_id
-        session.add(the_task)
-        session.commit()
+        await session.commit()
+        invalidate_tasks_cache(info.context)
         return UpdateTask(the_task)
 
 
 class UndoTask(Mutation):
-    """Mutation for undoing the latest task operation.
+    """Mutation for undoing the latest task operations.
 
       This class defines a mutation named 'UndoTask' that allows users to undo the
-      most recent operation performed on their tasks. It does not require any arguments.
+      most recent operations performed on their tasks.
+
+      * Arguments:
+      * `steps` (int, optional): How many history records to revert, between 1
+        and `MAX_UNDO_STEPS`. Defaults to 1, or to `MAX_UNDO_STEPS` when
+        `until_timestamp` is given.
+      * `until_timestamp` (datetime, optional): Stops before the first record
+        older than this timestamp.
 
       * Returns:
-      A `UndoTask` object with a single field:
-      * `task` (TaskNode, optional): The task object after the undo operation
-        (may be None if the undo operation involved task creation).
+      A `UndoTask` object with the fields:
+      * `task` (TaskNode, optional): The task object after the latest undone
+        operation (may be None if the undo operation involved task creation).
+      * `tasks` (list of TaskNode): Every task still existing after the undo,
+        in the order they were reverted (most recent first).
 
-      The `mutate` method handles the logic for undoing the latest task operation.
+      The `mutate` method handles the logic for undoing the latest task operations.
       It leverages the database session and user context information from `info`. 
       It performs the following steps:
 
       1. Retrieves the user ID from the context (raises error if missing).
-      2. Perform undoing by querying PL/pgSQL function - undo_task_action
-      3. Verifies that a valid undo record exists (raises error if not).
-      4. Analyzes the operation type:
-      - If type 1 (create task): cannot undo creation, return an empty `UpdateTask`.
-      5. Fetches the task object from the database based on the retrieved task ID.
-      8. Returns a `UndoTask` object if it is possible
+      2. Perform undoing by querying PL/pgSQL function - undo_task_actions,
+         which repeats undo_task_action up to `steps` times in one statement.
+      3. Verifies that at least one undo record was used (raises error if not).
+      4. Fetches the affected tasks from the database in one query
+         (undone creations have no task any more).
+      5. Returns a `UndoTask` object
 
       **Note:** This implementation requires user authentication (user_id in context)
       to undo tasks. It also performs basic validation to ensure undo operations 
       are possible. It raises `GraphQLError` for various failure scenarios 
-      like missing authentication, missing undo record, or non-existent task.
+      like missing authentication, an invalid step count or missing undo record.
       """
 
     class Arguments:
-        pass
+        steps = Int()
+        until_timestamp = graphene.DateTime()
 
     task = Field(TaskNode)
+    tasks = NonNull(List(NonNull(TaskNode)))
 
-    def mutate(self, info):
+    async def mutate(self, info, steps=None, until_timestamp=None):
         session = get_session(info.context)
         user_id = info.context.get('user').id
         if user_id is None:
             raise GraphQLError('This op needs user-id.')
-
-        undo_result = session.execute(
-            text("SELECT undo_task_action(:user_id)"), {
-                "user_id": user_id
-            }).scalar_one_or_none()
-
-        if undo_result is None or undo_result[0] is None:
+        if steps is None:
+            steps = 1 if until_timestamp is None else MAX_UNDO_STEPS
+        if steps < 1 or steps > MAX_UNDO_STEPS:
+            raise GraphQLError(
+                f'The steps must be between 1 and {MAX_UNDO_STEPS}.')
+
+        undo_results = (await session.execute(
+            text("SELECT op_type, task_id"
+                 " FROM undo_task_actions(:user_id, :steps, :until_timestamp)"),
+            {
+                "user_id": user_id,
+                "steps": steps,
+                "until_timestamp": until_timestamp
+            })).all()
+
+        if not undo_results:
             raise GraphQLError(f'Cannot undo anything for user {user_id}')
-        op_type, task_id = undo_result
-        if op_type == '1':
-            return UpdateTask(task=None)
-        session.commit()
-        the_task = get_task(session, int(task_id))
-        if the_task is None:
-            raise GraphQLError(f'The task #{id} does not exist.')
-        return UpdateTask(task=the_task)
+        await session.commit()
+        invalidate_tasks_cache(info.context)
+        task_ids = list(dict.fromkeys(task_id for _, task_id in undo_results))
+        stmt = select(Task).where(Task.id == any_(
+            bindparam('task_ids', task_ids, type_=ARRAY(Integer))))
+        tasks_by_id = {
+            a_task.id: a_task
+            for a_task in (await session.execute(stmt)).scalars()
+        }
+        latest_op_type, latest_task_id = undo_results[0]
+        the_task = None if latest_op_type == 1 else tasks_by_id.get(
+            latest_task_id)
+        return UndoTask(task=the_task,
+                        tasks=[
+                            tasks_by_id[task_id] for task_id in task_ids
+                            if task_id in tasks_by_id
+                        ])
 
 
 class Mutation(ObjectType):
@@ -422,6 +1044,7 @@ class Mutation(ObjectType):
       It provides functionalities for managing tasks:
 
       * `create_task`: Creates a new task (see 'CreateTask' for details).
+      * `create_tasks`: Creates many tasks at once (see 'CreateTasks' for details).
       * `delete_task`: Deletes an existing task (see 'DeleteTask' for details).
       * `update_task`: Updates an existing task (see 'UpdateTask' for details).
       * `undo_task`: Undoes the latest task operation (see 'UndoTask' for details).
@@ -430,9 +1053,28 @@ class Mutation(ObjectType):
       Refer to the individual mutation classes for specific requirements and behaviors.
       """
     create_task = CreateTask.Field()
+    create_tasks = CreateTasks.Field()
     delete_task = DeleteTask.Field()
     update_task = UpdateTask.Field()
     undo_task = UndoTask.Field()
 
 
+class SerialExecutionContext(ExecutionContext):
+    """Execution context resolving the root fields of queries one by one.
+
+      graphql-core resolves the root fields of a query concurrently, but all
+      resolvers of a request share one `AsyncSession`, which does not allow
+      concurrent operations. Resolving them serially, as is done for
+      mutations, lets a query select `tasks` more than once (e.g. under
+      aliases).
+    """
+
+    def execute_fields(self, parent_type, source_value, path, fields):
+        if path is None:
+            return self.execute_fields_serially(parent_type, source_value,
+                                                path, fields)
+        return super().execute_fields(parent_type, source_value, path,
+                                      fields)
+
+
 schema = graphene.Schema(query=Query, mutation=Mutation)
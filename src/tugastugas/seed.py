@@ -0,0 +1,418 @@
+"""Seeding and bulk import of users, tasks and their history.
+
+`add_fake_users` is enough to try the API, but not to test it with
+production-sized data. This command loads millions of rows with
+`COPY ... FROM STDIN`, sending them `--chunk-size` rows at a time in the text
+format of COPY, in one transaction:
+
+* `generate` makes users, tasks and the matching `h_task` history: an INSERT
+  record per task, then `--updates` UPDATE records changing its status, with
+  before-images as written by the audit trigger. The statuses, due dates and
+  creators follow configurable distributions, and `--seed` makes the data
+  reproducible.
+* `import` loads users, tasks and history from CSV or NDJSON files (optionally
+  gzip-compressed), e.g. the output of `/export/tasks` or the archives of
+  `tugastugas.retention`. The first line of a CSV file names its columns;
+  empty values of nullable columns are loaded as NULL.
+
+The audit trigger on `task` is disabled while loading, since the history is
+generated or imported along with the tasks. Afterwards, the ID sequences are
+moved past the loaded IDs and history records that landed in `h_task_default`
+are moved to their monthly partitions.
+
+Disabling the trigger takes an ACCESS EXCLUSIVE lock on `task` until the load
+commits, and while it is disabled, changes made by anyone else would not be
+audited. Loading is therefore meant for a database the application does not
+use, and the command refuses to run while other sessions are connected to it.
+
+Usage::
+
+    tugastugas-seed generate --users 1000 --tasks 1000000 --updates 2
+    tugastugas-seed import --users users.csv --tasks tasks.ndjson
+"""
+
+import argparse
+import bisect
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import random
+from psycopg import sql
+from sqlalchemy import create_engine
+from tugastugas.database import get_url
+
+COLUMNS = {
+    'user': ['id', 'username', 'password_hash'],
+    'task': [
+        'id', 'title', 'description', 'due_date', 'status', 'creator_id',
+        'last_modifier_id', 'from_undo'
+    ],
+    'h_task': [
+        'id', 'target_row_id', 'executed_operation', 'operation_executed_at',
+        'data_after_executed_operation', 'from_undo', 'user_id', 'used'
+    ],
+}
+
+NULLABLE_COLUMNS = {'due_date', 'data_after_executed_operation'}
+
+# Values of NOT NULL columns without a server default, used when an imported
+# file leaves them out
+IMPORT_DEFAULTS = {
+    'user': {
+        'password_hash': ''
+    },
+    'task': {
+        'description': ''
+    },
+}
+
+HISTORY_COLUMNS = COLUMNS['h_task'][1:]
+
+COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r"
+})
+
+WORDS = [
+    "call", "customer", "review", "report", "deploy", "fix", "update",
+    "meeting", "budget", "design", "release", "invoice", "plan", "test",
+    "document", "migrate", "database", "server", "follow", "up"
+]
+
+
+def encode_copy_value(value):
+    """Encodes a value in the text format of COPY."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(cursor, table, columns, rows, chunk_size):
+    """Copies `rows` into `table` with one COPY statement.
+
+      The rows are encoded and sent `chunk_size` at a time, so `rows` can be
+      a generator of any length.
+
+      Returns:
+      int: The number of copied rows.
+    """
+    statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)))
+    count = 0
+    rows = iter(rows)
+    with cursor.copy(statement) as copy:
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            copy.write("".join("\t".join(map(encode_copy_value, row)) + "\n"
+                               for row in chunk))
+            count += len(chunk)
+    return count
+
+
+def parse_weights(text):
+    """Parses "TODO:5,DOING:3,DONE:2" into values and their weights."""
+    values, weights = [], []
+    for item in text.split(","):
+        value, _, weight = item.partition(":")
+        values.append(value)
+        weights.append(float(weight) if weight else 1.0)
+    return values, weights
+
+
+def get_max_id(cursor, table):
+    cursor.execute(
+        sql.SQL("SELECT coalesce(max(id), 0) FROM {}").format(
+            sql.Identifier(table)))
+    return cursor.fetchone()[0]
+
+
+def get_now(cursor):
+    """Returns the current time in the time zone of `h_task`."""
+    cursor.execute("SELECT CAST(now() AS TIMESTAMP)")
+    return cursor.fetchone()[0]
+
+
+def generate_tasks(args, first_id, user_ids, now):
+    """Yields every generated task with its history records.
+
+      All randomness comes from `args.seed`, so calling it twice with the
+      same arguments yields the same tasks.
+    """
+    rng = random.Random(args.seed)
+    statuses, status_weights = args.statuses
+    status_cum_weights = list(itertools.accumulate(status_weights))
+    creator_cum_weights = list(
+        itertools.accumulate(1 / rank**args.creator_skew
+                             for rank in range(1, len(user_ids) + 1)))
+    due_days = (args.due_to - args.due_from).days
+    history_seconds = args.history_days * 86400
+    for task_id in range(first_id, first_id + args.tasks):
+        creator_id = user_ids[bisect.bisect_left(
+            creator_cum_weights,
+            rng.random() * creator_cum_weights[-1])]
+        task_statuses = rng.choices(statuses,
+                                    cum_weights=status_cum_weights,
+                                    k=args.updates + 1)
+        modifier_ids = [creator_id] + [
+            rng.choice(user_ids) for _ in range(args.updates)
+        ]
+        due_date = None
+        if rng.random() >= args.no_due_ratio:
+            due_date = args.due_from + datetime.timedelta(
+                days=rng.randint(0, due_days))
+        executed_at = sorted(
+            now - datetime.timedelta(seconds=rng.uniform(0, history_seconds))
+            for _ in range(args.updates + 1))
+        row = {
+            'id': task_id,
+            'title': f"Task {task_id}",
+            'description': " ".join(
+                rng.choices(WORDS, k=rng.randint(0, args.description_words))),
+            'due_date': due_date,
+            'status': task_statuses[0],
+            'creator_id': creator_id,
+            'last_modifier_id': creator_id,
+            'from_undo': False
+        }
+        history = [(str(task_id), 1, executed_at[0],
+                    dict(row, due_date=due_date and due_date.isoformat()),
+                    False, creator_id, False)]
+        for step in range(1, args.updates + 1):
+            before_image = {}
+            if task_statuses[step] != row['status']:
+                before_image['status'] = row['status']
+            if modifier_ids[step] != row['last_modifier_id']:
+                before_image['last_modifier_id'] = row['last_modifier_id']
+            row['status'] = task_statuses[step]
+            row['last_modifier_id'] = modifier_ids[step]
+            history.append((str(task_id), 3, executed_at[step],
+                            before_image, False, modifier_ids[step], False))
+        yield [row[column] for column in COLUMNS['task']], history
+
+
+def generate(cursor, args):
+    first_user_id = get_max_id(cursor, 'user') + 1
+    count = copy_rows(cursor, 'user', COLUMNS['user'],
+                      ((id, f"usr{id}", '')
+                       for id in range(first_user_id, first_user_id +
+                                       args.users)), args.chunk_size)
+    print(f"Copied {count} rows into user")
+
+    cursor.execute('SELECT id FROM "user" ORDER BY id')
+    user_ids = [id for id, in cursor.fetchall()]
+    if not user_ids:
+        raise ValueError("There are no users to create tasks for.")
+    now = get_now(cursor)
+    first_task_id = get_max_id(cursor, 'task') + 1
+    count = copy_rows(
+        cursor, 'task', COLUMNS['task'],
+        (row for row, _ in generate_tasks(args, first_task_id, user_ids, now)),
+        args.chunk_size)
+    print(f"Copied {count} rows into task")
+
+    # Create the partitions first instead of moving the rows out of the
+    # default partition afterwards
+    cursor.execute(
+        """SELECT create_h_task_partition(CAST(month AS DATE))
+             FROM generate_series(date_trunc('month', CAST(%s AS TIMESTAMP)),
+                                  date_trunc('month', CAST(%s AS TIMESTAMP)),
+                                  INTERVAL '1 month') AS month""",
+        (now - datetime.timedelta(days=args.history_days), now))
+    count = copy_rows(
+        cursor, 'h_task', HISTORY_COLUMNS,
+        (record
+         for _, history in generate_tasks(args, first_task_id, user_ids, now)
+         for record in history), args.chunk_size)
+    print(f"Copied {count} rows into h_task")
+
+
+def read_records(path):
+    """Yields the records of a CSV or NDJSON file as dictionaries."""
+    name = path[:-3] if path.endswith(".gz") else path
+    opener = gzip.open if path.endswith(".gz") else open
+    if name.endswith(".csv"):
+        with opener(path, "rt", newline="", encoding="utf-8") as file:
+            yield from csv.DictReader(file)
+    elif name.endswith((".ndjson", ".jsonl")):
+        with opener(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError(f"Unknown file type of {path}, expected .csv,"
+                         " .ndjson or .jsonl")
+
+
+def import_file(cursor, table, path, chunk_size):
+    records = read_records(path)
+    first = next(records, None)
+    if first is None:
+        return 0
+    unknown = set(first) - set(COLUMNS[table])
+    if unknown:
+        raise ValueError(
+            f"Unknown columns {', '.join(sorted(unknown))} in {path}")
+    defaults = {
+        column: value
+        for column, value in IMPORT_DEFAULTS.get(table, {}).items()
+        if column not in first
+    }
+    columns = [
+        column for column in COLUMNS[table]
+        if column in first or column in defaults
+    ]
+
+    def to_row(record):
+        record = dict(defaults, **record)
+        return [
+            None if column in NULLABLE_COLUMNS and record.get(column) == ''
+            else record.get(column) for column in columns
+        ]
+
+    return copy_rows(cursor, table, columns,
+                     map(to_row, itertools.chain([first], records)),
+                     chunk_size)
+
+
+def import_files(cursor, args):
+    for table, path in [('user', args.users), ('task', args.tasks),
+                        ('h_task', args.history)]:
+        if path is not None:
+            count = import_file(cursor, table, path, args.chunk_size)
+            print(f"Copied {count} rows into {table} from {path}")
+
+
+def reset_sequences(cursor):
+    """Moves the ID sequences past the loaded IDs."""
+    for table in COLUMNS:
+        cursor.execute(
+            sql.SQL("SELECT setval(pg_get_serial_sequence({}, 'id'), max(id))"
+                    " FROM {}").format(
+                        sql.Literal(sql.Identifier(table).as_string(cursor)),
+                        sql.Identifier(table)))
+
+
+def count_other_sessions(cursor):
+    """Returns the number of client sessions connected to the database,
+    besides this one."""
+    cursor.execute("""
+        SELECT count(*)
+          FROM pg_stat_activity
+         WHERE datname = current_database()
+           AND pid <> pg_backend_pid()
+           AND backend_type = 'client backend'""")
+    return cursor.fetchone()[0]
+
+
+def partition_default_history(cursor):
+    """Moves the history records of `h_task_default` to their monthly
+    partitions."""
+    cursor.execute("""
+        SELECT create_h_task_partition(CAST(month AS DATE))
+          FROM (SELECT DISTINCT date_trunc('month', operation_executed_at)
+                  FROM h_task_default) AS months (month)""")
+
+
+def date_argument(value):
+    return datetime.date.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="tugastugas-seed",
+        description="Load users, tasks and their history with COPY.")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=10000,
+                        help="rows sent to PostgreSQL at a time")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser(
+        "generate", help="generate users, tasks and their history")
+    generate_parser.add_argument("--users",
+                                 type=int,
+                                 default=0,
+                                 help="users to add to the existing ones")
+    generate_parser.add_argument("--tasks", type=int, default=1000)
+    generate_parser.add_argument(
+        "--updates",
+        type=int,
+        default=1,
+        help="UPDATE history records per task, after the INSERT one")
+    generate_parser.add_argument("--statuses",
+                                 type=parse_weights,
+                                 default="TODO:5,DOING:3,DONE:2",
+                                 help="statuses and their weights")
+    generate_parser.add_argument(
+        "--creator-skew",
+        type=float,
+        default=1.0,
+        help="the n-th user creates tasks with a weight of 1/n**skew"
+        " (0 for uniform)")
+    generate_parser.add_argument("--due-from",
+                                 type=date_argument,
+                                 default=datetime.date.today())
+    generate_parser.add_argument("--due-to",
+                                 type=date_argument,
+                                 default=datetime.date.today() +
+                                 datetime.timedelta(days=365))
+    generate_parser.add_argument("--no-due-ratio",
+                                 type=float,
+                                 default=0.2,
+                                 help="share of tasks without due date")
+    generate_parser.add_argument("--description-words",
+                                 type=int,
+                                 default=50,
+                                 help="maximum words of a description")
+    generate_parser.add_argument(
+        "--history-days",
+        type=int,
+        default=90,
+        help="the history is spread over this many past days")
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    import_parser = commands.add_parser(
+        "import", help="import users, tasks and history from files")
+    import_parser.add_argument("--users", help="CSV or NDJSON file of users")
+    import_parser.add_argument("--tasks", help="CSV or NDJSON file of tasks")
+    import_parser.add_argument("--history",
+                               help="CSV or NDJSON file of h_task records")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(get_url())
+    raw_connection = engine.raw_connection()
+    try:
+        connection = raw_connection.driver_connection
+        connection.autocommit = True
+        with connection.transaction(), connection.cursor() as cursor:
+            other_sessions = count_other_sessions(cursor)
+            if other_sessions:
+                parser.error(
+                    f"{other_sessions} other sessions are connected to the"
+                    " database; stop the application before loading data")
+            cursor.execute("ALTER TABLE task DISABLE TRIGGER task_audit")
+            try:
+                if args.command == "generate":
+                    generate(cursor, args)
+                else:
+                    import_files(cursor, args)
+            except ValueError as error:
+                parser.error(str(error))
+            cursor.execute("ALTER TABLE task ENABLE TRIGGER task_audit")
+            reset_sequences(cursor)
+            partition_default_history(cursor)
+    finally:
+        raw_connection.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
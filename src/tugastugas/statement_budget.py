@@ -0,0 +1,175 @@
+"""Statement budgets of GraphQL operations.
+
+An N+1 query, e.g. loading the creator of every task one by one, looks fine
+with the handful of rows of a test and only hurts with production data. A
+`StatementBudget` catches it whatever the data size: it limits the number of
+SQL statements an operation runs, and how many times the same statement
+shape (the SQL with literals and parameters replaced by `?`) is repeated.
+
+`guard_statements` records the statements run while it is active, in the
+current context only, so concurrent requests do not count each other's
+statements. The statements are seen by a `before_cursor_execute` listener on
+every `Engine`.
+
+`CachingGraphQLApp` guards every operation with the budget configured by
+`get_statement_budget`, and tests with the `statement_budget` fixture.
+"""
+
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import re
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r"\s+")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|:\w+")
+PARAMETER_LIST = re.compile(r"\(\?(?:, \?)+\)")
+
+
+class StatementBudgetExceeded(Exception):
+    pass
+
+
+def sql_shape(statement):
+    """Normalizes a statement so that executions differing only in values
+    have the same shape."""
+    shape = WHITESPACE.sub(" ", statement).strip()
+    shape = STRING_LITERAL.sub("?", shape)
+    shape = PARAMETER.sub("?", shape)
+    shape = NUMBER_LITERAL.sub("?", shape)
+    return PARAMETER_LIST.sub("(?)", shape)
+
+
+class StatementLog:
+    """The statements run inside one `guard_statements` block.
+
+      Statements are also recorded by the enclosing block, if any.
+    """
+
+    def __init__(self, parent=None) -> None:
+        self.parent = parent
+        self.statements: list[str] = []
+
+    def record(self, statement: str) -> None:
+        self.statements.append(statement)
+        if self.parent is not None:
+            self.parent.record(statement)
+
+    def shapes(self) -> collections.Counter:
+        return collections.Counter(map(sql_shape, self.statements))
+
+
+class StatementBudget:
+    """Limits of the statements of one operation.
+
+      * Arguments:
+      * `max_statements` (int, optional): Statements allowed.
+      * `max_repeats` (int, optional): Executions allowed per statement
+        shape.
+      * `on_exceeded` (str): "raise" to raise `StatementBudgetExceeded`, or
+        "log" to log a warning.
+    """
+
+    def __init__(self,
+                 max_statements: int | None = None,
+                 max_repeats: int | None = None,
+                 on_exceeded: str = "raise") -> None:
+        if on_exceeded not in ("raise", "log"):
+            raise ValueError(f'Unknown on_exceeded {on_exceeded!r}')
+        self.max_statements = max_statements
+        self.max_repeats = max_repeats
+        self.on_exceeded = on_exceeded
+
+    def violations(self, log: StatementLog) -> list[str]:
+        violations = []
+        if (self.max_statements is not None
+                and len(log.statements) > self.max_statements):
+            violations.append(f"{len(log.statements)} statements, more than"
+                              f" the budget of {self.max_statements}")
+        if self.max_repeats is not None:
+            for shape, count in log.shapes().most_common():
+                if count <= self.max_repeats:
+                    break
+                violations.append(f"{count} executions of {shape!r}, more"
+                                  f" than the budget of {self.max_repeats}")
+        return violations
+
+    def enforce(self, log: StatementLog, name: str) -> None:
+        violations = self.violations(log)
+        if not violations:
+            return
+        message = f"{name} exceeds its statement budget: " + "; ".join(
+            violations)
+        if self.on_exceeded == "log":
+            logger.warning(message)
+        else:
+            raise StatementBudgetExceeded(message)
+
+
+current_log: contextvars.ContextVar[StatementLog | None] = (
+    contextvars.ContextVar("current_statement_log", default=None))
+
+# Budget of the guards given none, set by the statement_budget fixture
+default_budget: contextvars.ContextVar[StatementBudget | None] = (
+    contextvars.ContextVar("default_statement_budget", default=None))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    log = current_log.get()
+    if log is not None:
+        log.record(statement)
+
+
+@contextlib.contextmanager
+def guard_statements(budget: StatementBudget | None = None,
+                     name: str = "The operation"):
+    """Records the statements run in the block, then enforces `budget`
+    (defaults to `default_budget`).
+
+      The budget is enforced when the block ends without an exception, i.e.
+      after the statements ran; a mutation is committed even if it raises.
+
+      Yields:
+      StatementLog: The recorded statements.
+    """
+    if budget is None:
+        budget = default_budget.get()
+    log = StatementLog(current_log.get())
+    token = current_log.set(log)
+    try:
+        yield log
+    finally:
+        current_log.reset(token)
+    if budget is not None:
+        budget.enforce(log, name)
+
+
+def get_statement_budget():
+    """Reads the statement budget of GraphQL operations.
+
+      It uses the following environment variables:
+      * STATEMENT_BUDGET: Statements allowed per operation.
+      * STATEMENT_REPEAT_LIMIT: Executions allowed per statement shape.
+      * STATEMENT_BUDGET_MODE: "log" (default) to log operations exceeding
+        the budget, or "raise" to answer them with an error, e.g. in staging.
+
+      Returns:
+      StatementBudget | None: The budget, or None if neither limit is set.
+    """
+    max_statements = os.getenv("STATEMENT_BUDGET")
+    max_repeats = os.getenv("STATEMENT_REPEAT_LIMIT")
+    if max_statements is None and max_repeats is None:
+        return None
+    return StatementBudget(
+        None if max_statements is None else int(max_statements),
+        None if max_repeats is None else int(max_repeats),
+        os.getenv("STATEMENT_BUDGET_MODE", "log").lower())
@@ -0,0 +1,133 @@
+"""Signed access tokens.
+
+Access tokens are JSON Web Tokens signed with HMAC-SHA256 (HS256), using only
+the standard library. The claims are:
+
+* `sub`: The user ID, as a string.
+* `name`: The username.
+* `exp`: The expiry time, in seconds since the epoch.
+
+Verifying a signature on every request is wasted work, because clients send
+the same token over and over again. `VerifiedTokenCache` remembers the user of
+each verified token until the token expires.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any
+from tugastugas.graphql_app import ExpiringLRUCache
+
+logger = logging.getLogger(__name__)
+
+HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+ENCODED_HEADER = b64encode(
+    json.dumps(HEADER, separators=(",", ":")).encode("utf-8"))
+
+
+def get_token_secret(development=False):
+    """Reads the key signing access tokens.
+
+      It uses the TOKEN_SECRET environment variable, which every worker has
+      to share. When it is not set, a random key is generated in
+      development, with a warning, because tokens are then only valid in the
+      process that issued them and until it restarts. Otherwise, starting
+      without a key is refused.
+
+      Returns:
+      bytes: The signing key.
+    """
+    secret = os.getenv("TOKEN_SECRET")
+    if secret is None:
+        if not development:
+            raise RuntimeError(
+                "TOKEN_SECRET must be set to the key signing access tokens")
+        logger.warning(
+            "TOKEN_SECRET is not set: signing tokens with a random key, so"
+            " tokens are rejected by other workers and after a restart")
+        return secrets.token_bytes(32)
+    return secret.encode("utf-8")
+
+
+def get_token_ttl():
+    """Reads the lifetime of access tokens in seconds.
+
+      It uses the TOKEN_TTL environment variable (defaults to "3600").
+    """
+    return int(os.getenv("TOKEN_TTL", "3600"))
+
+
+def sign(signing_input: str, secret: bytes) -> str:
+    return b64encode(
+        hmac.new(secret, signing_input.encode("ascii"),
+                 hashlib.sha256).digest())
+
+
+def encode_token(claims: dict[str, Any], secret: bytes) -> str:
+    """Makes a signed token carrying `claims`."""
+    payload = b64encode(
+        json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signing_input = f"{ENCODED_HEADER}.{payload}"
+    return f"{signing_input}.{sign(signing_input, secret)}"
+
+
+def decode_token(token: str,
+                 secret: bytes,
+                 now: float | None = None) -> dict[str, Any] | None:
+    """Verifies a token made by `encode_token` and returns its claims.
+
+      Returns None, without raising, if the token is malformed, has a wrong
+      signature or has expired. The cheap checks come first: the header has
+      to be the only one `encode_token` makes, so no JSON is parsed before
+      the signature is known to be right.
+    """
+    header, _, rest = token.partition(".")
+    payload, _, signature = rest.partition(".")
+    if header != ENCODED_HEADER or not payload or not signature:
+        return None
+    expected = sign(f"{header}.{payload}", secret)
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        claims = json.loads(b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"),
+                                                      (int, float)):
+        return None
+    if claims["exp"] <= (time.time() if now is None else now):
+        return None
+    return claims
+
+
+class VerifiedTokenCache(ExpiringLRUCache):
+    """Bounded cache of verified tokens and their users.
+
+      An entry is dropped when its token expires, i.e. at its `exp` claim,
+      and the least recently used entry is evicted when `max_size` entries
+      are stored.
+    """
+
+
+def get_token_cache_size():
+    """Reads the number of verified tokens kept in memory.
+
+      It uses the TOKEN_CACHE_SIZE environment variable (defaults to
+      "10000").
+    """
+    return int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
@@ -0,0 +1,479 @@
+"""Request tracing with spans exported in the OTLP JSON format.
+
+A sampled request is traced by nested spans:
+
+* `TracingMiddleware` (ASGI middleware) starts the trace with the span of the
+  HTTP request, and `traced` wraps every middleware of the chain in `app.py`
+  in a span. A middleware span covers the rest of the chain, so the time
+  spent in the middleware itself is the part not covered by its child span.
+* `trace` spans a coroutine function, e.g. `BearerAuthBackend.authenticate`.
+* `CachingGraphQLApp` spans the parsing and the execution of an operation,
+  and `GraphQLTracingMiddleware` (graphene middleware) the fields resolved
+  asynchronously: the queries, the mutations and the usernames of
+  `TaskNode`. Other fields return right away and are not spanned.
+* `start_span` spans any block, e.g. the query and ORM loading of a page of
+  tasks in `schema.fetch_tasks`.
+* Every SQL statement run by any `Engine` while a span is active gets a span
+  of its own, from `before_cursor_execute` to `after_cursor_execute`.
+
+Requests are sampled with the ratio given to `Tracer`. Tracing starts before
+authentication, so the W3C `traceparent` header of a request is ignored
+unless the tracer trusts it, e.g. behind a gateway setting it; a trusted
+header decides the sampling and continues the trace of the client. Spans of
+unsampled requests cost a context variable lookup.
+
+When the span of the request ends, the whole trace is handed to the exporter
+as one `ExportTraceServiceRequest` of OTLP/JSON. `FileExporter` appends them
+to a JSON lines file, as read by the `otlpjsonfile` receiver of the
+OpenTelemetry Collector, from a background thread, and `MemoryExporter`
+keeps the last ones in memory.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from inspect import isawaitable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "tugastugas"
+
+# Span kinds and status code of OTLP
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+STATUS_ERROR = 2
+
+# Longer statements are truncated in the db.statement attribute
+MAX_STATEMENT_LENGTH = 2000
+
+TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+
+
+def new_id(size):
+    return random.getrandbits(size * 8).to_bytes(size, "big").hex()
+
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """One timed operation of a trace.
+
+      The spans of a trace share `spans`, the list of the spans ended so far,
+      and the exporter, which is given the list when the first span of the
+      trace in this process, `root`, ends.
+    """
+
+    def __init__(self,
+                 name,
+                 kind=INTERNAL,
+                 attributes=None,
+                 parent=None,
+                 trace_id=None,
+                 parent_id=None,
+                 exporter=None) -> None:
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.span_id = new_id(8)
+        if parent is None:
+            self.trace_id = trace_id or new_id(16)
+            self.parent_id = parent_id
+            self.root = self
+            self.spans = []
+            self.exporter = exporter
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.root = parent.root
+            self.spans = parent.spans
+            self.exporter = parent.exporter
+        self.start = time.time_ns()
+        self.end = None
+
+    def set_attribute(self, key, value) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error) -> None:
+        self.status = {"code": STATUS_ERROR, "message": str(error)}
+
+    def finish(self) -> None:
+        self.end = time.time_ns()
+        self.spans.append(self)
+        if self.root is self and self.exporter is not None:
+            self.exporter.export(self.spans)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{
+                "key": key,
+                "value": attribute_value(value)
+            } for key, value in self.attributes.items()],
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.status is not None:
+            span["status"] = self.status
+        return span
+
+
+def to_otlp(spans):
+    """Makes the `ExportTraceServiceRequest` of ended spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": [{
+                    "key": "service.name",
+                    "value": attribute_value(SERVICE_NAME)
+                }]
+            },
+            "scopeSpans": [{
+                "scope": {
+                    "name": __name__
+                },
+                "spans": [span.to_otlp() for span in spans]
+            }]
+        }]
+    }
+
+
+class MemoryExporter:
+    """Keeps the last `max_traces` traces as OTLP/JSON requests."""
+
+    def __init__(self, max_traces=100) -> None:
+        self.requests = deque(maxlen=max_traces)
+
+    def export(self, spans) -> None:
+        self.requests.append(to_otlp(spans))
+
+    def spans(self):
+        """Returns the OTLP spans of the kept traces."""
+        return [
+            span for request in self.requests
+            for resource_spans in request["resourceSpans"]
+            for scope_spans in resource_spans["scopeSpans"]
+            for span in scope_spans["spans"]
+        ]
+
+
+class FileExporter:
+    """Appends every trace to `path` as one line of OTLP/JSON.
+
+      Traces are queued and written by a background thread, started by the
+      first export, so requests never wait for the file. At most
+      `max_queue` traces wait to be written; further ones are dropped and
+      counted in `dropped`.
+    """
+
+    def __init__(self, path, max_queue=1000) -> None:
+        self.path = path
+        self.queue: queue.Queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def export(self, spans) -> None:
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.write_traces,
+                                                   name="trace-exporter",
+                                                   daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait(list(spans))
+        except queue.Full:
+            self.dropped += 1
+
+    def write_traces(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a") as trace_file:
+                    trace_file.writelines(
+                        json.dumps(to_otlp(spans), separators=(",", ":")) +
+                        "\n" for spans in batch)
+            except Exception:
+                logger.exception("Cannot write %d traces to %s", len(batch),
+                                 self.path)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self) -> None:
+        """Waits until the queued traces are written."""
+        self.queue.join()
+
+
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None)
+
+
+class Tracer:
+    """Starts the traces of sampled requests.
+
+      * Arguments:
+      * `sample_ratio` (float): Probability of a request being traced.
+      * `exporter`: `FileExporter`, `MemoryExporter` or any object with an
+        `export(spans)` method.
+      * `trust_traceparent` (bool): Whether the `traceparent` header of
+        requests is used.
+    """
+
+    def __init__(self, sample_ratio, exporter,
+                 trust_traceparent=False) -> None:
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+        self.trust_traceparent = trust_traceparent
+
+    def start_trace(self, name, kind=SERVER, attributes=None,
+                    traceparent=None):
+        """Returns the first span of a new trace, or None if the trace is
+        not sampled.
+
+          A valid `traceparent` header, if trusted, decides the sampling, and
+          makes the span a child of the span of the client.
+        """
+        match = None
+        if self.trust_traceparent:
+            match = TRACEPARENT.fullmatch(traceparent or "")
+        if match is not None:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+            return Span(name, kind, attributes, trace_id=trace_id,
+                        parent_id=parent_id, exporter=self.exporter)
+        if self.sample_ratio <= 0 or random.random() >= self.sample_ratio:
+            return None
+        return Span(name, kind, attributes, exporter=self.exporter)
+
+
+def get_tracer():
+    """Configures tracing from the environment.
+
+      It uses the following environment variables:
+      * TRACE_SAMPLE_RATIO: Ratio of requests traced (defaults to "0").
+      * TRACE_TRUST_TRACEPARENT: "true" to use the `traceparent` header of
+        requests, so that the ones it samples are traced anyway (defaults to
+        "false"). Only set it when the header comes from a trusted proxy,
+        otherwise any client can have its requests traced.
+      * TRACE_EXPORTER: "file" (default) or "memory".
+      * TRACE_FILE: The file of the "file" exporter (defaults to
+        "tugastugas-traces.jsonl").
+
+      Returns:
+      Tracer: The tracer of `TracingMiddleware`.
+    """
+    exporter_name = os.getenv("TRACE_EXPORTER", "file").lower()
+    if exporter_name == "memory":
+        exporter = MemoryExporter()
+    elif exporter_name == "file":
+        exporter = FileExporter(
+            os.getenv("TRACE_FILE", "tugastugas-traces.jsonl"))
+    else:
+        raise ValueError(f"Unknown TRACE_EXPORTER {exporter_name!r}")
+    return Tracer(
+        float(os.getenv("TRACE_SAMPLE_RATIO", "0")), exporter,
+        os.getenv("TRACE_TRUST_TRACEPARENT",
+                  "false").lower() in ("1", "true", "yes"))
+
+
+@contextlib.contextmanager
+def activate(span):
+    """Makes `span` the current span in the block, and ends it after."""
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.record_error(error)
+        raise
+    finally:
+        current_span.reset(token)
+        span.finish()
+
+
+@contextlib.contextmanager
+def start_span(name, kind=INTERNAL, attributes=None):
+    """Spans the block with a child of the current span.
+
+      Yields:
+      Span | None: The span, or None outside of a sampled trace.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    with activate(Span(name, kind, attributes, parent)) as span:
+        yield span
+
+
+def trace(name):
+    """Decorator spanning every call of a coroutine function."""
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if current_span.get() is None:
+                return await function(*args, **kwargs)
+            with start_span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_span(conn, cursor, statement, parameters, context,
+                         executemany):
+    parent = current_span.get()
+    if parent is None or context is None:
+        return
+    words = statement.split(None, 1)
+    operation = words[0].upper() if words else "SQL"
+    context.tracing_span = Span(
+        operation, CLIENT, {
+            "db.system": conn.dialect.name,
+            "db.operation": operation,
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+        }, parent)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement_span(conn, cursor, statement, parameters, context,
+                       executemany):
+    span = getattr(context, "tracing_span", None)
+    if span is not None:
+        context.tracing_span = None
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute("db.rowcount", cursor.rowcount)
+        span.finish()
+
+
+@event.listens_for(Engine, "handle_error")
+def fail_statement_span(exception_context):
+    context = exception_context.execution_context
+    span = getattr(context, "tracing_span", None)
+    if span is not None:
+        context.tracing_span = None
+        span.record_error(exception_context.original_exception)
+        span.finish()
+
+
+class TracingMiddleware:
+    """ASGI middleware starting the trace of sampled HTTP requests.
+
+      It should come first, so that the rest of the middleware is traced.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for key, value in scope.get("headers", ()):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+        span = self.tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"]
+            },
+            traceparent=traceparent)
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code",
+                                   message["status"])
+            await send(message)
+
+        with activate(span):
+            await self.app(scope, receive, send_traced)
+
+
+class MiddlewareSpan:
+    """ASGI middleware spanning the call of the middleware it wraps."""
+
+    def __init__(self, app: ASGIApp, middleware) -> None:
+        cls, args, kwargs = middleware
+        self.app = cls(app, *args, **kwargs)
+        self.name = cls.__name__
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if current_span.get() is None:
+            await self.app(scope, receive, send)
+            return
+        with start_span(self.name):
+            await self.app(scope, receive, send)
+
+
+def traced(middleware):
+    """Wraps a `starlette.middleware.Middleware` in a span."""
+    return type(middleware)(MiddlewareSpan, middleware)
+
+
+class GraphQLTracingMiddleware:
+    """Graphene middleware spanning the fields resolved asynchronously.
+
+      These are the fields doing I/O: the queries, the mutations and the
+      usernames of `TaskNode`. A coroutine resolver only runs when it is
+      awaited, so its span starts then.
+    """
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        parent = current_span.get()
+        if parent is None or not isawaitable(result):
+            return result
+        return self.trace_async(result, info, parent)
+
+    async def trace_async(self, result, info, parent):
+        span = Span(
+            f"{info.parent_type.name}.{info.field_name}", INTERNAL,
+            {"graphql.field.path": ".".join(map(str, info.path.as_list()))},
+            parent)
+        with activate(span):
+            return await result
@@ -1,3 +1,70 @@
+import asyncio
+import os
+from typing import Any
+import pytest
 from pytest_mock_resources import create_postgres_fixture
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from tugastugas.statement_budget import StatementBudget, default_budget
+
+# The tests log in with the fake access tokens of development.
+os.environ.setdefault("ALLOW_FAKE_TOKENS", "true")
 
 alembic_engine = create_postgres_fixture()
+
+
+@pytest.fixture
+def pg_engine(alembic_runner: Any, alembic_engine: Any) -> Any:
+    """The test database migrated to the latest revision, so that the SQL
+    functions and triggers installed by migrations are available."""
+    alembic_runner.migrate_up_to("heads", return_current=False)
+    return alembic_engine
+
+
+@pytest.fixture
+def async_engine(pg_engine):
+    # Every test request runs in its own event loop, so connections must not
+    # be pooled across them.
+    engine = create_async_engine(
+        pg_engine.url.set(drivername='postgresql+psycopg'), poolclass=NullPool)
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def async_session(async_engine):
+    return async_sessionmaker(async_engine,
+                              autoflush=False,
+                              expire_on_commit=False)
+
+
+@pytest.fixture
+def db_env(pg_engine, monkeypatch):
+    """Points the command line tools, e.g. seed and retention, at the test
+    database."""
+    url = pg_engine.url
+    monkeypatch.setenv("DB_USER", url.username)
+    monkeypatch.setenv("DB_PASSWORD", url.password)
+    monkeypatch.setenv("DB_HOST", url.host)
+    monkeypatch.setenv("DB_PORT", str(url.port))
+    monkeypatch.setenv("DB_NAME", url.database)
+
+
+@pytest.fixture
+def statement_budget():
+    """Sets the statement budget of the operations run by a test.
+
+      Calling it with `max_statements` and/or `max_repeats` makes every
+      later `guard_statements` block of the test, e.g. every operation run
+      by `execute` in test_graphql.py, raise `StatementBudgetExceeded` when
+      it exceeds them.
+    """
+    tokens = []
+
+    def set_budget(max_statements=None, max_repeats=None):
+        tokens.append(
+            default_budget.set(StatementBudget(max_statements, max_repeats)))
+
+    yield set_budget
+    for token in reversed(tokens):
+        default_budget.reset(token)
@@ -0,0 +1,78 @@
+"""
+Result cache tests
+"""
+import time
+from tugastugas.cache import (MemoryBackend, SQLiteBackend, TasksCache,
+                              get_tasks_cache)
+
+
+def test_memory_backend_evicts_and_expires() -> None:
+    backend = MemoryBackend(2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    assert backend.get("a") == "1"
+    backend.set("c", "3", 60)
+    assert backend.get("b") is None
+    assert (backend.get("a"), backend.get("c")) == ("1", "3")
+
+    backend.set("d", "4", -1)
+    assert backend.get("d") is None
+    assert backend.incr("n") == 1
+    assert backend.incr("n") == 2
+    assert backend.get_counter("n") == 2
+
+
+def test_sqlite_backend_is_shared(tmp_path) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    worker1 = SQLiteBackend(path, 2)
+    worker2 = SQLiteBackend(path, 2)
+    worker1.set("a", "1", 60)
+    assert worker2.get("a") == "1"
+    time.sleep(0.01)
+    worker2.set("b", "2", 60)
+    time.sleep(0.01)
+    worker1.get("a")
+    worker1.set("c", "3", 60)
+    assert worker2.get("b") is None
+    assert (worker2.get("a"), worker2.get("c")) == ("1", "3")
+
+    worker1.set("d", "4", -1)
+    assert worker2.get("d") is None
+    assert worker1.incr("n") == 1
+    assert worker2.incr("n") == 2
+    assert worker1.get_counter("n") == 2
+
+
+def test_tasks_cache_invalidation() -> None:
+    cache = TasksCache(MemoryBackend(10), 60)
+    key = cache.make_key(1, {"status": "DOING", "first": None}, ["id"])
+    assert cache.get(key) is None
+    cache.set(key, {"tasks": [{"id": 1}], "has_more": False})
+    assert cache.get(cache.make_key(1, {
+        "first": None,
+        "status": "DOING"
+    }, ["id"])) == {
+        "tasks": [{
+            "id": 1
+        }],
+        "has_more": False
+    }
+    assert cache.get(cache.make_key(2, {"status": "DOING"}, ["id"])) is None
+
+    cache.invalidate()
+    assert cache.get(cache.make_key(1, {
+        "status": "DOING",
+        "first": None
+    }, ["id"])) is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "generation": 1}
+
+
+def test_tasks_cache_from_env(monkeypatch, tmp_path) -> None:
+    monkeypatch.setenv("TASKS_CACHE_BACKEND", "none")
+    assert get_tasks_cache() is None
+    monkeypatch.setenv("TASKS_CACHE_BACKEND", "sqlite")
+    monkeypatch.setenv("TASKS_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setenv("TASKS_CACHE_TTL", "2")
+    tasks_cache = get_tasks_cache()
+    assert isinstance(tasks_cache.backend, SQLiteBackend)
+    assert tasks_cache.ttl == 2
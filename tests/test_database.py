@@ -0,0 +1,108 @@
+"""
+Database configuration tests
+"""
+import asyncio
+import pytest
+from tugastugas.app import DBSessionMiddleware
+from tugastugas.database import get_engine_options
+
+
+def test_engine_options_defaults(monkeypatch) -> None:
+    for name in ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_RECYCLE",
+                 "DB_POOL_PRE_PING", "DB_POOL_TIMEOUT"):
+        monkeypatch.delenv(name, raising=False)
+    assert get_engine_options() == {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "pool_timeout": 30.0,
+    }
+
+
+def test_engine_options_from_env(monkeypatch) -> None:
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "600")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "2.5")
+    assert get_engine_options() == {
+        "pool_size": 20,
+        "max_overflow": 0,
+        "pool_recycle": 600,
+        "pool_pre_ping": False,
+        "pool_timeout": 2.5,
+    }
+
+
+class SpySession:
+    """Stands for an `AsyncSession`, recording what the middleware does."""
+
+    def __init__(self) -> None:
+        self.transaction = False
+        self.events: list[str] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.events.append("close")
+
+    def in_transaction(self) -> bool:
+        return self.transaction
+
+    async def rollback(self) -> None:
+        self.transaction = False
+        self.events.append("rollback")
+
+
+def run_request(app):
+    scope = {"type": "http"}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    asyncio.run(app(scope, receive, send))
+    return scope
+
+
+def test_every_request_gets_its_own_session() -> None:
+    sessions = []
+
+    def session_factory():
+        sessions.append(SpySession())
+        return sessions[-1]
+
+    async def app(scope, receive, send):
+        assert scope["session"].events == []
+
+    middleware = DBSessionMiddleware(app, session_factory)
+    scopes = [run_request(middleware) for _ in range(2)]
+    assert [scope["session"] for scope in scopes] == sessions
+    assert sessions[0] is not sessions[1]
+    assert [session.events for session in sessions] == [["close"], ["close"]]
+
+
+def test_open_transactions_are_rolled_back() -> None:
+    session = SpySession()
+
+    async def leave_transaction_open(scope, receive, send):
+        scope["session"].transaction = True
+
+    run_request(DBSessionMiddleware(leave_transaction_open, lambda: session))
+    assert session.events == ["rollback", "close"]
+
+
+def test_failed_requests_are_rolled_back() -> None:
+    session = SpySession()
+
+    async def fail(scope, receive, send):
+        scope["session"].transaction = True
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        run_request(DBSessionMiddleware(fail, lambda: session))
+    assert session.events == ["rollback", "close"]
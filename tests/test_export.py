@@ -0,0 +1,112 @@
+"""
+Task export tests
+"""
+import asyncio
+import csv
+import io
+import json
+from typing import Any
+import pytest
+from sqlalchemy.orm import Session
+from starlette.routing import Route
+from tugastugas import export
+from tugastugas.export import export_tasks
+from tugastugas.models import User, Task
+
+
+def get(async_session, query_string):
+    """Sends a GET request to the export endpoint with its own session, like
+    `app.DBSessionMiddleware` does."""
+    route = Route('/export/tasks', endpoint=export_tasks, methods=["GET"])
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # StreamingResponse listens for a disconnect while streaming
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        async with async_session() as session:
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/export/tasks",
+                "query_string": query_string.encode(),
+                "headers": [],
+                "session": session,
+            }
+            await route(scope, receive, send)
+
+    asyncio.run(run())
+    headers = dict(messages[0]["headers"])
+    chunks = [message.get("body", b"") for message in messages[1:]]
+    return messages[0]["status"], headers, chunks
+
+
+def add_tasks(pg_engine):
+    with Session(pg_engine) as session:
+        session.add(User(id=1, username='usr1', password_hash=''))
+        session.add(User(id=2, username='usr2', password_hash=''))
+        session.add_all([
+            Task(id=id,
+                 title=f"T{id}",
+                 description="line 1\nline 2, \"quoted\"",
+                 status="DONE" if id % 2 else "DOING",
+                 creator_id=1 if id <= 3 else 2,
+                 last_modifier_id=1) for id in range(1, 6)
+        ])
+        session.commit()
+
+
+def test_export_ndjson(pg_engine: Any, async_session: Any,
+                       monkeypatch: Any) -> None:
+    add_tasks(pg_engine)
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    status, headers, chunks = get(async_session, "status=DONE")
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"application/x-ndjson")
+    # One chunk per batch of the server-side cursor
+    assert len([chunk for chunk in chunks if chunk]) == 2
+    tasks = [
+        json.loads(line) for line in b"".join(chunks).decode().splitlines()
+    ]
+    assert [a_task["id"] for a_task in tasks] == [1, 3, 5]
+    assert tasks[0] == {
+        "id": 1,
+        "title": "T1",
+        "description": "line 1\nline 2, \"quoted\"",
+        "due_date": None,
+        "status": "DONE",
+        "creator_id": 1,
+        "last_modifier_id": 1
+    }
+
+
+def test_export_csv(pg_engine: Any, async_session: Any) -> None:
+    add_tasks(pg_engine)
+    status, headers, chunks = get(async_session,
+                                  "format=csv&creator=usr2")
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/csv")
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert [row["id"] for row in rows] == ["4", "5"]
+    assert rows[0]["description"] == "line 1\nline 2, \"quoted\""
+
+    status, headers, chunks = get(async_session, "format=csv&id=100")
+    assert b"".join(chunks).decode().splitlines() == [
+        ",".join(export.EXPORT_COLUMNS)
+    ]
+
+
+def test_export_rejects_invalid_parameters(pg_engine: Any,
+                                           async_session: Any) -> None:
+    status, headers, chunks = get(async_session, "format=xml")
+    assert status == 400
+    status, headers, chunks = get(async_session, "dueSince=tomorrow")
+    assert status == 400
+    assert b"".join(chunks) == b"Invalid dueSince 'tomorrow'."
@@ -1,23 +1,75 @@
 """
 GraphQL querying tests
 """
+import asyncio
 from typing import Any
 import pytest
-from pytest_mock_resources import create_postgres_fixture
+from sqlalchemy import func, select
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session as scoped_session_factory
 from tugastugas.database import Base
 from tugastugas import schema
-from tugastugas.models import User, Task
+from tugastugas.cache import MemoryBackend, TasksCache
+from tugastugas.statement_budget import (StatementBudget,
+                                         StatementBudgetExceeded,
+                                         guard_statements)
+from tugastugas.models import User, Task, HTask
 from pydantic import BaseModel
 
-alembic_engine: Any = create_postgres_fixture()
-pg_engine = create_postgres_fixture(Base)
 
+def execute(query, context):
+    """Runs a GraphQL operation the way the ASGI app does, i.e. asynchronously,
+    on its own `AsyncSession` and with a fresh request-scoped `UserLoader`.
 
-@pytest.mark.alembic()
-def prepare(alembic_runner: Any) -> None:
-    alembic_runner.migrate_up_to("head", return_current=False)
+    The operation is guarded by the budget set with `statement_budget`."""
+
+    async def run():
+        async with context['session_factory']() as session:
+            request_context = {
+                "session": session,
+                "user": context['user'],
+                "user_loader": schema.UserLoader(session),
+                "tasks_cache": context.get('tasks_cache')
+            }
+            with guard_statements(name=query):
+                return await schema.schema.execute_async(
+                    query,
+                    context=request_context,
+                    execution_context_class=schema.SerialExecutionContext)
+
+    return asyncio.run(run())
+
+
+def count_statements():
+    """Records the statements run in the block, without enforcing a budget,
+    e.g. `with count_statements() as log: ...` then `log.statements`."""
+    return guard_statements(StatementBudget(), name="The block")
+
+
+@pytest.fixture(autouse=True)
+def no_repeated_statements(statement_budget):
+    """Fails operations running a statement more than once, e.g. loading
+    the users of tasks one by one."""
+    statement_budget(max_repeats=1)
+
+
+@pytest.fixture
+def pg_session(pg_engine):
+    session_factory = sessionmaker(autocommit=False,
+                                   autoflush=False,
+                                   bind=pg_engine)
+    pg_session = scoped_session_factory(session_factory)
+    Base.query = pg_session.query_property()
+    yield pg_session
+    pg_session.remove()
+
+
+def task_nodes(result):
+    return [edge['node'] for edge in result.data['tasks']['edges']]
+
+
+class FakeUser(BaseModel):
+    id: int
 
 
 def add_users(pg_session):
@@ -43,7 +95,7 @@ def create_task1(context):
           }
         }
     '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
 
 
@@ -62,7 +114,7 @@ def create_task2(context):
           }
         }
     '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
 
 
@@ -77,7 +129,7 @@ def create_task3(context):
           ) { task { id } }
         }
     '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
 
 
@@ -91,15 +143,19 @@ def query_tasks(context):
     query = '''
               query Q1 {
                 tasks {
-                  title
+                  edges {
+                    node {
+                      title
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert len(result.data['tasks']) == 3
+    assert len(task_nodes(result)) == 3
     assert set([task['title']
-                for task in result.data['tasks']]) == set(["T1", "T2", "T3"])
+                for task in task_nodes(result)]) == set(["T1", "T2", "T3"])
 
 
 def delete_task(context):
@@ -108,7 +164,7 @@ def delete_task(context):
       deleteTask(id:2) { id }
     }
     '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
     assert result.data == {"deleteTask": {"id": 2}}
 
@@ -117,13 +173,17 @@ def query_tasks_after_delete(context):
     query = '''
               query Q1 {
                 tasks {
-                  title
+                  edges {
+                    node {
+                      title
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert len(result.data['tasks']) == 2
+    assert len(task_nodes(result)) == 2
 
 
 def update_task(context):
@@ -142,7 +202,7 @@ def update_task(context):
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
     assert result.data == {"updateTask": {"task": {"id": 2, "title": "T2-R1"}}}
 
@@ -151,15 +211,19 @@ def query_tasks_after_update_with_id_filter(context):
     query = '''
               query Q3 {
                 tasks(id:2) {
-                  id,
-                  title,
-                  status
+                  edges {
+                    node {
+                      id,
+                      title,
+                      status
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert result.data['tasks'][0] == {
+    assert task_nodes(result)[0] == {
         'id': 2,
         'title': 'T2-R1',
         'status': 'DONE'
@@ -170,83 +234,94 @@ def query_tasks_with_status_eq_done(context):
     query = '''
               query QueryStatusEqDone {
                 tasks(status:"DONE") {
-                  id,
+                  edges {
+                    node {
+                      id,
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert result.data['tasks'][0] == {'id': 2}
+    assert task_nodes(result)[0] == {'id': 2}
 
 
 def query_tasks_with_creator_eq_usr2(context):
     query = '''
               query QueryStatusEqDone {
                 tasks(creator:"usr2") {
-                  title,
+                  edges {
+                    node {
+                      title,
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert result.data['tasks'] == [{'title': 'T3'}]
+    assert task_nodes(result) == [{'title': 'T3'}]
 
 
 def query_tasks_with_last_modifier_eq_usr2(context):
     query = '''
               query QueryStatusEqDone {
                 tasks(lastModifier:"usr2") {
-                  title,
+                  edges {
+                    node {
+                      title,
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
     assert set([task['title']
-                for task in result.data['tasks']]) == set(['T2-R1', 'T3'])
+                for task in task_nodes(result)]) == set(['T2-R1', 'T3'])
 
 
 def query_tasks_with_due_before(context):
     query = '''
               query QueryStatusEqDone {
                 tasks(dueBefore:"2026-01-01") {
-                  title,
+                  edges {
+                    node {
+                      title,
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
-    assert result.data['tasks'] == [{'title': 'T3'}]
+    assert task_nodes(result) == [{'title': 'T3'}]
 
 
 def query_tasks_with_due_since(context):
     query = '''
               query QueryStatusEqDone {
                 tasks(dueBefore:"2026-01-01") {
-                  title,
+                  edges {
+                    node {
+                      title,
+                    }
+                  }
                 }
               }
             '''
-    result = schema.schema.execute(query, context=context)
+    result = execute(query, context)
     assert result.errors is None
     assert set([task['title']
-                for task in result.data['tasks']]) == set(["T1", "T2-R1"])
-
+                for task in task_nodes(result)]) == set(["T1", "T2-R1"])
 
-def test_crud(pg_engine: Any) -> None:
 
-    class TestUser(BaseModel):
-        id: int
-
-    user = TestUser(id=1)
-    user2 = TestUser(id=2)
-    session_factory = sessionmaker(autocommit=False,
-                                   autoflush=False,
-                                   bind=pg_engine)
-    pg_session = scoped_session_factory(session_factory)
-    Base.query = pg_session.query_property()
-    context = {"session": pg_session, "user": user}
-    context_user2 = {"session": pg_session, "user": user2}
+def test_crud(pg_session: Any, async_session: Any) -> None:
+    user = FakeUser(id=1)
+    user2 = FakeUser(id=2)
+    context = {"session_factory": async_session, "user": user}
+    context_user2 = {"session_factory": async_session, "user": user2}
 
     add_users(pg_session)
     create_tasks(context, context_user2)
@@ -257,3 +332,600 @@ def test_crud(pg_engine: Any) -> None:
     query_tasks_with_creator_eq_usr2(context)
     delete_task(context)
     query_tasks_after_delete(context)
+
+
+def test_tasks_statement_count(pg_session: Any, async_session: Any,
+                               statement_budget: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    pg_session.add_all([
+        Task(title=f"T{i}",
+             description="",
+             status="DOING",
+             creator_id=i % 2 + 1,
+             last_modifier_id=(i + 1) % 2 + 1) for i in range(1000)
+    ])
+    pg_session.commit()
+    pg_session.expunge_all()
+
+    # One statement for the tasks, one for all of their users.
+    statement_budget(max_statements=2)
+    query = '''
+              query Q1 {
+                tasks(first: 1000) {
+                  edges {
+                    node {
+                      id, creator, lastModifier
+                    }
+                  }
+                }
+              }
+            '''
+    result = execute(query, context)
+    assert result.errors is None
+    assert len(task_nodes(result)) == 1000
+    assert set(task['creator']
+               for task in task_nodes(result)) == set(['usr1', 'usr2'])
+
+
+def test_statement_budget_catches_n_plus_one(pg_session: Any,
+                                             async_session: Any,
+                                             monkeypatch: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    create_task1(context)
+    create_task2(context)
+
+    async def load_username_alone(self, user_id):
+        return await self.session.scalar(
+            select(User.username).where(User.id == user_id))
+
+    monkeypatch.setattr(schema.UserLoader, 'load', load_username_alone)
+    with pytest.raises(StatementBudgetExceeded, match='2 executions'):
+        execute('{ tasks { edges { node { id, creator } } } }', context)
+
+
+def query_page(context, arguments):
+    query = '''
+              query Page {
+                tasks(%s) {
+                  edges { node { title } }
+                  pageInfo {
+                    hasNextPage, hasPreviousPage, startCursor, endCursor
+                  }
+                }
+              }
+            ''' % arguments
+    result = execute(query, context)
+    assert result.errors is None
+    return ([task['title'] for task in task_nodes(result)],
+            result.data['tasks']['pageInfo'])
+
+
+def test_tasks_keyset_pagination(pg_session: Any,
+                                 async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    pg_session.add_all([
+        Task(title=f"T{i}",
+             description="",
+             status="DONE" if i % 2 else "DOING",
+             creator_id=1,
+             last_modifier_id=1) for i in range(1, 8)
+    ])
+    pg_session.commit()
+
+    titles, page_info = query_page(context, 'first: 3')
+    assert titles == ['T1', 'T2', 'T3']
+    assert page_info['hasNextPage']
+    titles, page_info = query_page(context,
+                                   f'first: 3, after: "{page_info["endCursor"]}"')
+    assert titles == ['T4', 'T5', 'T6']
+    assert page_info['hasNextPage']
+    titles, page_info = query_page(context,
+                                   f'first: 3, after: "{page_info["endCursor"]}"')
+    assert titles == ['T7']
+    assert not page_info['hasNextPage']
+
+    titles, page_info = query_page(context, 'last: 2')
+    assert titles == ['T6', 'T7']
+    assert page_info['hasPreviousPage']
+    titles, page_info = query_page(
+        context, f'last: 2, before: "{page_info["startCursor"]}"')
+    assert titles == ['T4', 'T5']
+
+    titles, page_info = query_page(context, 'status: "DONE", first: 2')
+    assert titles == ['T1', 'T3']
+    titles, page_info = query_page(
+        context, f'status: "DONE", first: 2, after: "{page_info["endCursor"]}"')
+    assert titles == ['T5', 'T7']
+    assert not page_info['hasNextPage']
+
+    result = execute('query { tasks(after: "bogus") { edges { cursor } } }',
+                     context)
+    assert result.errors is not None
+
+
+def test_search_tasks(pg_session: Any, async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    pg_session.add_all([
+        Task(title=title,
+             description=description,
+             status=status,
+             creator_id=1,
+             last_modifier_id=1) for title, description, status in [
+                 ("Call customer", "About the invoice", "TODO"),
+                 ("Pay invoices", "", "DONE"),
+                 ("Plan release", "Send the invoice after the release",
+                  "TODO"),
+                 ("Review budget", "", "TODO"),
+                 ("Invoice review", "Check the invoice of the invoice",
+                  "TODO"),
+             ]
+    ])
+    pg_session.commit()
+
+    # Title matches rank higher, then more matches
+    titles, page_info = query_page(context, 'search: "invoice"')
+    assert titles == [
+        'Invoice review', 'Pay invoices', 'Call customer', 'Plan release'
+    ]
+    titles, _ = query_page(context, 'search: "invoice -release", '
+                           'status: "TODO"')
+    assert titles == ['Invoice review', 'Call customer']
+
+    titles, page_info = query_page(context, 'search: "invoice", first: 3')
+    assert titles == ['Invoice review', 'Pay invoices', 'Call customer']
+    titles, page_info = query_page(
+        context,
+        f'search: "invoice", first: 3, after: "{page_info["endCursor"]}"')
+    assert titles == ['Plan release']
+    assert not page_info['hasNextPage']
+    titles, page_info = query_page(
+        context,
+        f'search: "invoice", last: 2, before: "{page_info["startCursor"]}"')
+    assert titles == ['Pay invoices', 'Call customer']
+    assert page_info['hasPreviousPage']
+
+    # Cursors of another sort key are rejected
+    _, page_info = query_page(context, 'first: 1')
+    result = execute(
+        '{ tasks(search: "invoice", after: "%s") { edges { cursor } } }' %
+        page_info['endCursor'], context)
+    assert result.errors[0].message.startswith('Invalid cursor')
+
+
+def page_through(context, arguments):
+    """Returns the titles of all tasks, paging forward and backward by two."""
+    titles, page_info = query_page(context, f'{arguments}, first: 2')
+    while page_info['hasNextPage']:
+        page, page_info = query_page(
+            context,
+            f'{arguments}, first: 2, after: "{page_info["endCursor"]}"')
+        titles += page
+    backward_titles, page_info = query_page(context, f'{arguments}, last: 2')
+    while page_info['hasPreviousPage']:
+        page, page_info = query_page(
+            context,
+            f'{arguments}, last: 2, before: "{page_info["startCursor"]}"')
+        backward_titles = page + backward_titles
+    assert titles == backward_titles
+    return titles
+
+
+def test_tasks_order_by(pg_session: Any, async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    pg_session.add_all([
+        Task(title=f"T{i}",
+             description="invoice" if i % 2 else "",
+             due_date=due_date,
+             status=status,
+             creator_id=1,
+             last_modifier_id=1) for i, (due_date, status) in enumerate(
+                 [("2026-03-01", "TODO"), (None, "DONE"),
+                  ("2026-01-01", "DOING"), (None, "TODO"),
+                  ("2026-03-01", "DONE"), ("2026-02-01", "TODO"),
+                  (None, "DOING")],
+                 start=1)
+    ])
+    pg_session.commit()
+
+    assert page_through(context, 'orderBy: {field: DUE_DATE}') == [
+        'T3', 'T6', 'T1', 'T5', 'T2', 'T4', 'T7'
+    ]
+    assert page_through(context,
+                        'orderBy: {field: DUE_DATE, nulls: FIRST}') == [
+                            'T2', 'T4', 'T7', 'T3', 'T6', 'T1', 'T5'
+                        ]
+    assert page_through(context,
+                        'orderBy: {field: DUE_DATE, direction: DESC}') == [
+                            'T7', 'T4', 'T2', 'T5', 'T1', 'T6', 'T3'
+                        ]
+    assert page_through(
+        context,
+        'orderBy: {field: DUE_DATE, direction: DESC, nulls: LAST}') == [
+            'T5', 'T1', 'T6', 'T3', 'T7', 'T4', 'T2'
+        ]
+    assert page_through(context, 'orderBy: {field: STATUS}') == [
+        'T3', 'T7', 'T2', 'T5', 'T1', 'T4', 'T6'
+    ]
+    assert page_through(context,
+                        'orderBy: {field: TITLE, direction: DESC}') == [
+                            'T7', 'T6', 'T5', 'T4', 'T3', 'T2', 'T1'
+                        ]
+    assert page_through(context, 'orderBy: {field: ID, direction: DESC}') == [
+        'T7', 'T6', 'T5', 'T4', 'T3', 'T2', 'T1'
+    ]
+    # The order takes precedence over the relevance of a search
+    assert page_through(
+        context, 'search: "invoice", status: "TODO", '
+        'orderBy: {field: DUE_DATE, direction: DESC}') == ['T1']
+    assert page_through(
+        context, 'search: "invoice", '
+        'orderBy: {field: DUE_DATE, direction: DESC}') == [
+            'T7', 'T5', 'T1', 'T3'
+        ]
+
+    # Cursors of another order are rejected
+    _, page_info = query_page(context, 'first: 1')
+    result = execute(
+        '{ tasks(orderBy: {field: TITLE}, after: "%s") { edges { cursor } } }'
+        % page_info['endCursor'], context)
+    assert result.errors[0].message.startswith('Invalid cursor')
+
+
+def test_create_tasks_in_bulk(pg_session: Any,
+                              async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=2)}
+    add_users(pg_session)
+    items = ', '.join(f'{{title:"B{i}", status:"TODO"}}' for i in range(5))
+    query = '''
+              mutation CreateMany {
+                createTasks(input: [%s, {title:"B5", status:"DONE",
+                                         dueDate:"2027-01-01"}]) {
+                  tasks { id, title, status, dueDate, creator }
+                }
+              }
+            ''' % items
+
+    with count_statements() as log:
+        result = execute(query, context)
+    assert result.errors is None
+    tasks = result.data['createTasks']['tasks']
+    assert [task['title'] for task in tasks] == [f'B{i}' for i in range(6)]
+    assert tasks[5] == {
+        'id': tasks[5]['id'],
+        'title': 'B5',
+        'status': 'DONE',
+        'dueDate': '2027-01-01',
+        'creator': 'usr2'
+    }
+    # The user lookup, set_config of the acting user, one multi-row INSERT
+    # (the audit trigger writes the history) and the username batch.
+    assert len(log.statements) == 4
+
+    histories = pg_session.scalars(select(HTask)).all()
+    assert sorted(int(h.target_row_id)
+                  for h in histories) == sorted(task['id'] for task in tasks)
+    assert all(h.executed_operation == 1 and h.user_id == 2
+               for h in histories)
+
+    items = ', '.join(['{title:"X", status:"TODO"}'] *
+                      (schema.MAX_BULK_CREATE + 1))
+    result = execute(
+        'mutation { createTasks(input: [%s]) { tasks { id } } }' % items,
+        context)
+    assert result.errors[0].message == (
+        'At most 1000 tasks can be created at once.')
+    assert len(pg_session.scalars(select(HTask)).all()) == 6
+
+
+def test_mutations_run_one_statement(pg_session: Any,
+                                     async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    context_user2 = {"session_factory": async_session, "user": FakeUser(id=2)}
+    add_users(pg_session)
+
+    with count_statements() as log:
+        result = execute(
+            'mutation { createTask(title:"T1", status:"DOING") '
+            '{ task { id } } }', context)
+        assert result.errors is None
+        task_id = result.data['createTask']['task']['id']
+        result = execute(
+            'mutation { updateTask(id:%d, title:"T1-R1") '
+            '{ task { id, title, status } } }' % task_id, context)
+        assert result.errors is None
+        assert result.data['updateTask']['task'] == {
+            'id': task_id,
+            'title': 'T1-R1',
+            'status': 'DOING'
+        }
+        result = execute('mutation { deleteTask(id:%d) { id } }' % task_id,
+                         context_user2)
+        assert result.errors[0].message == \
+            'This project is not belong to the user.'
+        result = execute('mutation { deleteTask(id:%d) { id } }' % task_id,
+                         context)
+        assert result.errors is None
+    assert len(log.statements) == 4
+
+    histories = pg_session.scalars(select(HTask).order_by(HTask.id)).all()
+    assert [(h.executed_operation, h.data_after_executed_operation['title'])
+            for h in histories] == [(1, 'T1'), (3, 'T1'), (2, 'T1-R1')]
+
+    result = execute('mutation { updateTask(id:%d, title:"X") { task { id } } }'
+                     % task_id, context)
+    assert result.errors[0].message == f'The task #{task_id} does not exist.'
+
+
+def test_undo_changes_are_not_undoable(pg_session: Any,
+                                       async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    result = execute(
+        'mutation { createTask(title:"T1", status:"DOING", '
+        'dueDate:"2026-01-01") { task { id } } }', context)
+    task_id = result.data['createTask']['task']['id']
+    execute('mutation { updateTask(id:%d, title:"T1-R1") { task { id } } }'
+            % task_id, context)
+
+    result = execute('mutation { undoTask { task { id, title } } }', context)
+    assert result.errors is None
+    assert result.data['undoTask']['task'] == {'id': task_id, 'title': 'T1'}
+    undo_history = pg_session.scalars(
+        select(HTask).order_by(HTask.id.desc()).limit(1)).one()
+    assert undo_history.executed_operation == 3
+    assert undo_history.from_undo and undo_history.used
+
+    # The next undo reverts the creation instead of the undo.
+    result = execute('mutation { undoTask { task { id } } }', context)
+    assert result.errors is None
+    assert pg_session.get(Task, task_id) is None
+
+
+def test_undo_restores_null_values(pg_session: Any,
+                                   async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    result = execute(
+        'mutation { createTask(title:"T1", status:"DOING") '
+        '{ task { id } } }', context)
+    task_id = result.data['createTask']['task']['id']
+    execute(
+        'mutation { updateTask(id:%d, title:"T1-R1", dueDate:"2027-01-01") '
+        '{ task { id } } }' % task_id, context)
+    execute('mutation { deleteTask(id:%d) { id } }' % task_id, context)
+
+    result = execute('mutation { undoTask { task { id, title, dueDate } } }',
+                     context)
+    assert result.errors is None
+    assert result.data['undoTask']['task'] == {
+        'id': task_id,
+        'title': 'T1-R1',
+        'dueDate': '2027-01-01'
+    }
+    result = execute('mutation { undoTask { task { id, title, dueDate } } }',
+                     context)
+    assert result.errors is None
+    assert result.data['undoTask']['task'] == {
+        'id': task_id,
+        'title': 'T1',
+        'dueDate': None
+    }
+
+
+def test_undo_restores_modified_columns_only(pg_session: Any,
+                                            async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    context_user2 = {"session_factory": async_session, "user": FakeUser(id=2)}
+    add_users(pg_session)
+    result = execute(
+        'mutation { createTask(title:"T1", description:"D1", '
+        'status:"DOING") { task { id } } }', context)
+    task_id = result.data['createTask']['task']['id']
+    execute('mutation { updateTask(id:%d, title:"T1-R1") { task { id } } }'
+            % task_id, context)
+    execute('mutation { updateTask(id:%d, status:"DONE") { task { id } } }'
+            % task_id, context_user2)
+
+    histories = pg_session.scalars(
+        select(HTask).where(HTask.executed_operation == 3).order_by(
+            HTask.id)).all()
+    assert [h.data_after_executed_operation for h in histories] == [{
+        'title': 'T1'
+    }, {
+        'status': 'DOING',
+        'last_modifier_id': 1
+    }]
+
+    # The status set by the other user is kept.
+    result = execute(
+        'mutation { undoTask { task { title, description, status } } }',
+        context)
+    assert result.errors is None
+    assert result.data['undoTask']['task'] == {
+        'title': 'T1',
+        'description': 'D1',
+        'status': 'DONE'
+    }
+
+
+def test_undo_many_steps(pg_session: Any, async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    result = execute(
+        'mutation { createTask(title:"T1", status:"DOING") '
+        '{ task { id } } }', context)
+    task_id = result.data['createTask']['task']['id']
+    for title in ["T1-R1", "T1-R2", "T1-R3"]:
+        execute(
+            'mutation { updateTask(id:%d, title:"%s") { task { id } } }' %
+            (task_id, title), context)
+    execute(
+        'mutation { createTask(title:"T2", status:"DOING") '
+        '{ task { id } } }', context)
+
+    result = execute('mutation { undoTask(steps:0) { task { id } } }',
+                     context)
+    assert result.errors[0].message == 'The steps must be between 1 and 1000.'
+
+    # Reverts the creation of T2 and the last two updates of T1
+    result = execute(
+        'mutation { undoTask(steps:3) { task { id }, tasks { id, title } } }',
+        context)
+    assert result.errors is None
+    assert result.data['undoTask'] == {
+        'task': None,
+        'tasks': [{
+            'id': task_id,
+            'title': 'T1-R1'
+        }]
+    }
+    assert pg_session.scalar(select(func.count()).select_from(Task)) == 1
+
+    # Reverts everything since the first update
+    first_update_at = pg_session.scalars(
+        select(HTask.operation_executed_at).where(
+            HTask.executed_operation == 3).order_by(HTask.id).limit(1)).one()
+    result = execute(
+        'mutation { undoTask(untilTimestamp:"%s") { task { id, title } } }' %
+        first_update_at.isoformat(), context)
+    assert result.errors is None
+    assert result.data['undoTask']['task'] == {'id': task_id, 'title': 'T1'}
+    pg_session.expire_all()
+    assert pg_session.get(Task, task_id) is not None
+
+    result = execute(
+        'mutation { undoTask(steps:5) { tasks { id } } }', context)
+    assert result.errors is None
+    assert result.data['undoTask']['tasks'] == []
+    result = execute('mutation { undoTask { task { id } } }', context)
+    assert result.errors[0].message == 'Cannot undo anything for user 1'
+
+
+def test_undo_tasks_created_together(pg_session: Any,
+                                     async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    items = ', '.join(f'{{title:"B{i}", status:"TODO"}}' for i in range(5))
+    execute('mutation { createTasks(input: [%s]) { tasks { id } } }' % items,
+            context)
+
+    # The history records share the timestamp of the transaction, so they
+    # are undone from the last one created
+    for remaining in range(4, 1, -1):
+        result = execute('mutation { undoTask { task { id } } }', context)
+        assert result.errors is None
+        assert pg_session.scalars(select(Task.title).order_by(
+            Task.id)).all() == [f'B{i}' for i in range(remaining)]
+
+
+def test_tasks_selected_twice(pg_session: Any, async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    create_task1(context)
+    create_task2(context)
+    result = execute(
+        '''
+        query {
+          doing: tasks(status: "DOING") { edges { node { id, creator } } }
+          first: tasks(first: 1) { edges { node { id, lastModifier } } }
+        }
+    ''', context)
+    assert result.errors is None
+    assert result.data == {
+        'doing': {
+            'edges': [{
+                'node': {
+                    'id': 1,
+                    'creator': 'usr1'
+                }
+            }, {
+                'node': {
+                    'id': 2,
+                    'creator': 'usr1'
+                }
+            }]
+        },
+        'first': {
+            'edges': [{
+                'node': {
+                    'id': 1,
+                    'lastModifier': 'usr1'
+                }
+            }]
+        }
+    }
+
+
+def test_tasks_load_selected_columns(pg_session: Any,
+                                     async_session: Any) -> None:
+    context = {"session_factory": async_session, "user": FakeUser(id=1)}
+    add_users(pg_session)
+    create_task1(context)
+
+    def task_columns(query):
+        with count_statements() as log:
+            result = execute(query, context)
+        assert result.errors is None
+        select_list = log.statements[0].split(' FROM ')[0]
+        return set(column for column in [
+            'id', 'title', 'description', 'due_date', 'status', 'creator_id',
+            'last_modifier_id', 'from_undo'
+        ] if f'task.{column}' in select_list), result
+
+    columns, result = task_columns(
+        '{ tasks { edges { node { id, status } } } }')
+    assert columns == {'id', 'status'}
+    assert task_nodes(result) == [{'id': 1, 'status': 'DOING'}]
+
+    columns, result = task_columns('''
+        query {
+          tasks { edges { cursor, node { ...Names, dueDate } } }
+          other: tasks { edges { node { description } } }
+        }
+        fragment Names on TaskNode { creator, lastModifier }
+    ''')
+    assert columns == {'id', 'due_date', 'creator_id', 'last_modifier_id'}
+    assert task_nodes(result) == [{
+        'creator': 'usr1',
+        'lastModifier': 'usr1',
+        'dueDate': '2026-01-01'
+    }]
+    assert result.data['other']['edges'][0]['node'] == {
+        'description': 'DESC1'
+    }
+
+
+def test_tasks_cache(pg_session: Any,
+                     async_session: Any) -> None:
+    tasks_cache = TasksCache(MemoryBackend(10), 60)
+    context = {
+        "session_factory": async_session,
+        "user": FakeUser(id=1),
+        "tasks_cache": tasks_cache
+    }
+    add_users(pg_session)
+    create_task1(context)
+    query = '{ tasks { edges { node { id, title, dueDate, creator } } } }'
+    with count_statements() as log:
+        results = [execute(query, context) for _ in range(2)]
+    assert results[0].data == results[1].data
+    assert task_nodes(results[1]) == [{
+        'id': 1,
+        'title': 'T1',
+        'dueDate': '2026-01-01',
+        'creator': 'usr1'
+    }]
+    # The second page comes from the cache; only usernames are queried.
+    assert len(log.statements) == 3
+    assert (tasks_cache.hits, tasks_cache.misses) == (1, 1)
+
+    execute('mutation { updateTask(id:1, title:"T1-R1") { task { id } } }',
+            context)
+    result = execute(query, context)
+    assert task_nodes(result)[0]['title'] == 'T1-R1'
+    assert (tasks_cache.hits, tasks_cache.misses) == (1, 2)
@@ -0,0 +1,302 @@
+"""
+GraphQL endpoint caching tests
+"""
+import asyncio
+import json
+import graphene
+from graphql import parse, validate
+from tugastugas import graphql_app
+from tugastugas.graphql_app import CachingGraphQLApp, LRUCache, hash_query
+from tugastugas.query_cost import query_cost_rule
+from tugastugas.schema import schema
+
+TYPENAME_QUERY = "{ __typename }"
+UNDO_QUERY = "mutation { undoTask { task { id } } }"
+
+
+class AnonymousUser:
+    id = None
+
+
+def post(app, payload):
+    """Sends one JSON POST request straight to the ASGI application."""
+    body = json.dumps(payload).encode("utf-8")
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    asyncio.run(app(scope, receive, send))
+    response_body = b"".join(message.get("body", b"")
+                             for message in messages[1:])
+    return messages[0]["status"], json.loads(response_body)
+
+
+def make_app(**kwargs):
+    return CachingGraphQLApp(schema,
+                             context_value={"user": AnonymousUser()},
+                             **kwargs)
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    function = getattr(graphql_app, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+
+    monkeypatch.setattr(graphql_app, name, counted)
+    return calls
+
+
+def persisted(query_hash):
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+
+
+def test_persisted_query(monkeypatch) -> None:
+    validations = count_calls(monkeypatch, "validate")
+    app = make_app()
+    query_hash = hash_query(UNDO_QUERY)
+
+    status, result = post(app, {"extensions": persisted(query_hash)})
+    assert status == 200
+    assert result["errors"][0]["message"] == "PersistedQueryNotFound"
+    assert result["errors"][0]["extensions"] == {
+        "code": "PERSISTED_QUERY_NOT_FOUND"
+    }
+
+    status, result = post(app, {
+        "query": UNDO_QUERY,
+        "extensions": persisted(query_hash)
+    })
+    assert status == 200
+    assert result["errors"][0]["message"] == "This op needs user-id."
+
+    status, result = post(app, {"extensions": persisted(query_hash)})
+    assert status == 200
+    assert result["errors"][0]["message"] == "This op needs user-id."
+    # Validated once, and measured once by the cost rule
+    assert len(validations) == 2
+
+    status, result = post(app, {
+        "query": TYPENAME_QUERY,
+        "extensions": persisted(query_hash)
+    })
+    assert status == 400
+
+
+def test_malformed_requests_are_rejected() -> None:
+    app = make_app()
+    for payload in [
+        {"query": ["{ __typename }"]},
+        {"query": TYPENAME_QUERY, "operationName": 1},
+        {"query": TYPENAME_QUERY, "variables": [1]},
+        {"query": TYPENAME_QUERY, "extensions": "persisted"},
+        {"extensions": {"persistedQuery": "abc"}},
+        {"extensions": persisted(1)},
+    ]:
+        status, result = post(app, payload)
+        assert status == 400
+        assert result["errors"]
+
+
+def test_plain_queries_are_validated_once(monkeypatch) -> None:
+    validations = count_calls(monkeypatch, "validate")
+    app = make_app()
+    for _ in range(3):
+        status, result = post(app, {"query": UNDO_QUERY})
+        assert status == 200
+    assert len(validations) == 2
+
+    status, result = post(app, {"query": "{ unknownField }"})
+    assert result["data"] is None
+    assert "unknownField" in result["errors"][0]["message"]
+    status, result = post(app, {"query": "{ unknownField }"})
+    assert len(validations) == 4
+
+
+def test_costs_are_cached_by_page_size(monkeypatch) -> None:
+    validations = count_calls(monkeypatch, "validate")
+    app = make_app(max_cost=1000)
+    query = ("query($n: Int, $s: String) "
+             "{ tasks(first: $n, status: $s) { edges { node { id } } } }")
+    for n, status_filter in [(500, "TODO"), (500, "DONE"), (5, "TODO")]:
+        status, result = post(app, {
+            "query": query,
+            "variables": {
+                "n": n,
+                "s": status_filter
+            }
+        })
+        assert result["extensions"]["cost"]["requested"] == 10 + 3 * n
+        assert (result["data"] is None) == (n == 500)
+    # One validation, and the cost of each page size
+    assert len(validations) == 3
+
+
+def test_introspection_is_cached(monkeypatch) -> None:
+    executions = count_calls(monkeypatch, "execute")
+    app = make_app()
+    query = "{ __schema { queryType { name } } }"
+    for _ in range(2):
+        status, result = post(app, {"query": query})
+        assert status == 200
+        assert result["data"] == {"__schema": {"queryType": {"name": "Query"}}}
+    assert len(executions) == 1
+
+    post(app, {"query": UNDO_QUERY})
+    post(app, {"query": UNDO_QUERY})
+    assert len(executions) == 3
+
+
+def test_cost_is_reported_and_limited() -> None:
+    app = make_app(max_cost=1000, max_depth=4)
+    status, result = post(app, {"query": UNDO_QUERY})
+    assert result["extensions"] == {
+        "cost": {
+            "requested": 12,
+            "maximum": 1000
+        }
+    }
+
+    status, result = post(
+        app, {
+            "query":
+            "query($n: Int) { tasks(first: $n) { edges { node { id } } } }",
+            "variables": {
+                "n": 500
+            }
+        })
+    assert status == 200
+    assert result["data"] is None
+    assert result["errors"][0]["message"] == (
+        "The query cost 1510 exceeds the maximum cost of 1000.")
+    assert result["extensions"]["cost"]["requested"] == 1510
+
+    status, result = post(
+        app,
+        {"query": "{ tasks { edges { node { id } } pageInfo { hasNextPage } } }"})
+    assert result["extensions"]["cost"]["requested"] == 312
+
+    status, result = post(app, {
+        "query":
+        "{ tasks { edges { node { ...on TaskNode { creator } } } } }"
+    })
+    assert result["extensions"]["cost"]["requested"] == 410
+
+    status, result = post(
+        app, {
+            "query": "{ tasks(last: 2) { edges { node { ...F } } } } "
+            "fragment F on TaskNode { id }"
+        })
+    assert result["errors"][0]["message"] == "This op needs user-id."
+    assert result["extensions"]["cost"]["requested"] == 16
+
+
+class Folder(graphene.ObjectType):
+    name = graphene.String()
+    parent = graphene.Field(lambda: Folder)
+
+
+class FolderQuery(graphene.ObjectType):
+    folder = graphene.Field(Folder)
+
+
+def measure(query):
+    costs: list[int] = []
+    errors = validate(
+        graphene.Schema(query=FolderQuery).graphql_schema, parse(query),
+        [query_cost_rule(1000, 10, costs=costs)])
+    assert not errors
+    return costs[0]
+
+
+def test_fragments_are_counted_wherever_spread() -> None:
+    inlined = measure("{ folder { name parent { name } } }")
+    assert inlined == 4
+    assert measure("{ folder { ...F parent { ...F } } } "
+                   "fragment F on Folder { name }") == inlined
+
+
+def test_bulk_creation_cost_grows_with_input() -> None:
+    app = make_app(max_cost=1000)
+    query = ("mutation($input: [TaskInput!]!) "
+             "{ createTasks(input: $input) { tasks { id } } }")
+    for count, cost in [(10, 120), (100, 1200)]:
+        status, result = post(
+            app, {
+                "query": query,
+                "variables": {
+                    "input": [{
+                        "title": "T",
+                        "status": "TODO"
+                    }] * count
+                }
+            })
+        assert result["extensions"]["cost"]["requested"] == cost
+    assert result["errors"][0]["message"] == (
+        "The query cost 1200 exceeds the maximum cost of 1000.")
+
+    status, result = post(
+        app, {
+            "query":
+            "mutation { createTasks(input: [%s]) { tasks { id } } }" %
+            ", ".join(['{title: "T", status: "TODO"}'] * 3)
+        })
+    assert result["extensions"]["cost"]["requested"] == 36
+
+
+def test_undo_cost_grows_with_steps() -> None:
+    app = make_app(max_cost=1000)
+    for arguments, cost in [("", 12), ("(steps: 50)", 600),
+                            ('(untilTimestamp: "2026-01-01T00:00:00")',
+                             12000)]:
+        status, result = post(app, {
+            "query":
+            "mutation { undoTask%s { tasks { id } } }" % arguments
+        })
+        assert result["extensions"]["cost"]["requested"] == cost
+    assert result["errors"][0]["message"] == (
+        "The query cost 12000 exceeds the maximum cost of 1000.")
+
+    status, result = post(
+        app, {
+            "query": "mutation($n: Int) { undoTask(steps: $n) { task { id } } }",
+            "variables": {
+                "n": 100
+            }
+        })
+    assert result["extensions"]["cost"]["requested"] == 1002
+
+
+def test_depth_is_limited() -> None:
+    app = make_app(max_depth=3)
+    status, result = post(app, {"query": "{ tasks { edges { node { id } } } }"})
+    assert result["errors"][0]["message"] == (
+        "The query depth 4 exceeds the maximum depth of 3.")
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+
+    disabled = LRUCache(0)
+    disabled.put("a", 1)
+    assert disabled.get("a") is None
@@ -0,0 +1,127 @@
+"""
+Metrics tests
+"""
+import asyncio
+import json
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from tugastugas import metrics
+from tugastugas.graphql_app import CachingGraphQLApp
+from tugastugas.metrics import (Counter, Gauge, GraphQLMetricsMiddleware,
+                                Histogram, MeteredQueuePool, Registry,
+                                RequestMetricsMiddleware, instrument_engine)
+from tugastugas.schema import schema
+
+
+class AnonymousUser:
+    id = None
+
+
+def histogram_count(histogram, *labels):
+    state = histogram.values.get(labels)
+    return 0 if state is None else state[2]
+
+
+def test_render() -> None:
+    registry = Registry()
+    counter = Counter("requests_total", "Requests.", ("path", ),
+                      registry=registry)
+    gauge = Gauge("temperature", "Temperature.", registry=registry)
+    histogram = Histogram("latency_seconds",
+                          "Latency.", ("field", ),
+                          buckets=(0.1, 1.0),
+                          registry=registry)
+    Gauge("computed", "Computed.", ("name", ),
+          function=lambda: [(("a", ), 2)],
+          registry=registry)
+    counter.inc('/a"b')
+    counter.inc('/a"b', amount=2)
+    gauge.set(1.5)
+    gauge.dec()
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value, "Query.tasks")
+
+    assert registry.render() == """\
+# HELP requests_total Requests.
+# TYPE requests_total counter
+requests_total{path="/a\\"b"} 3
+# HELP temperature Temperature.
+# TYPE temperature gauge
+temperature 0.5
+# HELP latency_seconds Latency.
+# TYPE latency_seconds histogram
+latency_seconds_bucket{field="Query.tasks",le="0.1"} 2
+latency_seconds_bucket{field="Query.tasks",le="1.0"} 3
+latency_seconds_bucket{field="Query.tasks",le="+Inf"} 4
+latency_seconds_sum{field="Query.tasks"} 3.65
+latency_seconds_count{field="Query.tasks"} 4
+# HELP computed Computed.
+# TYPE computed gauge
+computed{name="a"} 2
+"""
+
+
+def test_graphql_metrics() -> None:
+    app = CachingGraphQLApp(schema,
+                            context_value={"user": AnonymousUser()},
+                            middleware=[GraphQLMetricsMiddleware()])
+    operations = histogram_count(metrics.OPERATION_SECONDS, "mutation",
+                                 "Undo")
+    fields = histogram_count(metrics.FIELD_SECONDS, "Mutation.undoTask")
+    body = json.dumps({
+        "query": "mutation Undo { undoTask { task { id } } }"
+    }).encode()
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(
+        app(
+            {
+                "type": "http",
+                "method": "POST",
+                "path": "/",
+                "query_string": b"",
+                "headers": [(b"content-type", b"application/json")],
+            }, receive, send))
+    assert messages[0]["status"] == 200
+    assert histogram_count(metrics.OPERATION_SECONDS, "mutation",
+                           "Undo") == operations + 1
+    # Failed resolvers are recorded too
+    assert histogram_count(metrics.FIELD_SECONDS,
+                           "Mutation.undoTask") == fields + 1
+
+
+def test_request_sql_metrics() -> None:
+    engine = create_engine("sqlite://",
+                           poolclass=MeteredQueuePool,
+                           pool_size=1,
+                           max_overflow=0)
+    instrument_engine(engine, "test")
+    statements = metrics.SQL_STATEMENTS.values.get(("test", ), 0)
+
+    async def app(scope, receive, send):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+            assert 'tugastugas_db_pool_checked_out{engine="test"} 1' in (
+                metrics.REGISTRY.render())
+
+    asyncio.run(
+        RequestMetricsMiddleware(app)({
+            "type": "http",
+            "path": "/metrics-test"
+        }, None, None))
+
+    assert metrics.SQL_STATEMENTS.values[("test", )] == statements + 2
+    counts, total, count = metrics.REQUEST_SQL_STATEMENTS.values[(
+        "/metrics-test", )]
+    assert (total, count) == (2, 1)
+    assert histogram_count(metrics.POOL_WAIT_SECONDS, "sync") >= 1
+    rendered = metrics.REGISTRY.render()
+    assert 'tugastugas_db_pool_checked_out{engine="test"} 0' in rendered
+    assert 'tugastugas_db_pool_waiting{engine="sync"} 0' in rendered
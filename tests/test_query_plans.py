@@ -0,0 +1,142 @@
+"""
+Query plan tests for the filters and orders of Query.tasks
+"""
+import asyncio
+import datetime
+import itertools
+from typing import Any
+import pytest
+from pytest_mock_resources import create_postgres_fixture
+from sqlalchemy import event, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+from tugastugas.models import Task
+from tugastugas.schema import (ORDER_FIELDS, encode_cursor, fetch_tasks,
+                               filter_tasks)
+
+alembic_engine: Any = create_postgres_fixture()
+
+FILTERS = {
+    'id': 42,
+    'status': 'DONE',
+    'creator': 'usr7',
+    'last_modifier': 'usr3',
+    'due_since': datetime.date(2026, 1, 1),
+    'due_before': datetime.date(2026, 2, 1),
+    'search': 'T42',
+}
+
+
+@pytest.fixture
+def seeded_engine(alembic_runner: Any, alembic_engine: Any) -> Any:
+    alembic_runner.migrate_up_to("heads", return_current=False)
+    with alembic_engine.begin() as conn:
+        conn.execute(
+            text("""
+              INSERT INTO "user" (id, username, password_hash)
+              SELECT i, 'usr' || i, '' FROM generate_series(1, 20) AS i
+            """))
+        conn.execute(
+            text("""
+              INSERT INTO task (title,
+                        description,
+                        due_date,
+                        status,
+                        creator_id,
+                        last_modifier_id)
+              SELECT 'T' || i,
+                '',
+                DATE '2025-01-01' + i % 730,
+                (ARRAY['TODO', 'DOING', 'DONE'])[i % 3 + 1],
+                i % 20 + 1,
+                i * 7 % 20 + 1
+              FROM generate_series(1, 10000) AS i
+            """))
+        conn.execute(text("ANALYZE"))
+    return alembic_engine
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def test_task_filters_do_not_scan_sequentially(seeded_engine: Any) -> None:
+    combinations = [
+        names for size in range(1,
+                                len(FILTERS) + 1)
+        for names in itertools.combinations(FILTERS, size)
+    ]
+    seq_scans = {}
+    with seeded_engine.connect() as conn:
+        # Sequential scans are still chosen when no index can serve a query,
+        # so disabling them tells whether every filter has a usable index
+        # regardless of how small the seeded table is.
+        conn.execute(text("SET enable_seqscan = off"))
+        for names in combinations:
+            stmt = filter_tasks(select(Task),
+                                **{name: FILTERS[name]
+                                   for name in names})
+            sql = stmt.compile(dialect=postgresql.dialect(),
+                               compile_kwargs={"literal_binds": True})
+            plan, = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            scanned = [
+                node['Relation Name'] for node in plan_nodes(plan['Plan'])
+                if node['Node Type'] == 'Seq Scan'
+            ]
+            if scanned:
+                seq_scans[names] = scanned
+    assert seq_scans == {}
+
+
+ORDERS = [{
+    'field': field,
+    'direction': direction,
+    'nulls': nulls
+} for field in ORDER_FIELDS for direction in ('asc', 'desc')
+          for nulls in ((None, 'first', 'last') if field == 'due_date' else (
+              None, ))]
+
+
+def test_task_orders_are_read_from_indexes(seeded_engine: Any) -> None:
+    with seeded_engine.begin() as conn:
+        conn.execute(text("UPDATE task SET due_date = NULL WHERE id % 10 = 0"))
+        conn.execute(text("ANALYZE task"))
+    async_engine = create_async_engine(
+        seeded_engine.url.set(drivername='postgresql+psycopg'),
+        poolclass=NullPool)
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    async def fetch_pages():
+        async with AsyncSession(async_engine) as session:
+            for order_by, backward in itertools.product(ORDERS,
+                                                        (False, True)):
+                _, keys, _ = await fetch_tasks(session, ['id'], 20, None,
+                                               None, backward,
+                                               order_by=order_by)
+                cursor = encode_cursor(keys[-1])
+                await fetch_tasks(session, ['id'], 20,
+                                  None if backward else cursor,
+                                  cursor if backward else None, backward,
+                                  order_by=order_by)
+        await async_engine.dispose()
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute",
+                 record_statement)
+    asyncio.run(fetch_pages())
+    sorts = []
+    with seeded_engine.connect() as conn:
+        conn.execute(text("SET enable_seqscan = off"))
+        for statement, parameters in statements:
+            plan, = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}",
+                                         parameters).scalar()
+            if any(node['Node Type'] in ('Sort', 'Incremental Sort')
+                   for node in plan_nodes(plan['Plan'])):
+                sorts.append(statement)
+    assert len(statements) >= 4 * len(ORDERS)
+    assert sorts == []
@@ -0,0 +1,119 @@
+"""
+Task history retention tests
+"""
+import csv
+import datetime
+import gzip
+import os
+from typing import Any
+import pytest
+from psycopg.errors import DivisionByZero
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from tugastugas.models import User, HTask
+from tugastugas import retention
+from tugastugas.retention import main
+
+
+def read_archive(path):
+    with gzip.open(path, "rt", newline="") as archive:
+        return list(csv.DictReader(archive))
+
+
+def partitions(session):
+    return session.scalars(
+        text("SELECT c.relname FROM pg_inherits AS i"
+             " JOIN pg_class AS c ON c.oid = i.inhrelid"
+             " WHERE i.inhparent = 'h_task'::regclass"
+             " ORDER BY c.relname")).all()
+
+
+def test_retention(pg_engine: Any, db_env: Any, tmp_path: Any) -> None:
+    now = datetime.datetime.now()
+    ten_days_ago = now - datetime.timedelta(days=10)
+    with Session(pg_engine) as session:
+        session.add(User(id=1, username='usr1', password_hash=''))
+        session.add_all([
+            HTask(id=id,
+                  target_row_id=str(id),
+                  executed_operation=1,
+                  operation_executed_at=executed_at,
+                  data_after_executed_operation={},
+                  from_undo=False,
+                  user_id=1,
+                  used=used)
+            for id, executed_at, used in [
+                (1, datetime.datetime(2020, 1, 15), False),
+                (2, datetime.datetime(2020, 2, 10), True),
+                (3, ten_days_ago, True),
+                (4, ten_days_ago, False),
+                (5, now, True),
+            ]
+        ])
+        session.commit()
+        # The records of 2020 are in the default partition until their
+        # partition is created.
+        assert session.scalar(
+            text("SELECT count(*) FROM h_task_default")) == 2
+        session.execute(text("SELECT create_h_task_partition('2020-01-01')"))
+        session.commit()
+        assert session.scalar(
+            text("SELECT count(*) FROM h_task_default")) == 1
+        assert 'h_task_y2020m01' in partitions(session)
+
+    archive_dir = str(tmp_path / "archive")
+    main([
+        "--keep-days", "365", "--keep-used-days", "5", "--archive-dir",
+        archive_dir
+    ])
+
+    with Session(pg_engine) as session:
+        assert 'h_task_y2020m01' not in partitions(session)
+        next_month = (now.replace(day=1) + datetime.timedelta(days=32))
+        assert f'h_task_y{next_month:%Y}m{next_month:%m}' in partitions(
+            session)
+        assert session.scalars(select(HTask.id).order_by(
+            HTask.id)).all() == [4, 5]
+
+    archives = sorted(os.listdir(archive_dir))
+    assert archives[0].startswith("h_task_used_before_")
+    assert sorted(row["id"] for row in read_archive(
+        os.path.join(archive_dir, archives[0]))) == ["2", "3"]
+    assert archives[1] == "h_task_y2020m01.csv.gz"
+    assert [row["id"] for row in read_archive(
+        os.path.join(archive_dir, archives[1]))] == ["1"]
+
+
+def test_failed_archiving_leaves_no_archive(pg_engine: Any, db_env: Any,
+                                            tmp_path: Any,
+                                            monkeypatch: Any) -> None:
+    with Session(pg_engine) as session:
+        session.add(User(id=1, username='usr1', password_hash=''))
+        session.add(
+            HTask(id=1,
+                  target_row_id='1',
+                  executed_operation=1,
+                  operation_executed_at=datetime.datetime(2020, 1, 15),
+                  data_after_executed_operation={},
+                  from_undo=False,
+                  user_id=1,
+                  used=False))
+        session.commit()
+        session.execute(text("SELECT create_h_task_partition('2020-01-01')"))
+        session.commit()
+
+    copy_to_archive = retention.copy_to_archive
+
+    def copy_then_fail(cursor, query, path):
+        copy_to_archive(cursor, query, path)
+        # Fails the transaction dropping the partition after the archive
+        # was written
+        cursor.execute("SELECT 1 / 0")
+
+    monkeypatch.setattr(retention, "copy_to_archive", copy_then_fail)
+    archive_dir = tmp_path / "archive"
+    with pytest.raises(DivisionByZero):
+        main(["--keep-days", "365", "--archive-dir", str(archive_dir)])
+    assert os.listdir(archive_dir) == []
+    with Session(pg_engine) as session:
+        assert 'h_task_y2020m01' in partitions(session)
@@ -0,0 +1,122 @@
+"""
+Seeding and bulk import tests
+"""
+import gzip
+import json
+from typing import Any
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from tugastugas.models import User, Task, HTask
+from tugastugas.seed import main
+
+
+def count(session, model):
+    return session.scalar(select(func.count()).select_from(model))
+
+
+def test_generate(pg_engine: Any, db_env: Any) -> None:
+    # Seeding refuses to run while other sessions are connected
+    pg_engine.dispose()
+    main([
+        "--chunk-size", "7", "generate", "--users", "5", "--tasks", "50",
+        "--updates", "2", "--statuses", "TODO:1,DONE:1"
+    ])
+    with Session(pg_engine) as session:
+        assert count(session, User) == 5
+        assert count(session, Task) == 50
+        assert count(session, HTask) == 150
+        assert session.scalar(
+            text("SELECT count(*) FROM h_task_default")) == 0
+        assert set(session.scalars(select(Task.status))) <= {"TODO", "DONE"}
+
+        # Undoing the generated history leads back to the created rows
+        a_task = session.get(Task, 1)
+        created = session.scalars(
+            select(HTask.data_after_executed_operation).where(
+                HTask.target_row_id == "1",
+                HTask.executed_operation == 1)).one()
+        for user_id in session.scalars(
+                select(HTask.user_id).where(
+                    HTask.target_row_id == "1",
+                    HTask.executed_operation == 3).order_by(
+                        HTask.operation_executed_at.desc())).all():
+            session.execute(
+                text("UPDATE h_task SET used = true"
+                     " WHERE user_id = :user_id AND NOT used"
+                     " AND target_row_id <> '1'"), {"user_id": user_id})
+            session.execute(
+                text("SELECT undo_task_action(:user_id)"),
+                {"user_id": user_id})
+        session.refresh(a_task)
+        assert (a_task.status, a_task.last_modifier_id) == (
+            created["status"], created["last_modifier_id"])
+
+        # The trigger is enabled again and the sequence is past the IDs
+        session.execute(
+            text("INSERT INTO task (title, description, status, creator_id,"
+                 " last_modifier_id) VALUES ('T', '', 'TODO', 1, 1)"))
+        session.commit()
+        assert session.scalar(select(func.max(Task.id))) == 51
+        # Two undos and the insertion
+        assert count(session, HTask) == 153
+
+
+def test_import(pg_engine: Any, db_env: Any, tmp_path: Any) -> None:
+    users_path = tmp_path / "users.csv"
+    users_path.write_text("id,username\n1,usr1\n2,usr2\n")
+    tasks_path = tmp_path / "tasks.ndjson.gz"
+    with gzip.open(tasks_path, "wt") as tasks_file:
+        for id, description, due_date in [(1, "a\tb\\c\nd", "2027-01-01"),
+                                          (2, "", None)]:
+            tasks_file.write(
+                json.dumps({
+                    "id": id,
+                    "title": f"T{id}",
+                    "description": description,
+                    "due_date": due_date,
+                    "status": "DONE",
+                    "creator_id": id,
+                    "last_modifier_id": 1
+                }) + "\n")
+    history_path = tmp_path / "h_task.csv"
+    history_path.write_text(
+        "target_row_id,executed_operation,operation_executed_at,"
+        "data_after_executed_operation,from_undo,user_id,used\n"
+        "2,3,2020-01-15 10:00:00,\"{\"\"status\"\": \"\"TODO\"\"}\",f,2,f\n")
+
+    pg_engine.dispose()
+    main([
+        "import", "--users",
+        str(users_path), "--tasks",
+        str(tasks_path), "--history",
+        str(history_path)
+    ])
+    with Session(pg_engine) as session:
+        assert session.scalars(select(User.username).order_by(
+            User.id)).all() == ["usr1", "usr2"]
+        tasks = session.scalars(select(Task).order_by(Task.id)).all()
+        assert [(t.description, str(t.due_date)) for t in tasks] == [
+            ("a\tb\\c\nd", "2027-01-01"), ("", "None")
+        ]
+        # No INSERT records are written by the trigger while importing
+        history = session.scalars(select(HTask)).one()
+        assert history.data_after_executed_operation == {"status": "TODO"}
+        assert "h_task_y2020m01" in session.scalars(
+            text("SELECT relname FROM pg_class"
+                 " WHERE relname LIKE 'h_task_y%'")).all()
+
+    pg_engine.dispose()
+    with pytest.raises(SystemExit):
+        main(["import", "--tasks", str(users_path)])
+
+
+def test_refuse_connected_sessions(pg_engine: Any, db_env: Any,
+                                   capsys: Any) -> None:
+    pg_engine.dispose()
+    with pg_engine.connect():
+        with pytest.raises(SystemExit):
+            main(["generate", "--users", "1", "--tasks", "1"])
+    assert "1 other sessions are connected" in capsys.readouterr().err
+    with Session(pg_engine) as session:
+        assert count(session, Task) == 0
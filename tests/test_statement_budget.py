@@ -0,0 +1,114 @@
+"""
+Statement budget tests
+"""
+import asyncio
+import json
+import logging
+from typing import Any
+import graphene
+import pytest
+from sqlalchemy import create_engine, text
+from tugastugas import statement_budget
+from tugastugas.graphql_app import CachingGraphQLApp
+from tugastugas.statement_budget import (StatementBudget,
+                                         StatementBudgetExceeded,
+                                         get_statement_budget,
+                                         guard_statements, sql_shape)
+
+
+def test_sql_shape() -> None:
+    assert sql_shape("""SELECT username
+                          FROM "user" WHERE id = %(id_1)s AND name = 'a''b'
+                        LIMIT 10""") == (
+        'SELECT username FROM "user" WHERE id = ? AND name = ? LIMIT ?')
+    assert sql_shape("SELECT * FROM task WHERE id IN (%s, %s, %s)") == (
+        sql_shape("SELECT * FROM task WHERE id IN (1, 2)"))
+
+
+def test_guard_statements(caplog: Any, monkeypatch: Any) -> None:
+    # Loggers are disabled by the logging configuration of the migrations
+    monkeypatch.setattr(statement_budget.logger, "disabled", False)
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        with guard_statements(StatementBudget(max_statements=3)) as outer:
+            with guard_statements(StatementBudget(max_repeats=2)) as inner:
+                for task_id in range(2):
+                    connection.execute(text(f"SELECT {task_id}"))
+            connection.execute(text("SELECT 'other'"))
+        assert len(inner.statements) == 2
+        assert len(outer.statements) == 3
+
+        with pytest.raises(StatementBudgetExceeded,
+                           match="Loading exceeds its statement budget:"
+                           " 3 executions of 'SELECT \\?'"):
+            with guard_statements(StatementBudget(max_repeats=2),
+                                  "Loading"):
+                for task_id in range(3):
+                    connection.execute(text(f"SELECT {task_id}"))
+
+        with caplog.at_level(logging.WARNING):
+            with guard_statements(
+                    StatementBudget(max_statements=1, on_exceeded="log")):
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+        assert "2 statements, more than the budget of 1" in caplog.text
+
+
+def test_get_statement_budget(monkeypatch: Any) -> None:
+    monkeypatch.delenv("STATEMENT_BUDGET", raising=False)
+    monkeypatch.delenv("STATEMENT_REPEAT_LIMIT", raising=False)
+    assert get_statement_budget() is None
+    monkeypatch.setenv("STATEMENT_REPEAT_LIMIT", "5")
+    monkeypatch.setenv("STATEMENT_BUDGET_MODE", "RAISE")
+    budget = get_statement_budget()
+    assert (budget.max_statements, budget.max_repeats,
+            budget.on_exceeded) == (None, 5, "raise")
+
+
+engine = create_engine("sqlite://")
+
+
+class Query(graphene.ObjectType):
+    # Runs one statement per item, like an N+1 query
+    items = graphene.List(graphene.Int, count=graphene.Int())
+
+    def resolve_items(root, info, count):
+        with engine.connect() as connection:
+            return [
+                connection.execute(text(f"SELECT {item}")).scalar()
+                for item in range(count)
+            ]
+
+
+def post(app, query):
+    body = json.dumps({"query": query}).encode()
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(
+        app(
+            {
+                "type": "http",
+                "method": "POST",
+                "path": "/",
+                "query_string": b"",
+                "headers": [(b"content-type", b"application/json")],
+            }, receive, send))
+    return json.loads(messages[1]["body"])
+
+
+def test_app_statement_budget() -> None:
+    app = CachingGraphQLApp(graphene.Schema(query=Query),
+                            statement_budget=StatementBudget(max_repeats=2))
+    assert post(app, "query Items { items(count: 2) }")["data"] == {
+        "items": [0, 1]
+    }
+    response = post(app, "query Items { items(count: 3) }")
+    assert response["errors"][0]["message"] == (
+        "Items exceeds its statement budget: 3 executions of 'SELECT ?',"
+        " more than the budget of 2")
@@ -0,0 +1,102 @@
+"""
+Access token tests
+"""
+import asyncio
+import time
+from fastapi import HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
+import pytest
+from tugastugas import app, tokens
+from tugastugas.tokens import (VerifiedTokenCache, decode_token, encode_token,
+                               get_token_secret)
+
+SECRET = b"secret"
+
+
+def test_token_round_trip() -> None:
+    claims = {"sub": "1", "name": "usr1", "exp": time.time() + 60}
+    token = encode_token(claims, SECRET)
+    assert decode_token(token, SECRET) == claims
+
+    header, payload, signature = token.split(".")
+    assert decode_token(token, b"other secret") is None
+    assert decode_token(f"{header}.{payload}.{signature[:-2]}", SECRET) is None
+    assert decode_token(f"{header}.{payload}", SECRET) is None
+    assert decode_token("access-token-1", SECRET) is None
+    assert decode_token(token, SECRET, now=claims["exp"]) is None
+
+
+def test_token_secret_is_required(monkeypatch, caplog) -> None:
+    monkeypatch.setenv("TOKEN_SECRET", "secret")
+    assert get_token_secret() == SECRET
+
+    monkeypatch.delenv("TOKEN_SECRET")
+    # Loggers are disabled by the logging configuration of the migrations
+    monkeypatch.setattr(tokens.logger, "disabled", False)
+    with pytest.raises(RuntimeError):
+        get_token_secret()
+    assert len(get_token_secret(development=True)) == 32
+    assert "TOKEN_SECRET is not set" in caplog.text
+
+
+def test_verified_token_cache() -> None:
+    cache = VerifiedTokenCache(2)
+    cache.put("a", "user-a", expires_at=100)
+    cache.put("b", "user-b", expires_at=200)
+    assert cache.get("a", now=50) == "user-a"
+    cache.put("c", "user-c", expires_at=300)
+    assert cache.get("b", now=50) is None
+    assert cache.get("a", now=100) is None
+    assert len(cache) == 1
+
+
+class FakeConnection:
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def authenticate(headers):
+    return asyncio.run(app.BearerAuthBackend().authenticate(
+        FakeConnection(headers)))
+
+
+def test_issued_tokens_are_verified_once(monkeypatch) -> None:
+    monkeypatch.setattr(app, "token_cache", VerifiedTokenCache(10))
+    response = app.login(
+        OAuth2PasswordRequestForm(username="usr2", password=""))
+    assert response["token_type"] == "bearer"
+    token = response["access_token"]
+
+    verifications = []
+    decode = app.decode_token
+    monkeypatch.setattr(
+        app, "decode_token",
+        lambda *args: verifications.append(args) or decode(*args))
+    _, user = authenticate({"Authorization": f"Bearer {token}"})
+    assert (user.id, user.username, user.is_authenticated) == (2, "usr2",
+                                                                True)
+    _, same_user = authenticate({"Authorization": f"Bearer {token}"})
+    assert same_user is user
+    assert len(verifications) == 1
+
+    assert authenticate({}) is None
+    assert authenticate({"Authorization": "Bearer"}) is None
+    assert authenticate({"Authorization": "Basic dXNyMTo="}) is None
+    assert authenticate({"Authorization": f"Bearer {token}x"}) is None
+
+
+def test_login_rejects_unknown_users() -> None:
+    with pytest.raises(HTTPException) as error:
+        app.login(OAuth2PasswordRequestForm(username="nobody", password=""))
+    assert error.value.status_code == 401
+
+
+def test_fake_tokens_can_be_disabled(monkeypatch) -> None:
+    monkeypatch.setattr(app, "token_cache", VerifiedTokenCache(10))
+    _, user = authenticate({"Authorization": "Bearer access-token-1"})
+    assert user.id == 1
+
+    monkeypatch.setattr(app, "token_cache", VerifiedTokenCache(10))
+    monkeypatch.setattr(app, "allow_fake_tokens", False)
+    assert authenticate({"Authorization": "Bearer access-token-1"}) is None
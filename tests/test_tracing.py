@@ -0,0 +1,185 @@
+"""
+Tracing tests
+"""
+import asyncio
+import json
+import threading
+from typing import Any
+import graphene
+from sqlalchemy import create_engine, text
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from tugastugas.graphql_app import CachingGraphQLApp
+from tugastugas.tracing import (FileExporter, GraphQLTracingMiddleware,
+                                MemoryExporter, Span, Tracer,
+                                TracingMiddleware, trace, traced)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+CLIENT_SPAN_ID = "00f067aa0ba902b7"
+
+engine = create_engine("sqlite://")
+
+
+def request(app, method="GET", path="/", headers=(), body=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(
+        app(
+            {
+                "type": "http",
+                "method": method,
+                "path": path,
+                "query_string": b"",
+                "headers": list(headers),
+            }, receive, send))
+    return messages
+
+
+def spans_by_name(exporter):
+    return {span["name"]: span for span in exporter.spans()}
+
+
+def attributes(span):
+    return {
+        attribute["key"]: next(iter(attribute["value"].values()))
+        for attribute in span["attributes"]
+    }
+
+
+class CheckMiddleware:
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    @trace("CheckMiddleware.check")
+    async def check(self):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    async def __call__(self, scope, receive, send):
+        await self.check()
+        await self.app(scope, receive, send)
+
+
+def test_middleware_spans() -> None:
+    exporter = MemoryExporter()
+    app = PlainTextResponse("OK")
+    for middleware in reversed([
+            Middleware(TracingMiddleware, tracer=Tracer(1.0, exporter)),
+            traced(Middleware(CheckMiddleware))
+    ]):
+        app = middleware.cls(app, *middleware.args, **middleware.kwargs)
+
+    assert request(app, path="/check")[0]["status"] == 200
+    assert len(exporter.requests) == 1
+    spans = spans_by_name(exporter)
+    assert set(spans) == {
+        "GET /check", "CheckMiddleware", "CheckMiddleware.check", "SELECT"
+    }
+    request_span = spans["GET /check"]
+    assert "parentSpanId" not in request_span
+    assert attributes(request_span)["http.response.status_code"] == "200"
+    assert spans["CheckMiddleware"]["parentSpanId"] == request_span["spanId"]
+    assert spans["CheckMiddleware.check"]["parentSpanId"] == (
+        spans["CheckMiddleware"]["spanId"])
+    assert spans["SELECT"]["parentSpanId"] == (
+        spans["CheckMiddleware.check"]["spanId"])
+    assert spans["SELECT"]["kind"] == 3
+    assert attributes(spans["SELECT"])["db.statement"] == "SELECT 1"
+    assert {span["traceId"] for span in exporter.spans()} == {
+        request_span["traceId"]
+    }
+
+
+def test_sampling() -> None:
+    exporter = MemoryExporter()
+    app = TracingMiddleware(PlainTextResponse("OK"), Tracer(0.0, exporter))
+
+    request(app)
+    assert not exporter.requests
+
+    sampled = [(b"traceparent",
+                f"00-{TRACE_ID}-{CLIENT_SPAN_ID}-01".encode())]
+    request(app, headers=sampled)
+    assert not exporter.requests
+
+    app.tracer.trust_traceparent = True
+    request(app,
+            headers=[(b"traceparent",
+                      f"00-{TRACE_ID}-{CLIENT_SPAN_ID}-00".encode())])
+    assert not exporter.requests
+
+    request(app, headers=sampled)
+    [span] = exporter.spans()
+    assert span["traceId"] == TRACE_ID
+    assert span["parentSpanId"] == CLIENT_SPAN_ID
+
+
+class Query(graphene.ObjectType):
+    count = graphene.Int()
+
+    async def resolve_count(root, info):
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT 2")).scalar()
+
+
+def test_graphql_spans(tmp_path: Any) -> None:
+    path = tmp_path / "traces.jsonl"
+    graphql_app = CachingGraphQLApp(graphene.Schema(query=Query),
+                                    middleware=[GraphQLTracingMiddleware()])
+    file_exporter = FileExporter(path)
+    app = TracingMiddleware(graphql_app, Tracer(1.0, file_exporter))
+    body = json.dumps({"query": "query Count { count }"}).encode()
+
+    for _ in range(2):
+        messages = request(app,
+                           method="POST",
+                           headers=[(b"content-type", b"application/json")],
+                           body=body)
+        assert json.loads(messages[1]["body"])["data"] == {"count": 2}
+
+    file_exporter.flush()
+    assert file_exporter.dropped == 0
+    first, second = [json.loads(line) for line in open(path)]
+    exporter = MemoryExporter()
+    exporter.requests.append(first)
+    spans = spans_by_name(exporter)
+    assert set(spans) == {
+        "POST /", "graphql.parse", "query Count", "Query.count", "SELECT"
+    }
+    assert spans["Query.count"]["parentSpanId"] == (
+        spans["query Count"]["spanId"])
+    assert spans["SELECT"]["parentSpanId"] == spans["Query.count"]["spanId"]
+    resource = first["resourceSpans"][0]["resource"]
+    assert attributes(resource)["service.name"] == "tugastugas"
+    # The parsed document is cached
+    exporter.requests[0] = second
+    assert "graphql.parse" not in spans_by_name(exporter)
+
+
+def test_file_exporter_queue_is_bounded(tmp_path: Any) -> None:
+    path = tmp_path / "traces.jsonl"
+    exporter = FileExporter(path, max_queue=1)
+    # Nothing writes the queue until the thread is started
+    exporter.thread = threading.current_thread()
+    for name in ("first", "second"):
+        span = Span(name)
+        span.finish()
+        exporter.export([span])
+    assert exporter.dropped == 1
+
+    exporter.thread = None
+    span = Span("third")
+    span.finish()
+    exporter.export([span])
+    exporter.flush()
+    assert [
+        json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        ["name"] for line in open(path)
+    ] == ["first", "third"]